@@ -24,6 +24,12 @@ urlpatterns = [
     path('add/',views.add, name='add'),
     path('status/<int:task_id>/',views.status, name='status'),
     path('delete/<int:task_id>/',views.delete,name='delete'),
+    path('complete-all/',views.complete_all,name='complete_all'),
+    path('clear-completed/',views.clear_completed,name='clear_completed'),
+    path('delete-selected/',views.delete_selected,name='delete_selected'),
+    path('api/tasks/toggle/',views.api_toggle_batch,name='api_toggle_batch'),
+    path('api/tasks/<int:task_id>/toggle/',views.api_toggle,name='api_toggle'),
+    path('api/tasks/<int:task_id>/delete/',views.api_delete,name='api_delete'),
     
 ] 
 
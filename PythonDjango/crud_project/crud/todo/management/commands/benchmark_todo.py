@@ -0,0 +1,113 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from todo.models import Task
+from todo.views import PAGE_SIZE, make_cursor, task_counts, task_page
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+# Runs fn in a transaction that is rolled back, so every step sees the same tasks
+def timed_and_undone(fn):
+    with transaction.atomic():
+        elapsed = timed(fn)
+        transaction.set_rollback(True)
+    return elapsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database with --rows tasks and compares the old index counts, unpaginated "
+        "list and per-row bulk loops with the conditional aggregate, keyset pages and single-query bulk actions."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help="Number of tasks to seed.")
+        parser.add_argument('--sample', type=int, default=2000,
+                            help="Tasks the per-row loops are timed on; their time is scaled up to every matching task.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.seed(options['rows'])
+            self.run(options['rows'], options['sample'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def seed(self, rows):
+        started = time.perf_counter()
+        batch = 10000
+        for start in range(0, rows, batch):
+            Task.objects.bulk_create(
+                Task(title=f"Task {number}", is_complete=number % 3 == 0)
+                for number in range(start, min(start + batch, rows))
+            )
+        self.stdout.write(f"Seeded {rows} tasks in {time.perf_counter() - started:.1f}s.")
+
+    def report(self, name, before, after):
+        self.stdout.write(f"  {name:32} {before:>12.1f} {after:>12.1f} {before / after if after else 0:>8.0f}x")
+
+    def run(self, rows, sample):
+        self.stdout.write(f"  {'(ms)':32} {'before':>12} {'after':>12} {'speedup':>9}")
+
+        def three_counts():
+            tasks = Task.objects.all()
+            tasks.count()
+            tasks.filter(is_complete=True).count()
+            tasks.filter(is_complete=False).count()
+        self.report('counts', timed(three_counts), timed(task_counts))
+
+        def whole_list():
+            list(Task.objects.all())
+        middle = Task.objects.order_by('create_at', 'id')[rows // 2]
+        self.report('list, first page', timed(whole_list), timed(lambda: task_page(None)))
+        self.report('list, page in the middle', timed(whole_list), timed(lambda: task_page(make_cursor(middle))))
+
+        client = Client()
+        for name, params in (('first', {}), ('middle', {'after': make_cursor(middle)})):
+            elapsed = timed(lambda: client.get(reverse('index'), params))
+            self.stdout.write(f"  {'GET index, ' + name + ' page':32} {'':>12} {elapsed:>12.1f}")
+
+        # the per-row loops are timed on `sample` tasks and scaled up to all the matching ones
+        counts = task_counts()
+
+        def complete_one_by_one():
+            for task in Task.objects.filter(is_complete=False)[:sample]:
+                task.is_complete = True
+                task.save()
+        self.report(
+            'complete all',
+            timed_and_undone(complete_one_by_one) * counts['pending'] / sample,
+            timed_and_undone(lambda: Task.objects.filter(is_complete=False).update(is_complete=True)),
+        )
+
+        def clear_one_by_one():
+            for task in Task.objects.filter(is_complete=True)[:sample]:
+                task.delete()
+        self.report(
+            'clear completed',
+            timed_and_undone(clear_one_by_one) * counts['completed'] / sample,
+            timed_and_undone(lambda: Task.objects.filter(is_complete=True).delete()),
+        )
+
+        selected = [task.id for task in task_page(make_cursor(middle))[0]]
+
+        def delete_one_by_one():
+            for task_id in selected:
+                Task.objects.get(id=task_id).delete()
+        self.report(
+            f'delete {PAGE_SIZE} selected',
+            timed_and_undone(delete_one_by_one),
+            timed_and_undone(lambda: Task.objects.filter(id__in=selected).delete()),
+        )
@@ -5,7 +5,15 @@ class Task(models.Model):
     title=models.CharField(max_length=10000)
     is_complete=models.BooleanField(default=False)
     create_at=models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # the list is keyset-paginated in (create_at, id) order
+            models.Index(fields=['create_at', 'id'], name='todo_task_created_idx'),
+            # "complete all" and "clear completed" find their rows by status
+            models.Index(fields=['is_complete'], name='todo_task_complete_idx'),
+        ]
     
     
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
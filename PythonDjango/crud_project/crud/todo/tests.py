@@ -1,3 +1,108 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Task
+from .views import PAGE_SIZE
 
 # Create your tests here.
+
+
+class TaskListTests(TestCase):
+    def setUp(self):
+        # every task created at the same instant: pages must still split on the id
+        Task.objects.bulk_create(Task(title=f"Task {n}", is_complete=n % 4 == 0) for n in range(PAGE_SIZE * 2 + 5))
+        Task.objects.update(create_at=timezone.now())
+
+    def test_counts_come_from_one_query(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['total'], 105)
+        self.assertEqual(response.context['completed'], 27)
+        self.assertEqual(response.context['pending'], 78)
+
+    def test_keyset_pages_cover_every_task_once(self):
+        seen = []
+        params = {}
+        while True:
+            response = self.client.get(reverse('index'), params)
+            seen.extend(task.id for task in response.context['tasks'])
+            if not response.context['next_cursor']:
+                break
+            params = {'after': response.context['next_cursor']}
+        self.assertEqual(seen, list(Task.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_bulk_actions(self):
+        selected = list(Task.objects.filter(is_complete=False).values_list('id', flat=True)[:3])
+        with self.assertNumQueries(1):
+            self.client.post(reverse('delete_selected'), {'task_ids': selected})
+        self.assertFalse(Task.objects.filter(id__in=selected).exists())
+
+        with self.assertNumQueries(1):
+            self.client.post(reverse('complete_all'))
+        self.assertFalse(Task.objects.filter(is_complete=False).exists())
+
+        with self.assertNumQueries(1):
+            self.client.post(reverse('clear_completed'))
+        self.assertEqual(Task.objects.count(), 0)
+
+        self.assertEqual(self.client.get(reverse('complete_all')).status_code, 405)
+
+    def test_delete_selected_skips_values_that_are_not_ids(self):
+        task = Task.objects.first()
+        selected = [str(task.id), '²', '1' * 25, '0', '-3', ' 4', 'x']
+        response = self.client.post(reverse('delete_selected'), {'task_ids': selected})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Task.objects.filter(id=task.id).exists())
+        self.assertEqual(Task.objects.count(), PAGE_SIZE * 2 + 4)
+
+
+class TaskApiTests(TestCase):
+    def setUp(self):
+        self.pending = Task.objects.create(title="Pending")
+        self.done = Task.objects.create(title="Done", is_complete=True)
+
+    def test_toggle_is_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('api_toggle', args=[self.pending.id]))
+        writes = [query['sql'] for query in queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('SET "is_complete" = NOT "todo_task"."is_complete"', writes[0])
+        self.assertEqual(response.json(), {
+            'id': self.pending.id, 'is_complete': True, 'deltas': {'total': 0, 'completed': 1, 'pending': -1},
+        })
+        self.pending.refresh_from_db()
+        self.assertTrue(self.pending.is_complete)
+        self.assertEqual(self.client.post(reverse('api_toggle', args=[999])).status_code, 404)
+
+    def test_delete_reports_count_deltas(self):
+        response = self.client.post(reverse('api_delete', args=[self.done.id]))
+        self.assertEqual(response.json()['deltas'], {'total': -1, 'completed': -1, 'pending': 0})
+        self.assertFalse(Task.objects.filter(id=self.done.id).exists())
+        self.assertEqual(self.client.post(reverse('api_delete', args=[self.done.id])).status_code, 404)
+
+    def test_ids_past_the_primary_key_range_are_not_found(self):
+        for name in ('api_toggle', 'api_delete'):
+            for task_id in (0, 2 ** 63, 10 ** 25):
+                response = self.client.post(reverse(name, args=[task_id]))
+                self.assertEqual(response.status_code, 404, (name, task_id))
+
+    def test_batched_toggles(self):
+        body = {'ids': [self.pending.id, self.done.id, self.done.id, 999]}
+        response = self.client.post(reverse('api_toggle_batch'), body, content_type='application/json')
+        self.assertEqual(response.json(), {
+            'tasks': {str(self.pending.id): True, str(self.done.id): True},
+            'missing': [999],
+            'deltas': {'total': 0, 'completed': 1, 'pending': -1},
+        })
+        response = self.client.post(reverse('api_toggle_batch'), {'ids': 'x'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_batched_toggle_rejects_non_ids(self):
+        for ids in ([True], [self.pending.id, False], [0], [-1], [2 ** 63], [1.0], {'1': 1}):
+            response = self.client.post(reverse('api_toggle_batch'), {'ids': ids}, content_type='application/json')
+            self.assertEqual(response.status_code, 400, ids)
+        self.pending.refresh_from_db()
+        self.assertFalse(self.pending.is_complete)
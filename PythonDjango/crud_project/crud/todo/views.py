@@ -1,19 +1,66 @@
+import json
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.http import JsonResponse
 from django.shortcuts import render,redirect
+from django.views.decorators.http import require_POST
 #import the model
 from .models import Task
 # Create your views here.
 
+PAGE_SIZE = 50
+# most tasks one batched toggle request may name
+MAX_BATCH = 500
+# largest id a 64-bit primary key holds; bigger numbers overflow the driver
+MAX_ID = 2 ** 63 - 1
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+# The position after a task in the list, as "<microseconds since epoch>.<id>"
+def make_cursor(task):
+    return f"{(task.create_at - EPOCH) // timedelta(microseconds=1)}.{task.id}"
+
+
+def parse_cursor(cursor):
+    try:
+        micros, task_id = map(int, cursor.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    return EPOCH + timedelta(microseconds=micros), task_id
+
+
+# One page of tasks in (create_at, id) order, starting after the cursor.
+# The range on create_at is read straight from todo_task_created_idx, so a
+# page deep in the list costs the same as the first one.
+def task_page(cursor):
+    tasks = Task.objects.order_by('create_at', 'id')
+    after = parse_cursor(cursor)
+    if after is not None:
+        create_at, task_id = after
+        tasks = tasks.filter(create_at__gte=create_at).exclude(create_at=create_at, id__lte=task_id)
+    tasks = list(tasks[:PAGE_SIZE + 1])
+    next_cursor = make_cursor(tasks[PAGE_SIZE - 1]) if len(tasks) > PAGE_SIZE else None
+    return tasks[:PAGE_SIZE], next_cursor
+
+
+# total, completed and pending in one pass over the table
+def task_counts():
+    counts = Task.objects.aggregate(total=Count('id'), completed=Count('id', filter=Q(is_complete=True)))
+    counts['pending'] = counts['total'] - counts['completed']
+    return counts
+
+
 def index(request):
-    tasks=Task.objects.all()
-    total=tasks.count()
-    completed=tasks.filter(is_complete =True).count()
-    pending=tasks.filter(is_complete =False).count()
+    tasks, next_cursor = task_page(request.GET.get('after'))
     
     context ={
         'tasks':tasks,
-        'total':total,
-        'completed':completed,
-        'pending':pending,
+        'next_cursor':next_cursor,
+        'first_page':'after' not in request.GET,
+        **task_counts(),
     }
     return render(request,'index.html',context)
 
@@ -33,4 +80,104 @@ def status(request, task_id):
 
 def delete(request, task_id):
     task =Task.objects.get(id=task_id).delete()
-    return redirect('index')
\ No newline at end of file
+    return redirect('index')
+
+
+# The bulk actions below are one UPDATE or DELETE each, whatever the number of tasks
+
+@require_POST
+def complete_all(request):
+    Task.objects.filter(is_complete=False).update(is_complete=True)
+    return redirect('index')
+
+@require_POST
+def clear_completed(request):
+    Task.objects.filter(is_complete=True).delete()
+    return redirect('index')
+
+# A task id from a form field, or None for anything that is not one: only
+# ASCII digits ('²'.isdigit() is true) and within the primary key range
+def parse_task_id(value):
+    if not (value.isascii() and value.isdecimal()):
+        return None
+    task_id = int(value)
+    return task_id if 1 <= task_id <= MAX_ID else None
+
+@require_POST
+def delete_selected(request):
+    task_ids = [task_id for task_id in map(parse_task_id, request.POST.getlist('task_ids')) if task_id is not None]
+    if task_ids:
+        Task.objects.filter(id__in=task_ids).delete()
+    return redirect('index')
+
+
+# The JSON endpoints below are used by the page to update a row and the
+# counts in place instead of reloading the list. Each answers with the new
+# state and how the total/completed/pending counts changed.
+
+def count_deltas(completed, pending, total=0):
+    return {'total': total, 'completed': completed, 'pending': pending}
+
+
+# Flips the task with one UPDATE ... SET is_complete = NOT is_complete, so two
+# clicks racing each other both count, then reads the result in the same
+# transaction.
+@require_POST
+def api_toggle(request, task_id):
+    if not 1 <= task_id <= MAX_ID:
+        return JsonResponse({'error': 'Task not found.'}, status=404)
+    with transaction.atomic():
+        if not Task.objects.filter(id=task_id).update(is_complete=~F('is_complete')):
+            return JsonResponse({'error': 'Task not found.'}, status=404)
+        is_complete = Task.objects.filter(id=task_id).values_list('is_complete', flat=True).get()
+    change = 1 if is_complete else -1
+    return JsonResponse({
+        'id': task_id,
+        'is_complete': is_complete,
+        'deltas': count_deltas(completed=change, pending=-change),
+    })
+
+
+@require_POST
+def api_delete(request, task_id):
+    if not 1 <= task_id <= MAX_ID:
+        return JsonResponse({'error': 'Task not found.'}, status=404)
+    with transaction.atomic():
+        is_complete = Task.objects.select_for_update().filter(id=task_id).values_list('is_complete', flat=True).first()
+        if is_complete is None:
+            return JsonResponse({'error': 'Task not found.'}, status=404)
+        Task.objects.filter(id=task_id).delete()
+    return JsonResponse({
+        'id': task_id,
+        'deleted': True,
+        'deltas': count_deltas(completed=-1 if is_complete else 0, pending=0 if is_complete else -1, total=-1),
+    })
+
+
+# Many toggles in one request: {"ids": [3, 5, 5, 8]}. A task named twice is
+# flipped twice, i.e. left as it was. All of them are flipped with one UPDATE.
+@require_POST
+def api_toggle_batch(request):
+    try:
+        ids = json.loads(request.body)['ids']
+        # bool is a subclass of int, true and false are not ids
+        if not isinstance(ids, list) or not all(
+            isinstance(task_id, int) and not isinstance(task_id, bool) and 1 <= task_id <= MAX_ID
+            for task_id in ids
+        ):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON body like {"ids": [1, 2, 3]}.'}, status=400)
+    if len(ids) > MAX_BATCH:
+        return JsonResponse({'error': f'At most {MAX_BATCH} tasks per request.'}, status=400)
+
+    flipped = [task_id for task_id, times in Counter(ids).items() if times % 2]
+    with transaction.atomic():
+        Task.objects.filter(id__in=flipped).update(is_complete=~F('is_complete'))
+        states = dict(Task.objects.filter(id__in=set(ids)).values_list('id', 'is_complete'))
+    completed = sum(1 if states[task_id] else -1 for task_id in flipped if task_id in states)
+    return JsonResponse({
+        'tasks': {str(task_id): is_complete for task_id, is_complete in states.items()},
+        'missing': sorted(set(ids) - states.keys()),
+        'deltas': count_deltas(completed=completed, pending=-completed),
+    })
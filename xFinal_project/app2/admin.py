@@ -1,52 +1,184 @@
-from django.contrib.auth.forms import UserCreationForm
-#import all models
-from .models import *
-from .models import UserProfile
-
-
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.contrib.admin.views.main import ALL_VAR, IS_POPUP_VAR, ORDER_VAR, PAGE_VAR, SEARCH_VAR, TO_FIELD_VAR
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Max
+from django.utils.functional import cached_property
+from django.utils.timezone import now
 from .models import UserProfile, Farmer, ChickStock, ChickRequest, Sale, FeedStock
+from .receivables import refresh_balances
+from .concurrency import VersionedModel
+from .sites import get_sites, site_database
+from . import live
 
 class UserProfileInline(admin.StackedInline):
     model = UserProfile
     can_delete = False
     verbose_name_plural = 'Profile'
 
+#BaseUserAdmin hashes the password set from the add form
 class UserAdmin(BaseUserAdmin):
     inlines = (UserProfileInline,)
-    
+    list_select_related = ('userprofile',)
+
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
-admin.site.register(Farmer)
-admin.site.register(ChickStock)
-admin.site.register(ChickRequest)
-admin.site.register(Sale)
-admin.site.register(FeedStock)
 
 
-#auto hashing password
-from django.contrib.auth.admin import UserAdmin as DefaultUserAdmin
-from .models import UserProfile
+# Unfiltered changelists read an estimate instead of COUNT(*) over the whole
+# table: the planner's row estimate on PostgreSQL when the database holds a
+# single site, else the highest id among the changelist's (site-scoped) rows.
+# The default managers always add a WHERE (tombstones, site), so whether the
+# list is filtered is decided by the admin from the request, not the SQL.
+class EstimatedCountPaginator(Paginator):
+    def __init__(self, *args, estimate=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.estimate = estimate
 
-class UserProfileAdmin(admin.ModelAdmin):
-    def save_model(self,request,obj, form,change):
-        if UserProfile.objects.filter(user=obj.user).exists():
-            existing_profile =UserProfile.objects.get(user=obj.user)
-            pass
-        else:
-            super().save_model(request,obj,form,change)
+    @cached_property
+    def count(self):
+        if not self.estimate:
+            return super().count
+        # the database the router picked for the changelist's queryset
+        alias = self.object_list.db
+        connection = connections[alias]
+        shared = sum(1 for site in get_sites() if site_database(site) == alias) > 1
+        if connection.vendor == 'postgresql' and not shared:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                               [self.object_list.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+        return self.object_list.aggregate(last=Max('pk'))['last'] or 0
 
 
-class UserProfileInline(admin.StackedInline):
-    model = UserProfile
-    can_delete = False
-    verbose_name_plural = 'Profile'
-    
+class ScalableModelAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
 
-class UserAdmin(admin.ModelAdmin):
-    inlines = (UserProfileInline,)
+    # Parameters that only page, sort or frame the changelist; any other key,
+    # or a non-empty search, narrows the rows and needs a real count.
+    unfiltered_params = (PAGE_VAR, ORDER_VAR, ALL_VAR, IS_POPUP_VAR, TO_FIELD_VAR)
 
-admin.site.unregister(User)
-admin.site.register(User, UserAdmin)
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        params = request.GET
+        estimate = (
+            not params.get(SEARCH_VAR, '').strip()
+            and all(key in self.unfiltered_params or key == SEARCH_VAR for key in params)
+        )
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, estimate=estimate)
+
+    # Bulk actions run one UPDATE; updated_at is set by hand because
+    # queryset.update() skips auto_now, and the version is bumped so open
+    # edit forms of these rows see the change as a conflict. No post_save is
+    # sent, so subclasses publish what the signals would have. None of the
+    # actions is a notified event (approvals and new sales go through the
+    # staff views), so nothing is queued in the notification outbox.
+    def update_selected(self, request, queryset, message, **fields):
+        if issubclass(queryset.model, VersionedModel):
+            fields['version'] = F('version') + 1
+        updated = queryset.update(updated_at=now(), **fields)
+        self.message_user(request, message % updated, messages.SUCCESS)
+
+
+@admin.register(Farmer)
+class FarmerAdmin(ScalableModelAdmin):
+    list_display = ('farmer_name', 'farmer_nin', 'phone_number', 'email', 'farmer_type', 'registration_date')
+    list_filter = ('farmer_type', 'gender')
+    # exact matches on the unique columns and a prefix match on the indexed name
+    search_fields = ('=farmer_nin', '=email', '^farmer_name')
+    date_hierarchy = 'registration_date'
+    ordering = ('farmer_name',)
+
+
+@admin.register(ChickStock)
+class ChickStockAdmin(ScalableModelAdmin):
+    list_display = ('batch_number', 'chick_type', 'chick_breed', 'chick_quantity', 'chick_price', 'date_added')
+    list_filter = ('chick_type', 'chick_breed')
+    search_fields = ('=batch_number',)
+    date_hierarchy = 'date_added'
+
+
+@admin.register(ChickRequest)
+class ChickRequestAdmin(ScalableModelAdmin):
+    list_display = ('id', 'farmer', 'farmer_type', 'chick_type', 'chick_breed', 'quantity_requested',
+                    'request_status', 'payment_status', 'request_date')
+    list_filter = ('request_status', 'payment_status', 'chick_type', 'chick_breed')
+    list_select_related = ('farmer',)
+    autocomplete_fields = ('farmer',)
+    search_fields = ('=farmer__farmer_nin',)
+    date_hierarchy = 'request_date'
+    actions = ('mark_rejected', 'mark_delivered', 'mark_paid')
+
+    # the live dashboards get the event live_request_saved would have sent
+    # for every changed request
+    def update_selected(self, request, queryset, message, **fields):
+        changed = list(queryset)
+        super().update_selected(request, queryset.filter(pk__in=[row.pk for row in changed]), message, **fields)
+        for chick_request in changed:
+            for name, value in fields.items():
+                setattr(chick_request, name, value)
+            delta = live.pending_delta(chick_request)
+            live.publish('requests', chick_request.site,
+                         lambda chick_request=chick_request, delta=delta: live.request_payload(
+                             chick_request, pending_delta=delta),
+                         queryset.db)
+
+    # approving deducts stock, so it stays in manage_requests
+    @admin.action(description="Reject selected pending requests")
+    def mark_rejected(self, request, queryset):
+        self.update_selected(request, queryset.filter(request_status='Pending'),
+                             "%d request(s) rejected.", request_status='Rejected')
+
+    @admin.action(description="Mark selected requests as delivered")
+    def mark_delivered(self, request, queryset):
+        self.update_selected(request, queryset, "%d request(s) marked delivered.",
+                             delivered='YES', delivery_date=now().date())
+
+    @admin.action(description="Mark selected requests as paid")
+    def mark_paid(self, request, queryset):
+        self.update_selected(request, queryset, "%d request(s) marked paid.", payment_status='paid')
+
+
+@admin.register(Sale)
+class SaleAdmin(ScalableModelAdmin):
+    list_display = ('id', 'customer', 'quantity_sold', 'amount', 'payment_status', 'payment_method',
+                    'feed_payment_due_date', 'sale_date')
+    list_filter = ('payment_status', 'payment_method')
+    list_select_related = ('customer',)
+    autocomplete_fields = ('customer',)
+    raw_id_fields = ('chick_request',)
+    search_fields = ('=customer__farmer_nin',)
+    date_hierarchy = 'sale_date'
+    actions = ('mark_paid', 'mark_partially_paid', 'mark_cancelled')
+
+    # queryset.update() sends no post_save, so refresh the balances here
+    def update_selected(self, request, queryset, message, **fields):
+        farmer_ids = set(queryset.values_list('customer_id', flat=True))
+        super().update_selected(request, queryset, message, **fields)
+        refresh_balances(farmer_ids)
+
+    @admin.action(description="Mark selected sales as paid")
+    def mark_paid(self, request, queryset):
+        self.update_selected(request, queryset, "%d sale(s) marked paid.", payment_status='paid')
+
+    @admin.action(description="Mark selected sales as partially paid")
+    def mark_partially_paid(self, request, queryset):
+        self.update_selected(request, queryset, "%d sale(s) marked partially paid.",
+                             payment_status='partially_paid')
+
+    @admin.action(description="Mark selected sales as cancelled")
+    def mark_cancelled(self, request, queryset):
+        self.update_selected(request, queryset, "%d sale(s) cancelled.", payment_status='cancelled')
+
+
+@admin.register(FeedStock)
+class FeedStockAdmin(ScalableModelAdmin):
+    list_display = ('name', 'feed_type', 'feed_brand', 'quantity', 'unit_price', 'supplier', 'date_added')
+    list_filter = ('feed_type', 'feed_brand')
+    search_fields = ('=supplier_contact', '^name')
+    date_hierarchy = 'date_added'
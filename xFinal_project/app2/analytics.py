@@ -0,0 +1,307 @@
+import heapq
+import json
+import os
+import shutil
+from collections import Counter, namedtuple
+from contextlib import ExitStack
+from datetime import datetime, timezone as dt_timezone
+from operator import itemgetter
+
+import numpy as np
+from django.db import models, transaction
+from django.utils.timezone import localtime, make_aware, now
+
+from .models import ArchivedChickRequest, ArchivedSale, ChickRequest, Sale
+from .sites import get_sites, site_database
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional, without it the export falls back to .npz
+    pyarrow = None
+
+MANIFEST = '_manifest.json'
+UNKNOWN = 'unknown'
+
+Column = namedtuple('Column', 'name lookup field kind nullable')
+Dataset = namedtuple('Dataset', 'sources date_lookup partition_lookup columns')
+
+
+def resolve_field(model, lookup):
+    *relations, name = lookup.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def column_kind(field):
+    if field.choices:
+        return 'category'
+    if isinstance(field, models.BooleanField):
+        return 'bool'
+    if isinstance(field, models.DateTimeField):
+        return 'timestamp'
+    if isinstance(field, models.DateField):
+        return 'date'
+    if isinstance(field, models.DecimalField):
+        return 'decimal'
+    if isinstance(field, (models.IntegerField, models.AutoField, models.ForeignKey)):
+        return 'int'
+    return 'string'
+
+
+def make_columns(model, lookups):
+    columns = []
+    for lookup in lookups:
+        field = resolve_field(model, lookup)
+        # a value through a nullable relation can be missing even if its field is not
+        nullable = field.null or '__' in lookup
+        columns.append(Column(lookup.replace('__', '_'), lookup, field, column_kind(field), nullable))
+    # which table the row was read from; closed rows move to the archive tables
+    columns.append(Column('archived', None, models.BooleanField(), 'bool', False))
+    return columns
+
+
+# The hot table and its archive are exported together, so a month reads the
+# same before and after archive_closed_records has run.
+DATASETS = {
+    'requests': Dataset(
+        sources=((ChickRequest, False), (ArchivedChickRequest, True)),
+        date_lookup='request_date',
+        partition_lookup='chick_type',
+        columns=make_columns(ChickRequest, [
+            'id', 'farmer_id', 'farmer_type', 'chick_type', 'chick_breed', 'quantity_requested', 'request_date',
+            'chick_period', 'took_feeds', 'request_status', 'delivered', 'delivery_date', 'payment_status',
+            'approval_date', 'site',
+        ]),
+    ),
+    'sales': Dataset(
+        sources=((Sale, False), (ArchivedSale, True)),
+        date_lookup='sale_date',
+        partition_lookup='chick_request__chick_type',
+        columns=make_columns(Sale, [
+            'id', 'customer_id', 'chick_request_id', 'chick_request__chick_type', 'sale_date', 'quantity_sold',
+            'amount', 'feed_bags_eligible', 'feed_payment_due_date', 'payment_status', 'payment_method', 'site',
+        ]),
+    ),
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def default_format():
+    return 'parquet' if pyarrow is not None else 'npz'
+
+
+def month_of(value):
+    return localtime(value).strftime('%Y-%m')
+
+
+def month_start(month):
+    year, month = map(int, month.split('-'))
+    return make_aware(datetime(year, month, 1))
+
+
+def next_month_start(month):
+    year, month = map(int, month.split('-'))
+    return make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+
+
+# only whole months are exported, so a partition never has to be rewritten
+def current_month_start():
+    return month_start(month_of(now()))
+
+
+# Choice values in declaration order, so a code means the same value in every
+# file; values outside the choices are appended after them.
+def encode_categories(values, field):
+    categories = [value for value, _ in field.choices]
+    index = {value: code for code, value in enumerate(categories)}
+    codes = []
+    for value in values:
+        if value is None:
+            codes.append(-1)
+            continue
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(categories)
+            categories.append(value)
+        codes.append(code)
+    dtype = np.int8 if len(categories) < 128 else np.int32
+    return np.array(codes, dtype=dtype), categories
+
+
+def utc_naive(value):
+    return value.astimezone(dt_timezone.utc).replace(tzinfo=None) if value is not None else None
+
+
+def parquet_array(column, values):
+    if column.kind == 'category':
+        codes, categories = encode_categories(values, column.field)
+        return pyarrow.DictionaryArray.from_arrays(
+            pyarrow.array(codes, mask=codes < 0), pyarrow.array(categories, type=pyarrow.string()),
+        )
+    if column.kind == 'decimal':
+        return pyarrow.array(values, type=pyarrow.decimal128(column.field.max_digits, column.field.decimal_places))
+    types = {
+        'bool': pyarrow.bool_(),
+        'timestamp': pyarrow.timestamp('us', tz='UTC'),
+        'date': pyarrow.date32(),
+        'int': pyarrow.int64(),
+        'string': pyarrow.string(),
+    }
+    return pyarrow.array(values, type=types[column.kind])
+
+
+def write_parquet(path, columns, values):
+    table = pyarrow.table({column.name: parquet_array(column, data) for column, data in zip(columns, values)})
+    pyarrow.parquet.write_table(table, path)
+
+
+# The same columns as numpy arrays. Categories are int codes plus a
+# `<name>__categories` array, nullable ints get a `<name>__valid` mask,
+# timestamps are UTC and decimals float64.
+def write_npz(path, columns, values):
+    arrays = {}
+    for column, data in zip(columns, values):
+        if column.kind == 'category':
+            arrays[column.name], categories = encode_categories(data, column.field)
+            arrays[f"{column.name}__categories"] = np.array(categories, dtype=str)
+        elif column.kind == 'timestamp':
+            arrays[column.name] = np.array([utc_naive(value) for value in data], dtype='datetime64[us]')
+        elif column.kind == 'date':
+            arrays[column.name] = np.array(data, dtype='datetime64[D]')
+        elif column.kind == 'decimal':
+            arrays[column.name] = np.array([np.nan if value is None else float(value) for value in data])
+        elif column.kind == 'int':
+            arrays[column.name] = np.array([0 if value is None else value for value in data], dtype=np.int64)
+            if column.nullable:
+                arrays[f"{column.name}__valid"] = np.array([value is not None for value in data])
+        elif column.kind == 'bool':
+            arrays[column.name] = np.array(data, dtype=bool)
+        else:
+            arrays[column.name] = np.array(['' if value is None else value for value in data], dtype=str)
+    np.savez_compressed(path, **arrays)
+
+
+WRITERS = {'parquet': write_parquet, 'npz': write_npz}
+
+
+# Rows of a dataset in date order from every database holding a site: each
+# source is read `chunk_size` rows at a time and the sorted streams merged.
+# Each database is read in one transaction, so a row being archived meanwhile
+# is seen in exactly one of the two tables.
+def dataset_rows(dataset, start, until, chunk_size):
+    lookups = [column.lookup for column in dataset.columns if column.lookup is not None]
+    date_position = lookups.index(dataset.date_lookup)
+    filters = {f"{dataset.date_lookup}__lt": until}
+    if start is not None:
+        filters[f"{dataset.date_lookup}__gte"] = start
+    with ExitStack() as stack:
+        streams = []
+        for database in dict.fromkeys(site_database(site) for site in get_sites()):
+            stack.enter_context(transaction.atomic(using=database))
+            for model, archived in dataset.sources:
+                queryset = model._base_manager.using(database).filter(**filters).order_by(dataset.date_lookup, 'pk')
+                rows = queryset.values_list(*lookups).iterator(chunk_size=chunk_size)
+                streams.append(map(lambda row, archived=archived: row + (archived,), rows))
+        yield from heapq.merge(*streams, key=itemgetter(date_position))
+
+
+# Buffers rows per (month, chick type) partition and writes a part file when
+# a buffer reaches `rows_per_file` or the month is over: rows arrive in date
+# order, so at most one month is held, in bounded buffers.
+class PartitionWriter:
+    def __init__(self, directory, dataset, file_format, rows_per_file):
+        self.directory = directory
+        self.dataset = dataset
+        self.file_format = file_format
+        self.rows_per_file = rows_per_file
+        names = [column.lookup for column in dataset.columns]
+        self.date_position = names.index(dataset.date_lookup)
+        self.partition_position = names.index(dataset.partition_lookup)
+        self.buffers = {}
+        self.parts = Counter()
+        self.months = []
+        self.rows = 0
+
+    def add(self, row):
+        month = month_of(row[self.date_position])
+        if not self.months or self.months[-1] != month:
+            self.flush_all()
+            self.months.append(month)
+            # left behind by an interrupted run
+            shutil.rmtree(os.path.join(self.directory, f"month={month}"), ignore_errors=True)
+        key = (month, row[self.partition_position] or UNKNOWN)
+        buffer = self.buffers.setdefault(key, [])
+        buffer.append(row)
+        if len(buffer) >= self.rows_per_file:
+            self.flush(key)
+
+    def flush(self, key):
+        rows = self.buffers.pop(key)
+        month, partition = key
+        directory = os.path.join(self.directory, f"month={month}", f"chick_type={partition}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{self.parts[key]:05d}.{self.file_format}")
+        self.parts[key] += 1
+        WRITERS[self.file_format](path, self.dataset.columns, list(zip(*rows)))
+        self.rows += len(rows)
+
+    def flush_all(self):
+        for key in list(self.buffers):
+            self.flush(key)
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# Writes <path>/<name>/month=YYYY-MM/chick_type=<type>/part-NNNNN.<format>
+# for every whole month before `until` (default: the current month), and
+# _manifest.json listing the months. A full export replaces the dataset;
+# an incremental one only adds the months after the last one exported.
+def export_dataset(path, name, file_format=None, incremental=False, until=None, chunk_size=2000,
+                   rows_per_file=100000):
+    dataset = DATASETS[name]
+    directory = os.path.join(path, name)
+    until = until or current_month_start()
+    manifest = read_manifest(directory)
+    file_format = file_format or (manifest['format'] if manifest else default_format())
+    if file_format == 'parquet' and pyarrow is None:
+        raise ExportError("Parquet export needs the pyarrow package; use the npz format instead.")
+    start = None
+    if incremental and manifest is not None:
+        if manifest['format'] != file_format:
+            raise ExportError(f"{directory} holds {manifest['format']} files, not {file_format}.")
+        if manifest['months']:
+            start = next_month_start(manifest['months'][-1])
+    else:
+        if manifest is not None:
+            shutil.rmtree(directory)
+        elif os.path.isdir(directory) and os.listdir(directory):
+            raise ExportError(f"{directory} is not empty and was not written by this export.")
+        manifest = {'dataset': name, 'format': file_format, 'months': [], 'rows': 0}
+    os.makedirs(directory, exist_ok=True)
+
+    writer = PartitionWriter(directory, dataset, file_format, rows_per_file)
+    for row in dataset_rows(dataset, start, until, chunk_size):
+        writer.add(row)
+    writer.flush_all()
+
+    manifest.update(
+        columns=[{'name': column.name, 'kind': column.kind} for column in dataset.columns],
+        months=sorted(set(manifest['months']).union(writer.months)),
+        rows=manifest['rows'] + writer.rows,
+        through=until.isoformat(),
+        exported_at=now().isoformat(),
+    )
+    with open(os.path.join(directory, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return writer.months, writer.rows
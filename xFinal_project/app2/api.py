@@ -0,0 +1,188 @@
+import base64
+import json
+import zlib
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET, require_POST
+
+from .models import Farmer, ChickRequest, Sale, ChickStock, FeedStock
+from .sync import SyncError, apply_batch
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+# cap on an uploaded body after gzip decompression
+MAX_BODY_BYTES = 20 * 1024 * 1024
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# resource name -> model and the columns a client may ask for with ?fields=
+RESOURCES = {
+    'farmers': (Farmer, (
+        'id', 'farmer_name', 'date_of_birth', 'gender', 'farmer_nin', 'phone_number', 'recommender_name',
+        'recommender_nin', 'address', 'email', 'recommender_tel', 'farmer_type', 'registration_date',
+        'updated_at',
+    )),
+    'chick-requests': (ChickRequest, (
+        'id', 'farmer_id', 'farmer_type', 'chick_type', 'chick_breed', 'quantity_requested', 'request_date',
+        'chick_period', 'took_feeds', 'request_status', 'delivered', 'delivery_date', 'payment_status',
+        'approval_date', 'updated_at',
+    )),
+    'sales': (Sale, (
+        'id', 'customer_id', 'chick_request_id', 'sale_date', 'quantity_sold', 'amount', 'feed_bags_eligible',
+        'feed_payment_due_date', 'payment_status', 'payment_method', 'notes', 'updated_at',
+    )),
+    'chick-stock': (ChickStock, (
+        'id', 'batch_number', 'chick_type', 'chick_breed', 'chick_price', 'chick_quantity', 'date_added',
+        'registered_by', 'chicks_period', 'updated_at',
+    )),
+    'feed-stock': (FeedStock, (
+        'id', 'name', 'feed_type', 'feed_brand', 'quantity', 'unit_price', 'buying_price', 'selling_price',
+        'supplier', 'supplier_contact', 'date_added', 'updated_at',
+    )),
+}
+# rows of deleted farmers stay out of the listings until the purge removes them
+RESOURCE_FILTERS = {
+    'chick-requests': {'farmer__deleted_at__isnull': True},
+    'sales': {'customer__deleted_at__isnull': True},
+}
+
+
+# JSON clients get a 401/403 body instead of the login page redirect
+def api_role_required(*roles):
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return JsonResponse({'error': "Authentication required."}, status=401)
+            profile = getattr(request.user, 'userprofile', None)
+            if roles and (profile is None or profile.role not in roles):
+                return JsonResponse({'error': "Permission denied."}, status=403)
+            return view_func(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
+def read_json_body(request):
+    body = request.body
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, MAX_BODY_BYTES)
+        except zlib.error:
+            raise SyncError("Body is not valid gzip.")
+        if decompressor.unconsumed_tail:
+            raise SyncError("Decompressed body is too large.")
+    try:
+        return json.loads(body)
+    except (UnicodeDecodeError, ValueError):
+        raise SyncError("Body is not valid JSON.")
+
+
+# Offline sales reps upload their queued farmer registrations and chick
+# requests in one (optionally gzip-compressed) POST:
+#   {"farmers": [{"idempotency_key": ..., "farmer_nin": ..., ...}],
+#    "chick_requests": [{"idempotency_key": ..., "farmer_nin": ..., ...}]}
+@require_POST
+@api_role_required('sales_rep')
+def sync_batch(request):
+    try:
+        payload = read_json_body(request)
+        if not isinstance(payload, dict):
+            raise SyncError("Body must be a JSON object.")
+        results = apply_batch(payload, request.user)
+    except SyncError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    except IntegrityError:
+        # a concurrent retry of the same keys won the insert, nothing was written
+        return JsonResponse({'error': "Conflicting upload in progress, retry the batch."}, status=409)
+    summary = {status: sum(1 for entry in results if entry['status'] == status)
+               for status in ('created', 'duplicate', 'error')}
+    return JsonResponse({'summary': summary, 'results': results})
+
+
+class ApiError(Exception):
+    pass
+
+
+def encode_cursor(pk):
+    return base64.urlsafe_b64encode(str(pk).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ApiError("Invalid cursor.")
+
+
+# orjson hands dates, times and Decimals to this, so both encoders write them
+# the DjangoJSONEncoder way: milliseconds, "Z" for UTC, amounts as strings
+json_default = DjangoJSONEncoder().default
+
+
+def json_response(data, status=200):
+    if orjson is not None:
+        content = orjson.dumps(data, default=json_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    else:
+        content = json.dumps(data, cls=DjangoJSONEncoder)
+    return HttpResponse(content, status=status, content_type='application/json')
+
+
+# Read-only listing of one model, keyset-paginated on id:
+#   /api/<resource>/?fields=id,farmer_name&limit=100&cursor=<next_cursor>
+# Rows are fetched with .values() on just the projected columns and encoded
+# straight from those dicts, never through model instances. Large pages are
+# compressed by ResponseCompressionMiddleware.
+@require_GET
+@api_role_required('brooder_manager', 'sales_rep')
+def resource_list(request, resource):
+    if resource not in RESOURCES:
+        return json_response({'error': f"Unknown resource '{resource}'.", 'resources': list(RESOURCES)}, 404)
+    model, allowed_fields = RESOURCES[resource]
+    try:
+        fields = parse_fields(request.GET.get('fields'), allowed_fields)
+        limit = parse_limit(request.GET.get('limit'))
+        queryset = model.objects.filter(**RESOURCE_FILTERS.get(resource, {})).order_by('pk')
+        if request.GET.get('cursor'):
+            queryset = queryset.filter(pk__gt=decode_cursor(request.GET['cursor']))
+    except ApiError as exc:
+        return json_response({'error': str(exc)}, 400)
+
+    # one extra row tells whether there is a next page
+    rows = list(queryset.values(*fields)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['id'])
+    return json_response({'results': rows, 'next_cursor': next_cursor})
+
+
+def parse_fields(raw, allowed_fields):
+    if not raw:
+        return list(allowed_fields)
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed_fields]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}. Allowed: {', '.join(allowed_fields)}.")
+    # the cursor is built from the id, so it is always selected
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+
+def parse_limit(raw):
+    if not raw:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise ApiError("limit must be an integer.")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ApiError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+    return limit
@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .models import ArchivedChickRequest, ArchivedSale, ChickRequest, Sale
+from .receivables import refresh_balances
+from . import sites
+
+CLOSED_REQUEST_STATUSES = ('Fulfilled', 'Rejected')
+CLOSED_PAYMENT_STATUSES = ('paid', 'refunded', 'cancelled')
+
+
+# columns copied to the archive; bookkeeping such as the optimistic-lock
+# version has no meaning once a row is closed and is not archived
+def archived_columns(model, archive_model):
+    kept = {field.attname for field in archive_model._meta.concrete_fields}
+    return [field.attname for field in model._meta.concrete_fields if field.attname in kept]
+
+
+REQUEST_COLUMNS = archived_columns(ChickRequest, ArchivedChickRequest)
+SALE_COLUMNS = archived_columns(Sale, ArchivedSale)
+
+
+def archive_cutoff(older_than_days=None):
+    if older_than_days is None:
+        older_than_days = settings.ARCHIVE_AFTER_DAYS
+    return now() - timedelta(days=older_than_days)
+
+
+# A request and its sale are archived together or not at all, so a hot sale
+# never points at an archived request and the OneToOne link survives the move.
+def archivable_requests(cutoff):
+    closed_sales = Sale.objects.filter(payment_status__in=CLOSED_PAYMENT_STATUSES, sale_date__lt=cutoff)
+    return ChickRequest.objects.filter(
+        request_status__in=CLOSED_REQUEST_STATUSES, request_date__lt=cutoff,
+    ).filter(Q(sale__isnull=True) | Q(sale__in=closed_sales))
+
+
+def archivable_unlinked_sales(cutoff):
+    return Sale.objects.filter(
+        payment_status__in=CLOSED_PAYMENT_STATUSES, sale_date__lt=cutoff, chick_request__isnull=True,
+    )
+
+
+# Moves one chunk in its own transaction: copy to the archive tables, then
+# delete from the hot ones. A crash loses at most the chunk in flight, which
+# is still in the hot tables and simply picked up by the next run.
+def move_chunk(request_ids, sale_ids):
+    with sites.atomic():
+        ArchivedChickRequest.objects.bulk_create([
+            ArchivedChickRequest(**row)
+            for row in ChickRequest.objects.filter(pk__in=request_ids).values(*REQUEST_COLUMNS)
+        ])
+        sales = list(Sale.objects.filter(pk__in=sale_ids).values(*SALE_COLUMNS))
+        ArchivedSale.objects.bulk_create([ArchivedSale(**row) for row in sales])
+        # closed sales carry no balance, so the per-row post_delete signal is
+        # skipped and the customers are refreshed once for the whole chunk.
+        # Closed requests leave no pending count or dashboard row behind, so
+        # their live "deleted" events are skipped too; their sales, the only
+        # rows pointing at them, were moved just above.
+        Sale.objects.filter(pk__in=sale_ids)._raw_delete(Sale.objects.db)
+        ChickRequest.objects.filter(pk__in=request_ids)._raw_delete(ChickRequest.objects.db)
+        refresh_balances({row['customer_id'] for row in sales})
+
+
+def archive_closed_records(cutoff, chunk_size=500, progress=None):
+    moved = {'chick_requests': 0, 'sales': 0}
+    while True:
+        request_ids = list(archivable_requests(cutoff).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not request_ids:
+            break
+        sale_ids = list(Sale.objects.filter(chick_request_id__in=request_ids).values_list('pk', flat=True))
+        move_chunk(request_ids, sale_ids)
+        moved['chick_requests'] += len(request_ids)
+        moved['sales'] += len(sale_ids)
+        if progress:
+            progress(moved)
+    while True:
+        sale_ids = list(archivable_unlinked_sales(cutoff).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not sale_ids:
+            break
+        move_chunk([], sale_ids)
+        moved['sales'] += len(sale_ids)
+        if progress:
+            progress(moved)
+    return moved
+
+
+# Read path over hot and archived rows: one UNION ALL of the same columns,
+# returned as dicts so templates use them like model instances.
+REQUEST_HISTORY_FIELDS = (
+    'id', 'chick_type', 'chick_breed', 'quantity_requested', 'request_date', 'request_status',
+    'payment_status', 'delivered', 'delivery_date',
+)
+SALE_HISTORY_FIELDS = (
+    'id', 'chick_request_id', 'sale_date', 'quantity_sold', 'amount', 'feed_payment_due_date',
+    'payment_status', 'payment_method',
+)
+
+
+def request_history(farmer):
+    hot = ChickRequest.objects.filter(farmer=farmer).values(*REQUEST_HISTORY_FIELDS)
+    cold = ArchivedChickRequest.objects.filter(farmer=farmer).values(*REQUEST_HISTORY_FIELDS)
+    return hot.union(cold, all=True).order_by('-request_date')
+
+
+def sale_history(farmer):
+    hot = Sale.objects.filter(customer=farmer).values(*SALE_HISTORY_FIELDS)
+    cold = ArchivedSale.objects.filter(customer=farmer).values(*SALE_HISTORY_FIELDS)
+    return hot.union(cold, all=True).order_by('-sale_date')
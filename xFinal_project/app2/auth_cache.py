@@ -0,0 +1,104 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.functional import SimpleLazyObject
+
+_users = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_cache_size():
+    return getattr(settings, 'AUTH_USER_CACHE_SIZE', 1000)
+
+
+def get_cache_timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 300)
+
+
+def cache_key(session):
+    try:
+        return (
+            str(session[auth.SESSION_KEY]),
+            session[auth.BACKEND_SESSION_KEY],
+            session.get(auth.HASH_SESSION_KEY, ''),
+        )
+    except KeyError:
+        return None
+
+
+def version_key(user_id):
+    return 'auth_user_version:%s' % user_id
+
+
+# Every process compares its entries with this counter in the shared cache,
+# forget_user bumps it so the others drop their copies too
+def get_version(user_id):
+    return cache.get(version_key(user_id), 0)
+
+
+# The logged-in user (with their profile) for this session, from the process
+# cache when the same user id, backend and session auth hash were seen less
+# than AUTH_USER_CACHE_TIMEOUT seconds ago and the user's version in the
+# shared cache has not moved since. Saving the user or their profile (a
+# password, is_active or role change) bumps the version in every process;
+# bulk updates that skip the model signals must call forget_user themselves.
+def get_user(request):
+    key = cache_key(request.session)
+    if key is None:
+        return auth.get_user(request)
+    version = get_version(key[0])
+    with _lock:
+        entry = _users.get(key)
+        if entry is not None and entry[0] > time.monotonic() and entry[1] == version:
+            _users.move_to_end(key)
+            # every request gets its own copy, views may change request.user
+            return copy.deepcopy(entry[2])
+
+    user = auth.get_user(request)
+    if not user.is_authenticated:
+        return user
+    try:
+        user.userprofile
+    except ObjectDoesNotExist:
+        # superusers made with createsuperuser before the profile signal
+        pass
+    with _lock:
+        _users[key] = (time.monotonic() + get_cache_timeout(), version, copy.deepcopy(user))
+        _users.move_to_end(key)
+        while len(_users) > get_cache_size():
+            _users.popitem(last=False)
+    return user
+
+
+def forget_user(user_id):
+    key = version_key(user_id)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # evicted between add and incr
+            cache.set(key, 1, None)
+    user_id = str(user_id)
+    with _lock:
+        for key in [key for key in _users if key[0] == user_id]:
+            del _users[key]
+
+
+def clear():
+    with _lock:
+        _users.clear()
+
+
+# Drop-in for AuthenticationMiddleware that reads request.user through the
+# per-process cache instead of loading the User and UserProfile every request.
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
@@ -0,0 +1,316 @@
+import gzip
+import json
+import os
+import uuid
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.duration import duration_iso_string
+from django.utils.timezone import now
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+# Tables whose rows are never changed once written: an incremental backup
+# takes the rows created since the base. Every other table with an auto_now
+# column takes the rows modified since; tables with neither are copied whole.
+# queryset.update() and bulk_update() skip auto_now, so code updating those
+# tables in bulk sets the column itself (see purge.stamped). The one known
+# exception: merge_farmers repoints sync receipts to the kept farmer, which an
+# incremental restore misses; retries of those keys then answer with the
+# merged-away farmer's id.
+APPEND_ONLY_FIELDS = {
+    'app2.stockmovement': 'created_at',
+    'app2.syncreceipt': 'created_at',
+    'app2.archivedchickrequest': 'archived_at',
+    'app2.archivedsale': 'archived_at',
+}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def get_overlap():
+    # auto_now is stamped before the transaction commits, so a row saved just
+    # before the base snapshot can become visible after it; incremental
+    # backups reach back this many seconds. Rows taken twice are harmless.
+    return timedelta(seconds=getattr(settings, 'BACKUP_INCREMENTAL_OVERLAP', 300))
+
+
+# Parents before children, so the restore inserts every row after the rows it
+# points at.
+def dependency_order(models):
+    ordered = []
+    remaining = list(models)
+    while remaining:
+        for model in remaining:
+            parents = {field.related_model for field in model._meta.concrete_fields if field.is_relation}
+            if not parents.difference({model}).intersection(remaining):
+                break
+        else:
+            raise SnapshotError(f"Circular foreign keys between {', '.join(m._meta.label for m in remaining)}.")
+        remaining.remove(model)
+        ordered.append(model)
+    return ordered
+
+
+# Every app2 table plus the tables they point at outside the app (the users),
+# so a snapshot restores into an empty database.
+def backup_models():
+    models = list(apps.get_app_config('app2').get_models(include_auto_created=True))
+    pending = list(models)
+    while pending:
+        for field in pending.pop()._meta.concrete_fields:
+            if field.is_relation and field.related_model not in models:
+                models.append(field.related_model)
+                pending.append(field.related_model)
+    return dependency_order(models)
+
+
+def modified_field(model):
+    for field in model._meta.concrete_fields:
+        if getattr(field, 'auto_now', False):
+            return field.attname
+    return APPEND_ONLY_FIELDS.get(model._meta.label_lower)
+
+
+def encode(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, timedelta):
+        return duration_iso_string(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} values cannot be written to a snapshot.")
+
+
+def dumps(row):
+    return json.dumps(row, default=encode, separators=(',', ':'))
+
+
+def read_lines(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as lines:
+        for line in lines:
+            yield json.loads(line)
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise SnapshotError(f"{path} has no {MANIFEST}; it is not a snapshot or its backup did not finish.")
+    if manifest.get('format') != FORMAT_VERSION:
+        raise SnapshotError(f"{path} is in snapshot format {manifest.get('format')}, expected {FORMAT_VERSION}.")
+    return manifest
+
+
+# Streams one table to <label>.jsonl.gz: one JSON array per row, columns as
+# listed in the manifest, read in pk order `chunk_size` rows at a time. In an
+# incremental backup every current pk also goes to <label>.keys.gz so the
+# restore can drop the rows deleted since the base.
+def dump_table(path, model, database, since, chunk_size, compresslevel):
+    label = model._meta.label_lower
+    columns = [field.attname for field in model._meta.concrete_fields]
+    queryset = model._base_manager.using(database).order_by('pk')
+    entry = {'model': label, 'file': f"{label}.jsonl.gz", 'columns': columns, 'keys': None}
+    field = modified_field(model) if since is not None else None
+    if field is not None:
+        entry['keys'] = f"{label}.keys.gz"
+        with gzip.open(os.path.join(path, entry['keys']), 'wt', compresslevel=compresslevel, encoding='utf-8') as out:
+            for pk in queryset.values_list('pk', flat=True).iterator(chunk_size=chunk_size):
+                out.write(f"{dumps(pk)}\n")
+        queryset = queryset.filter(**{f"{field}__gte": since})
+    rows = 0
+    with gzip.open(os.path.join(path, entry['file']), 'wt', compresslevel=compresslevel, encoding='utf-8') as out:
+        for row in queryset.values_list(*columns).iterator(chunk_size=chunk_size):
+            out.write(f"{dumps(row)}\n")
+            rows += 1
+    entry['rows'] = rows
+    return entry
+
+
+def journal_mode(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        return cursor.fetchone()[0].lower()
+
+
+# Writes a snapshot of `database` into the empty directory `path`. All tables
+# are read in one transaction, so they agree with each other exactly as at
+# one moment, while writers carry on. On SQLite that needs WAL mode (set on
+# every connection by app2.signals); with a rollback journal the long read
+# would block every writer until the backup ends, so it is refused. With `base` (the manifest of an earlier
+# snapshot) only rows changed since that snapshot are written. The manifest
+# is written last; a directory without one is an unfinished backup.
+def write_snapshot(path, database=DEFAULT_DB_ALIAS, base=None, chunk_size=2000, compresslevel=1, progress=None):
+    os.makedirs(path, exist_ok=True)
+    if os.listdir(path):
+        raise SnapshotError(f"{path} is not empty.")
+    connection = connections[database]
+    manifest = {'format': FORMAT_VERSION, 'id': uuid.uuid4().hex, 'database': database, 'base': None, 'since': None}
+    since = None
+    if base is not None:
+        since = parse_datetime(base['started_at']) - get_overlap()
+        manifest.update(base=base['id'], since=since.isoformat())
+    if connection.vendor == 'sqlite' and journal_mode(connection) not in ('wal', 'memory'):
+        raise SnapshotError(f"SQLite database {database!r} is not in WAL mode; the backup would block all writes.")
+    tables = []
+    with transaction.atomic(using=database):
+        if connection.vendor == 'postgresql':
+            # SQLite, and MySQL's default REPEATABLE READ, already read one
+            # snapshot from the first query of the transaction
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        manifest['started_at'] = now().isoformat()
+        for model in backup_models():
+            entry = dump_table(path, model, database, since, chunk_size, compresslevel)
+            tables.append(entry)
+            if progress:
+                progress(entry)
+    manifest['finished_at'] = now().isoformat()
+    manifest['tables'] = tables
+    with open(os.path.join(path, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def delete_rows(model, pks, database):
+    model._base_manager.using(database).filter(pk__in=pks)._raw_delete(database)
+
+
+# pks of the rows in the table but not in the (pk ordered) keys file
+def removed_keys(model, keys_path, database, chunk_size):
+    kept = read_lines(keys_path)
+    key = next(kept, None)
+    removed = []
+    for pk in model._base_manager.using(database).order_by('pk').values_list('pk', flat=True).iterator(chunk_size):
+        while key is not None and key < pk:
+            key = next(kept, None)
+        if pk != key:
+            removed.append(pk)
+    return removed
+
+
+# Values read back from JSON that the database driver takes as they are;
+# dates, decimals, JSON and the like go through the field's own conversion.
+PLAIN_TYPES = {
+    'AutoField', 'BigAutoField', 'SmallAutoField', 'IntegerField', 'BigIntegerField', 'SmallIntegerField',
+    'PositiveIntegerField', 'PositiveBigIntegerField', 'PositiveSmallIntegerField', 'CharField', 'TextField',
+    'BooleanField', 'FloatField', 'ForeignKey', 'OneToOneField',
+}
+
+
+def row_reader(model, columns, connection):
+    fields = model._meta.concrete_fields
+    attnames = [field.attname for field in fields]
+    unknown = set(columns).difference(attnames)
+    if unknown:
+        raise SnapshotError(f"{model._meta.label_lower} no longer has the column(s) {', '.join(sorted(unknown))}.")
+    positions = [columns.index(attname) if attname in columns else None for attname in attnames]
+    converters = [
+        None if field.get_internal_type() in PLAIN_TYPES
+        else lambda value, field=field: field.get_db_prep_save(value, connection)
+        for field in fields
+    ]
+
+    def read(row):
+        values = []
+        for field, position, convert in zip(fields, positions, converters):
+            # columns added since the backup take their defaults
+            value = row[position] if position is not None else field.get_default()
+            values.append(value if convert is None else convert(value))
+        return values
+    return read
+
+
+# Inserts one chunk of snapshot rows with a single executemany. Bypassing
+# the ORM keeps auto_now/auto_now_add at the snapshot's values (like
+# loaddata's raw saves) and sends no signals: the ledger, balances and live
+# dashboards are restored as they were, not recomputed.
+def insert_rows(model, rows, connection):
+    quote = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def load_table(path, model, entry, database, chunk_size):
+    connection = connections[database]
+    read = row_reader(model, entry['columns'], connection)
+    pk_position = model._meta.concrete_fields.index(model._meta.pk)
+    chunk = []
+    for row in read_lines(os.path.join(path, entry['file'])):
+        chunk.append(read(row))
+        if len(chunk) >= chunk_size:
+            load_chunk(model, chunk, entry, connection, pk_position)
+            chunk = []
+    if chunk:
+        load_chunk(model, chunk, entry, connection, pk_position)
+
+
+def load_chunk(model, rows, entry, connection, pk_position):
+    if entry['keys'] is not None:
+        # rows changed since the base replace the restored ones
+        delete_rows(model, [row[pk_position] for row in rows], connection.alias)
+    insert_rows(model, rows, connection)
+
+
+def apply_snapshot(path, manifest, database, chunk_size, progress=None):
+    tables = []
+    for entry in manifest['tables']:
+        try:
+            tables.append((apps.get_model(entry['model']), entry))
+        except LookupError:
+            raise SnapshotError(f"{path}: unknown model {entry['model']}.")
+    # children first: empty the tables (incremental: drop the deleted rows)
+    for model, entry in reversed(tables):
+        if entry['keys'] is None:
+            model._base_manager.using(database).all()._raw_delete(database)
+        else:
+            removed = removed_keys(model, os.path.join(path, entry['keys']), database, chunk_size)
+            for start in range(0, len(removed), chunk_size):
+                delete_rows(model, removed[start:start + chunk_size], database)
+    for model, entry in tables:
+        load_table(path, model, entry, database, chunk_size)
+        if progress:
+            progress(entry)
+    return [model for model, _ in tables]
+
+
+# Restores a full snapshot followed by any incremental ones taken on top of
+# it, in one transaction: the database ends up exactly as at the last
+# snapshot, or is left untouched. Rows are bulk inserted parents first with
+# foreign key checks deferred and verified once at the end, like loaddata.
+# A lone incremental snapshot is applied onto the current contents.
+def restore_snapshots(paths, database=DEFAULT_DB_ALIAS, chunk_size=2000, progress=None):
+    manifests = [read_manifest(path) for path in paths]
+    for path, previous, manifest in zip(paths[1:], manifests, manifests[1:]):
+        if manifest['base'] != previous['id']:
+            raise SnapshotError(f"{path} was not taken on top of the snapshot before it.")
+    connection = connections[database]
+    restored = set()
+    with transaction.atomic(using=database):
+        with connection.constraint_checks_disabled():
+            for path, manifest in zip(paths, manifests):
+                restored.update(apply_snapshot(path, manifest, database, chunk_size, progress))
+        connection.check_constraints()
+        sequence_sql = connection.ops.sequence_reset_sql(no_style(), list(restored))
+        if sequence_sql:
+            with connection.cursor() as cursor:
+                for sql in sequence_sql:
+                    cursor.execute(sql)
+    return manifests[-1]
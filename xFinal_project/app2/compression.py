@@ -0,0 +1,82 @@
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+from .static_pipeline import accepts_encoding, parse_accept_encoding
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    'text/html', 'text/plain', 'text/css', 'text/csv', 'text/javascript', 'application/javascript',
+    'application/json', 'application/xml', 'image/svg+xml',
+)
+
+
+def get_min_size():
+    return getattr(settings, 'RESPONSE_COMPRESSION_MIN_SIZE', 1024)
+
+
+def encode_gzip(content):
+    # a random-length gzip header, as GZipMiddleware does against BREACH
+    return compress_string(content, max_random_bytes=100)
+
+
+def encode_brotli(content):
+    return brotli.compress(content, quality=getattr(settings, 'RESPONSE_COMPRESSION_BROTLI_QUALITY', 5))
+
+
+# Whether a page can echo a secret an attacker could guess byte by byte from
+# the compressed length (BREACH): it rendered the CSRF token or read the session.
+def may_carry_secrets(request, content_type):
+    session = getattr(request, 'session', None)
+    return content_type == 'text/html' and bool(
+        request.META.get('CSRF_COOKIE_NEEDS_UPDATE') or (session is not None and session.accessed)
+    )
+
+
+# Compresses rendered pages and API responses of at least
+# RESPONSE_COMPRESSION_MIN_SIZE bytes, with brotli when installed and accepted,
+# else gzip. Pages that may carry secrets always get gzip, whose random-length
+# header brotli has no equivalent of. Streaming responses (the live event stream, files) and anything
+# already encoded, like the precompressed static files, pass through as they are.
+class ResponseCompressionMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.encoders = [('gzip', encode_gzip)]
+        if brotli is not None:
+            self.encoders.insert(0, ('br', encode_brotli))
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip()
+        if content_type not in COMPRESSIBLE_TYPES:
+            return response
+        # the page differs by Accept-Encoding even when it is sent as it is
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < get_min_size():
+            return response
+
+        accepted = parse_accept_encoding(request.headers.get('Accept-Encoding', ''))
+        sensitive = may_carry_secrets(request, content_type)
+        for encoding, encode in self.encoders:
+            if accepts_encoding(accepted, encoding) and not (sensitive and encoding == 'br'):
+                break
+        else:
+            return response
+        compressed = encode(response.content)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # the bytes differ from the uncompressed page's, so a strong ETag
+        # (app2.conditional) becomes a weak one; If-None-Match still matches
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
@@ -0,0 +1,96 @@
+from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from . import sites
+
+
+class ConflictError(Exception):
+    pass
+
+
+# Optimistic locking: every UPDATE of an existing row is issued as
+#   UPDATE ... SET <fields>, version = version + 1 WHERE id = ? AND version = ?
+# with the version the instance was read (or the edit form was rendered) with.
+# If someone saved the row in between no row matches and ConflictError is
+# raised instead of silently overwriting their change.
+class VersionedModel(models.Model):
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        version_field = self._meta.get_field('version')
+        expected = self.version
+        values = [value for value in values if value[0] is not version_field]
+        values.append((version_field, None, expected + 1))
+        updated = super()._do_update(
+            base_qs.filter(version=expected), using, pk_val, values, update_fields, forced_update,
+        )
+        if not updated and base_qs.filter(pk=pk_val).exists():
+            raise ConflictError(f"{self._meta.verbose_name} {pk_val} was changed by someone else.")
+        if updated:
+            self.version = expected + 1
+        return updated
+
+
+# Copies the posted values of `fields` onto the instance and returns the names
+# of those that actually changed; fields missing from the form are left alone.
+def apply_changes(instance, data, fields):
+    changed = []
+    errors = []
+    for name in fields:
+        if name not in data:
+            continue
+        field = instance._meta.get_field(name)
+        try:
+            value = None if data[name] == '' and field.null else field.to_python(data[name])
+        except ValidationError as exc:
+            errors.append(f"{field.verbose_name}: {' '.join(exc.messages)}")
+            continue
+        if value != getattr(instance, field.attname):
+            setattr(instance, field.attname, value)
+            changed.append(name)
+    if errors:
+        raise ValidationError(errors)
+    return changed
+
+
+# Writes only the changed columns (plus updated_at, which the conditional
+# pages use) against the version the edit form was rendered with.
+def save_changes(instance, changed, version):
+    if not changed:
+        return False
+    try:
+        instance.version = int(version)
+    except (TypeError, ValueError):
+        # no version posted: checked against the row as this request read it
+        pass
+    # a savepoint, so a conflict inside an outer transaction only undoes this save
+    with sites.atomic():
+        instance.save(update_fields=changed + ['updated_at'])
+    return True
+
+
+# POST handling shared by the edit views. Returns None once saved, otherwise
+# the status to re-render the form with: 400 for invalid input, 409 when the
+# row changed since the form was rendered (the instance is then reloaded so
+# the form shows the other user's values and the current version).
+def save_edit_form(request, instance, fields):
+    try:
+        changed = apply_changes(instance, request.POST, fields)
+        if not save_changes(instance, changed, request.POST.get('version')):
+            messages.info(request, "No changes to save.")
+    except ValidationError as exc:
+        messages.error(request, ' '.join(exc.messages))
+        return 400
+    except ConflictError:
+        instance.refresh_from_db()
+        messages.error(
+            request,
+            "Someone else saved this record while you were editing it. The form now shows their "
+            "changes; re-apply yours and save again.",
+        )
+        return 409
+    return None
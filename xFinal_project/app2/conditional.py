@@ -0,0 +1,64 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+
+# One cheap aggregate per queryset: the newest updated_at and the row count.
+# The count catches deletes, which never move MAX(updated_at).
+def table_state(querysets):
+    return [
+        queryset.aggregate(last_updated=Max('updated_at'), rows=Count('pk'))
+        for queryset in querysets
+    ]
+
+
+# Wraps a view so a refresh with a matching If-None-Match / If-Modified-Since
+# is answered with 304 before the view queries or renders anything.
+# `querysets` is called with the view's arguments and returns the querysets
+# whose rows the page shows.
+def conditional_page(querysets):
+    def get_state(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        # a page holding flash messages has to be rendered so they are shown
+        if len(messages.get_messages(request)):
+            return None
+        if not hasattr(request, '_conditional_state'):
+            request._conditional_state = table_state(querysets(request, *args, **kwargs))
+        return request._conditional_state
+
+    def etag_func(request, *args, **kwargs):
+        state = get_state(request, *args, **kwargs)
+        if state is None or not any(table['rows'] for table in state):
+            return None
+        user = request.user
+        role = getattr(getattr(user, 'userprofile', None), 'role', '')
+        # the page embeds the user, their role and a csrf token derived from the cookie
+        key = '|'.join([
+            str(user.pk), role, request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+            *(f"{table['last_updated']}:{table['rows']}" for table in state),
+        ])
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def last_modified_func(request, *args, **kwargs):
+        state = get_state(request, *args, **kwargs)
+        if state is None:
+            return None
+        return max((table['last_updated'] for table in state if table['last_updated']), default=None)
+
+    def decorator(view_func):
+        conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view_func)
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            # always revalidate, never reuse a stored copy without asking
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return _wrapped_view
+    return decorator
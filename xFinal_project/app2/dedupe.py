@@ -0,0 +1,269 @@
+from collections import defaultdict, namedtuple
+from itertools import combinations
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from django.utils.timezone import now
+
+from .matching import edit_similarity, jaro_winkler, name_key, nin_key, normalise_name, phone_key
+from .models import DuplicateCandidate, Farmer, FarmerBalance, ReceivablesSnapshot, SyncReceipt
+from .purge import dependents, stamped, tombstone_farmer
+from .receivables import refresh_balances
+from . import sites
+
+FARMER_FIELDS = ('id', 'farmer_name', 'farmer_nin', 'phone_number', 'date_of_birth', 'email', 'recommender_nin')
+# How much each field counts towards the score (they add up to 1)
+WEIGHTS = {
+    'name': 0.35,
+    'nin': 0.25,
+    'phone': 0.15,
+    'date_of_birth': 0.15,
+    'email': 0.05,
+    'recommender_nin': 0.05,
+}
+# a field counts as agreeing (and is listed in the reasons) from this similarity
+AGREES = 0.9
+SNAPSHOT_AMOUNTS = ('current', 'days_0_30', 'days_31_60', 'days_over_60', 'total')
+
+Profile = namedtuple('Profile', 'id name nin phone date_of_birth email recommender_nin name_key')
+Candidate = namedtuple('Candidate', 'score farmer_id other_id reasons')
+
+
+class MergeError(Exception):
+    pass
+
+
+def get_threshold():
+    return getattr(settings, 'DUPLICATE_FARMER_THRESHOLD', 0.8)
+
+
+def get_max_block():
+    return getattr(settings, 'DUPLICATE_FARMER_MAX_BLOCK', 200)
+
+
+def get_window():
+    return getattr(settings, 'DUPLICATE_FARMER_WINDOW', 20)
+
+
+def make_profile(farmer_id, farmer_name, farmer_nin, phone_number, date_of_birth, email, recommender_nin):
+    return Profile(
+        id=farmer_id,
+        name=normalise_name(farmer_name),
+        nin=nin_key(farmer_nin),
+        phone=phone_key(phone_number),
+        date_of_birth=date_of_birth,
+        email=(email or '').split('@')[0].lower(),
+        recommender_nin=nin_key(recommender_nin),
+        name_key=name_key(farmer_name),
+    )
+
+
+# A farmer is only compared with the farmers sharing one of these keys
+def blocking_keys(profile):
+    keys = [('name', profile.name_key), ('phone', profile.phone), ('date_of_birth', profile.date_of_birth),
+            ('recommender_nin', profile.recommender_nin)]
+    return [key for key in keys if key[1]]
+
+
+# Weighted agreement of two farmers between 0 and 1, and the fields that
+# agree. The exact-match fields are scored first and the string similarities
+# (the expensive part) only while the pair can still reach `threshold`;
+# None when it cannot.
+def compare(a, b, threshold=0):
+    similarities = {
+        'phone': float(bool(a.phone) and a.phone == b.phone),
+        'date_of_birth': float(a.date_of_birth == b.date_of_birth),
+        'recommender_nin': float(bool(a.recommender_nin) and a.recommender_nin == b.recommender_nin),
+    }
+    measures = (
+        ('name', lambda: jaro_winkler(a.name, b.name)),
+        ('nin', lambda: edit_similarity(a.nin, b.nin)),
+        ('email', lambda: jaro_winkler(a.email, b.email) if a.email and b.email else 0.0),
+    )
+    score = sum(WEIGHTS[field] * similarity for field, similarity in similarities.items())
+    remaining = sum(WEIGHTS[field] for field, _ in measures)
+    for field, measure in measures:
+        if score + remaining < threshold:
+            return None
+        similarities[field] = measure()
+        score += WEIGHTS[field] * similarities[field]
+        remaining -= WEIGHTS[field]
+    if score < threshold:
+        return None
+    return round(score, 3), [field for field in WEIGHTS if similarities[field] >= AGREES]
+
+
+# Pairs of ids to compare within a block. A block larger than `max_block` (a
+# date of birth or recommender shared by hundreds) is sorted by name and each
+# farmer only compared with the `window` farmers after it.
+def block_pairs(ids, profiles, max_block, window):
+    if len(ids) <= max_block:
+        yield from combinations(ids, 2)
+        return
+    ordered = sorted(ids, key=lambda farmer_id: profiles[farmer_id].name)
+    for position, farmer_id in enumerate(ordered):
+        for other_id in ordered[position + 1:position + 1 + window]:
+            yield farmer_id, other_id
+
+
+# Possible duplicates among the active site's farmers, best first. Farmers are
+# read once and grouped by blocking key; only pairs sharing a block are
+# scored, so the work grows with the block sizes instead of with n². Stored
+# keys that are missing or stale (rows written by bulk_create) are fixed on
+# the way. Returns the candidates and counts of the work done.
+def find_duplicates(threshold=None, max_block=None, window=None):
+    threshold = get_threshold() if threshold is None else threshold
+    max_block = max_block or get_max_block()
+    window = window or get_window()
+    profiles = {}
+    blocks = defaultdict(list)
+    stale = []
+    rows = Farmer.objects.order_by('pk').values_list(*FARMER_FIELDS, 'name_key', 'phone_key')
+    for *values, stored_name_key, stored_phone_key in rows.iterator(chunk_size=2000):
+        profile = make_profile(*values)
+        profiles[profile.id] = profile
+        for key in blocking_keys(profile):
+            blocks[key].append(profile.id)
+        if (stored_name_key, stored_phone_key) != (profile.name_key, profile.phone):
+            stale.append((profile.id, profile.name_key, profile.phone))
+    # written once the read is over; bulk_update skips auto_now, and the
+    # next incremental backup has to take the new keys
+    stamp = now()
+    for start in range(0, len(stale), 500):
+        Farmer.objects.bulk_update([
+            Farmer(pk=farmer_id, name_key=key, phone_key=phone, updated_at=stamp)
+            for farmer_id, key, phone in stale[start:start + 500]
+        ], ['name_key', 'phone_key', 'updated_at'])
+
+    compared = set()
+    candidates = []
+    for ids in blocks.values():
+        if len(ids) < 2:
+            continue
+        for pair in block_pairs(ids, profiles, max_block, window):
+            pair = tuple(sorted(pair))
+            if pair in compared:
+                continue
+            compared.add(pair)
+            match = compare(profiles[pair[0]], profiles[pair[1]], threshold)
+            if match is not None:
+                candidates.append(Candidate(match[0], pair[0], pair[1], match[1]))
+    candidates.sort(key=lambda candidate: (-candidate.score, candidate.farmer_id, candidate.other_id))
+    stats = {'farmers': len(profiles), 'blocks': len(blocks), 'comparisons': len(compared), 'keys_fixed': len(stale)}
+    return candidates, stats
+
+
+# The registered farmers that `values` (the fields of a farmer about to be
+# registered, as posted) may duplicate, best first. Only the rows sharing a
+# blocking key are read, through the indexes on the stored keys.
+def possible_duplicates(values, threshold=None, limit=5):
+    threshold = get_threshold() if threshold is None else threshold
+    try:
+        date_of_birth = Farmer._meta.get_field('date_of_birth').to_python(values.get('date_of_birth'))
+    except ValidationError:
+        date_of_birth = None
+    profile = make_profile(None, values.get('farmer_name'), values.get('farmer_nin'), values.get('phone_number'),
+                           date_of_birth, values.get('email'), values.get('recommender_nin'))
+    condition = Q()
+    if profile.name_key:
+        condition |= Q(name_key=profile.name_key)
+    if profile.phone:
+        condition |= Q(phone_key=profile.phone)
+    if date_of_birth:
+        condition |= Q(date_of_birth=date_of_birth)
+    if values.get('recommender_nin'):
+        condition |= Q(recommender_nin=values['recommender_nin'])
+    if not condition:
+        return []
+    rows = Farmer.objects.filter(condition).values_list(*FARMER_FIELDS)
+    candidates = []
+    for row in rows[:get_max_block() * 4]:
+        match = compare(profile, make_profile(*row), threshold)
+        if match is not None:
+            candidates.append(Candidate(match[0], row[0], None, match[1]))
+    candidates.sort(key=lambda candidate: (-candidate.score, candidate.farmer_id))
+    return candidates[:limit]
+
+
+# Stores candidates for review; pairs already known (open, merged or
+# dismissed) are left as they are. With `farmer_id`, the candidates are the
+# matches possible_duplicates found for that (newly registered) farmer.
+def record_candidates(candidates, farmer_id=None):
+    pairs = []
+    for candidate in candidates:
+        if farmer_id is not None:
+            ids = sorted((farmer_id, candidate.farmer_id))
+            candidate = candidate._replace(farmer_id=ids[0], other_id=ids[1])
+        pairs.append(DuplicateCandidate(
+            farmer_id=candidate.farmer_id, other_id=candidate.other_id, score=candidate.score,
+            reasons=candidate.reasons,
+        ))
+    DuplicateCandidate.objects.bulk_create(pairs, batch_size=500, ignore_conflicts=True)
+
+
+# Sums the duplicate's ageing rows into the kept farmer's rows of the same
+# day; the days only the duplicate has are moved with the other rows
+def merge_snapshots(keep_id, duplicate_id):
+    snapshots = ReceivablesSnapshot._base_manager
+    shared = snapshots.filter(
+        farmer_id=duplicate_id, snapshot_date__in=snapshots.filter(farmer_id=keep_id).values('snapshot_date'),
+    )
+    for snapshot in shared:
+        snapshots.filter(farmer_id=keep_id, snapshot_date=snapshot.snapshot_date).update(
+            **{field: F(field) + getattr(snapshot, field) for field in SNAPSHOT_AMOUNTS}
+        )
+    return shared.delete()[0]
+
+
+# Moves everything that points at `duplicate` (requests, sales and their
+# archived copies, notifications, receivables snapshots, sync receipts) to
+# `keep` with one UPDATE per table, then tombstones the duplicate for the
+# background purge. Moved rows get a new version and modification time, so
+# open edit forms conflict, conditional pages change and the next incremental
+# backup takes them. Returns the rows moved per model.
+def merge_farmers(keep, duplicate, user=None, candidate=None):
+    if keep.pk == duplicate.pk:
+        raise MergeError("A farmer cannot be merged into themselves.")
+    if keep.site != duplicate.site:
+        raise MergeError("Farmers of different sites cannot be merged.")
+    moved = {}
+    with sites.atomic():
+        locked = list(Farmer.objects.select_for_update().filter(pk__in=[keep.pk, duplicate.pk]))
+        if len(locked) != 2:
+            raise MergeError("One of the farmers was deleted or merged meanwhile.")
+        stamp = now()
+        FarmerBalance._base_manager.filter(farmer_id=duplicate.pk).delete()
+        merge_snapshots(keep.pk, duplicate.pk)
+        for related, field_name, _ in dependents(Farmer):
+            updates = stamped(related, {field_name: keep.pk}, stamp)
+            count = related._base_manager.filter(**{field_name: duplicate.pk}).update(**updates)
+            if count:
+                moved[related._meta.label] = count
+        count = SyncReceipt.objects.filter(item_type='farmer', object_id=duplicate.pk).update(object_id=keep.pk)
+        if count:
+            moved[SyncReceipt._meta.label] = count
+        Farmer.all_objects.filter(pk=keep.pk).update(updated_at=stamp, version=F('version') + 1)
+        refresh_balances([keep.pk])
+        tombstone_farmer(duplicate, user)
+
+        # other pairs with the duplicate are found again against the kept farmer
+        DuplicateCandidate.objects.filter(status='open').filter(
+            Q(farmer_id=duplicate.pk) | Q(other_id=duplicate.pk),
+        ).exclude(pk=getattr(candidate, 'pk', None)).delete()
+        if candidate is None:
+            candidate, _ = DuplicateCandidate.objects.get_or_create(
+                farmer_id=min(keep.pk, duplicate.pk), other_id=max(keep.pk, duplicate.pk),
+                defaults={'score': compare(profile_of(keep), profile_of(duplicate))[0]},
+            )
+        candidate.status = 'merged'
+        candidate.kept_id = keep.pk
+        candidate.moved = moved
+        candidate.resolved_by = user
+        candidate.resolved_at = stamp
+        candidate.save()
+    return moved
+
+
+def profile_of(farmer):
+    return make_profile(*(getattr(farmer, field) for field in FARMER_FIELDS))
@@ -0,0 +1,137 @@
+import hashlib
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import CharField, Sum
+from django.db.models.functions import Cast, Substr
+from django.utils.timezone import localdate
+
+from .conditional import table_state
+from .models import ArchivedChickRequest, ChickRequest, ChickStock
+from .sites import get_current_site
+
+SEASON_WEEKS = 52
+HORIZON_WEEKS = 4
+MOVING_AVERAGE_WEEKS = 4
+ALPHA = 0.3
+CACHE_TIMEOUT = 60 * 60
+
+
+# Daily totals per type/breed in one grouped query. The day is the
+# 'YYYY-MM-DD' prefix of the timestamp cast to text, which the database
+# computes natively (TruncDate runs a Python function per row on SQLite) and
+# numpy parses in one call.
+def daily_totals(queryset):
+    return (
+        queryset.exclude(request_status='Rejected')
+        .annotate(day=Substr(Cast('request_date', CharField()), 1, 10))
+        .values_list('chick_type', 'chick_breed', 'day')
+        .annotate(quantity=Sum('quantity_requested'))
+        .order_by()
+    )
+
+
+# Returns the series labels plus, column-wise for every day with requests,
+# the index of its series, its day number and the chicks requested. Archived
+# requests are history too; a day split over both tables is summed again when
+# the weeks are binned.
+def load_daily_demand():
+    rows = list(daily_totals(ChickRequest.objects.all()).union(
+        daily_totals(ArchivedChickRequest.objects.all()), all=True,
+    ))
+    if not rows:
+        return [], np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    chick_types, chick_breeds, days, quantities = zip(*rows)
+    keys = np.char.add(np.char.add(np.array(chick_types), '|'), np.array(chick_breeds))
+    labels, series_index = np.unique(keys, return_inverse=True)
+    day_numbers = np.array(days, dtype='datetime64[D]').astype(np.int64)
+    return [tuple(label.split('|')) for label in labels], series_index, day_numbers, np.array(quantities, dtype=float)
+
+
+# Bins the daily totals into one row of weekly (Monday-based) demand per
+# series. The last column is the last complete week before `today`.
+def weekly_matrix(series_count, series_index, day_numbers, quantities, today):
+    # 1970-01-01 was a Thursday, so Monday-based week numbers are (day + 3) // 7
+    this_week = (np.datetime64(today, 'D').astype(np.int64) + 3) // 7
+    week_numbers = (day_numbers + 3) // 7
+    keep = week_numbers < this_week
+    first_week = week_numbers[keep].min() if keep.any() else this_week - 1
+    demand = np.zeros((series_count, this_week - first_week))
+    np.add.at(demand, (series_index[keep], week_numbers[keep] - first_week), quantities[keep])
+    return demand, first_week
+
+
+# Simple exponential smoothing of every row at once, written as the weighted
+# sum it expands to: level = (1 - a)^(n-1) * y0 + sum a * (1 - a)^(n-1-t) * yt
+def smoothed_level(series, alpha=ALPHA):
+    weeks = series.shape[1]
+    weights = alpha * (1 - alpha) ** np.arange(weeks - 1, -1, -1)
+    weights[0] = (1 - alpha) ** (weeks - 1)
+    return series @ weights
+
+
+# Forecast for the next `horizon` weeks. With two full seasons of history the
+# level is smoothed on deseasonalised demand and multiplied back by each target
+# week's seasonal index (the average of the same week in earlier years over the
+# overall average); with less history the smoothed level is used flat.
+def forecast(demand, first_week, horizon=HORIZON_WEEKS):
+    series_count, weeks = demand.shape
+    season_position = (first_week + np.arange(weeks)) % SEASON_WEEKS
+    future_position = (first_week + weeks + np.arange(horizon)) % SEASON_WEEKS
+    if weeks < 2 * SEASON_WEEKS:
+        level = smoothed_level(demand)
+        return np.repeat(level[:, None], horizon, axis=1)
+
+    totals = np.zeros((series_count, SEASON_WEEKS))
+    np.add.at(totals, (slice(None), season_position), demand)
+    seasons = np.bincount(season_position, minlength=SEASON_WEEKS)
+    overall = demand.mean(axis=1, keepdims=True)
+    index = np.divide(totals / seasons, overall, out=np.ones_like(totals), where=overall > 0)
+    deseasonalised = np.divide(demand, index[:, season_position],
+                               out=np.zeros_like(demand), where=index[:, season_position] > 0)
+    level = smoothed_level(deseasonalised)
+    return level[:, None] * index[:, future_position]
+
+
+def compute_forecast(today=None):
+    today = today or localdate()
+    labels, series_index, day_numbers, quantities = load_daily_demand()
+    if not labels:
+        return None
+    demand, first_week = weekly_matrix(len(labels), series_index, day_numbers, quantities, today)
+    predicted = forecast(demand, first_week)
+    recent = demand[:, -MOVING_AVERAGE_WEEKS:]
+    stock = {
+        (row['chick_type'].lower(), row['chick_breed'].lower()): row['on_hand']
+        for row in ChickStock.objects.values('chick_type', 'chick_breed').annotate(on_hand=Sum('chick_quantity'))
+    }
+    week_start = today - timedelta(days=today.weekday())
+    results = []
+    for position, (chick_type, chick_breed) in enumerate(labels):
+        weekly = [round(value) for value in predicted[position]]
+        on_hand = stock.get((chick_type.lower(), chick_breed.lower()), 0) or 0
+        results.append({
+            'chick_type': chick_type,
+            'chick_breed': chick_breed,
+            'last_week': int(demand[position, -1]),
+            'moving_average': round(recent[position].mean()),
+            'weekly': weekly,
+            'total': sum(weekly),
+            'on_hand': on_hand,
+            'shortfall': max(sum(weekly) - on_hand, 0),
+        })
+    return {
+        'weeks': [week_start + timedelta(weeks=week) for week in range(HORIZON_WEEKS)],
+        'history_weeks': demand.shape[1],
+        'series': results,
+    }
+
+
+# Cached per site until a request is added or changed (or the day rolls over),
+# so the dashboard recomputes at most once per change to the history.
+def get_forecast():
+    today = localdate()
+    state = table_state([ChickRequest.objects.all(), ChickStock.objects.all()])
+    key = 'chick_demand_forecast:' + hashlib.md5(repr((get_current_site(), today, state)).encode()).hexdigest()
+    return cache.get_or_set(key, lambda: compute_forecast(today), CACHE_TIMEOUT)
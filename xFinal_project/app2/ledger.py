@@ -0,0 +1,172 @@
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils.timezone import now
+
+from .models import StockMovement, StockSnapshot
+
+
+# Reason, source object and user for the next save of a stock row. Without a
+# note a new row is 'received' and a later change an 'adjustment'.
+def note(stock, reason, source=None, user=None):
+    stock._ledger_note = (reason, source, user)
+
+
+# note() for the saves inside the block only: the movement is written by
+# post_save once the version check passed, and a save that raised a conflict
+# or was never made leaves no reason behind on the instance.
+@contextmanager
+def noted(stock, reason, source=None, user=None):
+    note(stock, reason, source, user)
+    try:
+        yield
+    finally:
+        stock._ledger_note = None
+
+
+def movement(stock, delta, reason, source=None, user=None):
+    return StockMovement(
+        item_kind=stock.LEDGER_KIND,
+        item_id=stock.pk,
+        item_label=stock.ledger_label(),
+        delta=delta,
+        unit_value=stock.ledger_unit_value(),
+        reason=reason,
+        source_type=source._meta.model_name if source is not None else '',
+        source_id=source.pk if source is not None else None,
+        created_by=user if user is not None and user.is_authenticated else None,
+        site=stock.site,
+    )
+
+
+# post_save: appends the change in quantity (or unit value) since the row was
+# loaded. The optimistic version check guarantees nobody wrote in between, so
+# the difference is exact.
+def record_stock_change(stock, created):
+    quantity = int(stock.ledger_quantity())
+    unit_value = Decimal(stock.ledger_unit_value())
+    if created:
+        loaded_quantity, loaded_value = 0, unit_value
+    elif getattr(stock, '_ledger_loaded', None) is not None:
+        loaded_quantity, loaded_value = stock._ledger_loaded
+        loaded_quantity, loaded_value = int(loaded_quantity or 0), Decimal(loaded_value or 0)
+    else:
+        # built by hand instead of loaded, there is nothing to compare with
+        return
+    delta = quantity - loaded_quantity
+    if created or delta or unit_value != loaded_value:
+        reason, source, user = getattr(stock, '_ledger_note', None) or (None, None, None)
+        if reason is None:
+            reason = 'received' if created else 'adjustment' if delta else 'revalued'
+        movement(stock, delta, reason, source, user).save()
+    stock._ledger_loaded = (quantity, unit_value)
+    stock._ledger_note = None
+
+
+def record_stock_removal(stock):
+    reason, source, user = getattr(stock, '_ledger_note', None) or (None, None, None)
+    movement(stock, -int(stock.ledger_quantity()), 'removed', source, user).save()
+
+
+# Opening movements for rows created without post_save (bulk_create), the
+# same way migration 0011 opened the ledger for the rows that existed then.
+def record_opening_balances(stocks):
+    StockMovement.objects.bulk_create(
+        [movement(stock, int(stock.ledger_quantity()), 'opening') for stock in stocks], batch_size=500,
+    )
+
+
+# The latest checkpoint at or before `moment` and its positions by item.
+def checkpoint_positions(moment):
+    checkpoint = StockSnapshot.objects.filter(taken_at__lte=moment).aggregate(latest=Max('taken_at'))['latest']
+    positions = {}
+    if checkpoint is not None:
+        snapshot = StockSnapshot.objects.filter(taken_at=checkpoint).values_list(
+            'item_kind', 'item_id', 'item_label', 'quantity', 'unit_value',
+        )
+        for kind, item_id, label, quantity, unit_value in snapshot:
+            positions[kind, item_id] = {'label': label, 'quantity': quantity, 'unit_value': unit_value}
+    return checkpoint, positions
+
+
+# The movements after `checkpoint` up to `moment`, oldest first
+def movements_between(checkpoint, moment):
+    tail = StockMovement.objects.filter(created_at__lte=moment)
+    if checkpoint is not None:
+        tail = tail.filter(created_at__gt=checkpoint)
+    return tail.order_by('created_at', 'pk').values_list(
+        'created_at', 'item_kind', 'item_id', 'item_label', 'delta', 'unit_value',
+    )
+
+
+def apply_movement(positions, kind, item_id, label, delta, unit_value):
+    position = positions.setdefault((kind, item_id), {'quantity': 0})
+    position.update(label=label, unit_value=unit_value, quantity=position['quantity'] + delta)
+
+
+def current_positions(positions):
+    return [
+        {'item_kind': kind, 'item_id': item_id, 'value': position['quantity'] * position['unit_value'], **position}
+        for (kind, item_id), position in sorted(positions.items())
+        if position['quantity']
+    ]
+
+
+# Quantity and unit value of every stock item at `moment`: the latest
+# checkpoint at or before it plus the movements between the two, so the work
+# is bounded by the snapshot interval instead of the whole history.
+def inventory_at(moment):
+    checkpoint, positions = checkpoint_positions(moment)
+    for _, *row in movements_between(checkpoint, moment):
+        apply_movement(positions, *row)
+    return current_positions(positions)
+
+
+# Writes a checkpoint at `taken_at` derived from the ledger itself (previous
+# checkpoint plus tail), so checkpoints never disagree with the movements.
+def take_snapshot(taken_at=None):
+    taken_at = taken_at or now()
+    positions = inventory_at(taken_at)
+    with transaction.atomic():
+        StockSnapshot.objects.filter(taken_at=taken_at).delete()
+        StockSnapshot.objects.bulk_create([
+            StockSnapshot(
+                taken_at=taken_at, item_kind=position['item_kind'], item_id=position['item_id'],
+                item_label=position['label'], quantity=position['quantity'], unit_value=position['unit_value'],
+            )
+            for position in positions
+        ], batch_size=500)
+    return len(positions)
+
+
+def totals_of(positions):
+    totals = {kind: {'units': 0, 'value': Decimal(0)} for kind, _ in StockMovement.KIND_CHOICES}
+    for position in positions:
+        totals[position['item_kind']]['units'] += position['quantity']
+        totals[position['item_kind']]['value'] += position['value']
+    return totals
+
+
+def valuation_totals(moment):
+    return totals_of(inventory_at(moment))
+
+
+# valuation_totals() at each of `moments` in one ordered pass: the checkpoint
+# before the earliest moment, then every movement up to the latest one read
+# once, with the totals taken as each moment is passed.
+def valuation_series(moments):
+    moments = sorted(moments)
+    if not moments:
+        return {}
+    checkpoint, positions = checkpoint_positions(moments[0])
+    rows = iter(movements_between(checkpoint, moments[-1]).iterator(chunk_size=2000))
+    pending = next(rows, None)
+    series = {}
+    for moment in moments:
+        while pending is not None and pending[0] <= moment:
+            apply_movement(positions, *pending[1:])
+            pending = next(rows, None)
+        series[moment] = totals_of(current_positions(positions))
+    return series
@@ -0,0 +1,324 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque, namedtuple
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.utils.module_loading import import_string
+
+from .models import ChickStock, Farmer, FeedStock
+from .sites import override
+
+try:
+    import redis
+    import redis.asyncio
+except ImportError:  # optional, only the cross-process RedisBackend needs it
+    redis = None
+
+TOPICS = ('requests', 'sales', 'stock')
+QUEUE_SIZE = 100
+
+Event = namedtuple('Event', 'id topic site data')
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+# A connected dashboard: its own queue on the event loop that serves it. If the
+# client falls QUEUE_SIZE events behind the stream ends, and the browser
+# reconnects and catches up from the hub history with Last-Event-ID.
+class Subscription:
+    def __init__(self, topics, site, loop):
+        self.topics = topics
+        self.site = site
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    # dashboards only hear about their own site
+    def wants(self, event):
+        return event.topic in self.topics and event.site == self.site
+
+    def offer(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+# In-process fan-out. dispatch() may be called from any thread (the request
+# thread committing a save, or a backend listener); every subscriber gets the
+# event through call_soon_threadsafe on its own loop, so an idle connection
+# is just a parked coroutine and a queue, not a thread.
+class Hub:
+    def __init__(self, history_size=500):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._history = deque(maxlen=history_size)
+        self._last_id = 0
+
+    # `event_id` is the id a backend assigned across processes; without one
+    # the hub numbers the events itself
+    def dispatch(self, topic, site, data, event_id=None):
+        with self._lock:
+            if event_id is None:
+                event_id = self._last_id + 1
+            self._last_id = max(self._last_id, event_id)
+            event = Event(event_id, topic, site, data)
+            self._history.append(event)
+            subscriptions = [sub for sub in self._subscriptions if sub.wants(event)]
+        for sub in subscriptions:
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, event)
+            except RuntimeError:
+                # its event loop is gone
+                self.unsubscribe(sub)
+        return event
+
+    # The subscription plus what replay() returns, atomically with subscribing
+    # so no event falls in between.
+    def subscribe(self, topics, site, last_id=None):
+        sub = Subscription(frozenset(topics), site, asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.add(sub)
+            backlog, start_id = self._since(sub, last_id)
+        return sub, backlog, start_id
+
+    # The events after `last_id` that a reconnecting browser missed, and the id
+    # it continues from.
+    def replay(self, topics, site, last_id=None):
+        with self._lock:
+            return self._since(Subscription(frozenset(topics), site, None), last_id)
+
+    def _since(self, sub, last_id):
+        if last_id is None or last_id > self._last_id:
+            # a fresh page, or an id from before this process started
+            return [], self._last_id
+        if self._history and last_id < self._history[0].id - 1:
+            # older than the history, the page has to be reloaded to catch up
+            return [Event(self._last_id, 'reload', sub.site, {})], self._last_id
+        return [event for event in self._history if event.id > last_id and sub.wants(event)], last_id
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subscriptions.discard(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+
+hub = Hub()
+
+
+# Single process (runserver, one ASGI worker): events go straight to the hub.
+class LocalBackend:
+    def publish(self, topic, site, data):
+        hub.dispatch(topic, site, data)
+
+    def start(self):
+        pass
+
+
+# Numbers the event from a shared counter and publishes it in one atomic step,
+# so every process sees the ids in order.
+PUBLISH_SCRIPT = """
+local id = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', ARGV[1], id .. ' ' .. ARGV[2])
+return id
+"""
+
+
+# Several worker processes: events are published on a Redis channel and every
+# process relays what it hears to its own hub. Event ids come from a Redis
+# counter, so a Last-Event-ID means the same event on every worker and a
+# browser reconnecting to another one replays the right events. Needs the
+# redis package and LIVE_EVENTS_REDIS_URL.
+class RedisBackend:
+    def __init__(self):
+        if redis is None:
+            raise ImproperlyConfigured("RedisBackend needs the redis package.")
+        self.url = get_setting('LIVE_EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+        self.channel = get_setting('LIVE_EVENTS_REDIS_CHANNEL', 'young4chicks:live')
+        self.client = redis.Redis.from_url(self.url)
+        self.publish_script = self.client.register_script(PUBLISH_SCRIPT)
+        self._listener = None
+
+    def publish(self, topic, site, data):
+        message = {'topic': topic, 'site': site, 'data': data}
+        self.publish_script(
+            keys=[f"{self.channel}:last-id"], args=[self.channel, json.dumps(message, cls=DjangoJSONEncoder)],
+        )
+
+    # called by every stream; starts the relay on the serving loop once
+    def start(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self.listen())
+
+    async def listen(self):
+        client = redis.asyncio.Redis.from_url(self.url)
+        async with client.pubsub() as pubsub:
+            await pubsub.subscribe(self.channel)
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    relay(message['data'])
+
+
+# "<id> <json>" as published by RedisBackend, into this process's hub
+def relay(message):
+    event_id, body = message.split(b' ', 1)
+    payload = json.loads(body)
+    return hub.dispatch(payload['topic'], payload['site'], payload['data'], event_id=int(event_id))
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(get_setting('LIVE_EVENTS_BACKEND', 'app2.live.LocalBackend'))()
+
+
+# Called from model signals: the payload is built (at the row's site) and sent
+# once the transaction commits, so dashboards never see rows that were rolled back.
+def publish(topic, site, build, using=None):
+    def send():
+        with override(site):
+            data = build()
+        get_backend().publish(topic, site, data)
+    transaction.on_commit(send, using=using)
+
+
+# How a save or delete changes the number of pending requests: +1, -1 or 0.
+# Worked out from the status the instance was read with, when the signal
+# fires, so dashboards adjust their count without a COUNT per event.
+def pending_delta(chick_request, deleted=False):
+    was_pending = getattr(chick_request, '_loaded_status', None) == 'Pending'
+    is_pending = not deleted and chick_request.request_status == 'Pending'
+    chick_request._loaded_status = None if deleted else chick_request.request_status
+    return int(is_pending) - int(was_pending)
+
+
+# Payloads of the three topics. Built after the commit, so the quantities are
+# the ones the next page load would show.
+def request_payload(chick_request, deleted=False, pending_delta=0):
+    farmer_nin = Farmer.all_objects.filter(pk=chick_request.farmer_id).values_list('farmer_nin', flat=True).first()
+    return {
+        'id': chick_request.pk,
+        'status': 'Deleted' if deleted else chick_request.request_status,
+        'farmer_nin': farmer_nin or '',
+        'quantity': chick_request.quantity_requested,
+        'chick_type': chick_request.chick_type,
+        'chick_breed': chick_request.chick_breed,
+        'pending_delta': pending_delta,
+    }
+
+
+def sale_payload(sale):
+    return {
+        'id': sale.pk,
+        'chick_request_id': sale.chick_request_id,
+        'customer': Farmer.all_objects.filter(pk=sale.customer_id).values_list('farmer_name', flat=True).first(),
+        'quantity': sale.quantity_sold,
+        'amount': sale.amount,
+    }
+
+
+def stock_payload(movement):
+    model = ChickStock if movement.item_kind == 'chick' else FeedStock
+    quantity_field = model.LEDGER_QUANTITY_FIELD
+    payload = {
+        'kind': movement.item_kind,
+        'id': movement.item_id,
+        'label': movement.item_label,
+        'delta': movement.delta,
+        'reason': movement.reason,
+        'quantity': model.objects.filter(pk=movement.item_id).values_list(quantity_field, flat=True).first(),
+    }
+    if movement.item_kind == 'chick':
+        payload['chick_batches'] = ChickStock.objects.count()
+    return payload
+
+
+def format_event(event):
+    data = json.dumps(event.data, cls=DjangoJSONEncoder)
+    return f"id: {event.id}\nevent: {event.topic}\ndata: {data}\n\n"
+
+
+def read_last_id(request):
+    value = request.headers.get('Last-Event-ID') or request.GET.get('last_id')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def preamble(start_id):
+    # a new page starts at the current id so reconnects only replay what it missed
+    return f"retry: {get_setting('LIVE_EVENTS_RETRY_MS', 3000)}\nid: {start_id}\n\n"
+
+
+async def event_stream(topics, site, last_id):
+    get_backend().start()
+    sub, backlog, start_id = hub.subscribe(topics, site, last_id)
+    try:
+        yield preamble(start_id)
+        for event in backlog:
+            yield format_event(event)
+        heartbeat = get_setting('LIVE_EVENTS_HEARTBEAT', 15)
+        # streams end after LIVE_EVENTS_MAX_AGE seconds and the browser reconnects,
+        # which also reaps connections whose client went away without us noticing
+        deadline = time.monotonic() + get_setting('LIVE_EVENTS_MAX_AGE', 600)
+        # a client that fell behind is dropped too and replays from the history
+        while time.monotonic() < deadline and not sub.overflowed:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        hub.unsubscribe(sub)
+
+
+def staff_role(request):
+    user = request.user
+    if not (user.is_authenticated and user.is_staff):
+        return None
+    profile = getattr(user, 'userprofile', None)
+    return profile.role if profile is not None else None
+
+
+# Server-Sent Events for the staff dashboards: /live/events/?topics=requests,stock
+# Under ASGI each connection stays open and receives events as they happen.
+# Under WSGI (runserver) streaming would tie up a worker thread, so the missed
+# events are sent and the response ends; EventSource then polls every
+# LIVE_EVENTS_RETRY_MS.
+async def live_events(request):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if await sync_to_async(staff_role)(request) is None:
+        return JsonResponse({'error': "Authentication required."}, status=401)
+    topics = [topic for topic in request.GET.get('topics', '').split(',') if topic in TOPICS] or TOPICS
+    last_id = read_last_id(request)
+    if isinstance(request, ASGIRequest):
+        response = StreamingHttpResponse(
+            event_stream(topics, request.site, last_id), content_type='text/event-stream',
+        )
+    else:
+        backlog, start_id = hub.replay(topics, request.site, last_id)
+        response = HttpResponse(
+            preamble(start_id) + ''.join(format_event(event) for event in backlog), content_type='text/event-stream',
+        )
+    response['Cache-Control'] = 'no-cache'
+    # nginx would otherwise buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
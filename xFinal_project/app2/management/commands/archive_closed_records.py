@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from app2.archive import archivable_requests, archivable_unlinked_sales, archive_closed_records, archive_cutoff
+from app2.sites import each_site, site_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves fulfilled/rejected chick requests and paid/refunded/cancelled sales older than "
+        "ARCHIVE_AFTER_DAYS into the archive tables, one chunk per transaction. Safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=None,
+                            help="Overrides ARCHIVE_AFTER_DAYS.")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help="Only count what would be moved.")
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['older_than_days'])
+        for site in each_site():
+            self.archive_site(site_name(site), cutoff, options)
+
+    def archive_site(self, name, cutoff, options):
+        if options['dry_run']:
+            self.stdout.write(
+                f"{name}: would archive {archivable_requests(cutoff).count()} chick request(s) and "
+                f"{archivable_unlinked_sales(cutoff).count()} unlinked sale(s), plus the sales of those "
+                f"requests, closed before {cutoff:%Y-%m-%d}."
+            )
+            return
+        moved = archive_closed_records(
+            cutoff, options['chunk_size'],
+            progress=lambda moved: self.stdout.write(
+                f"  {moved['chick_requests']} request(s), {moved['sales']} sale(s) archived"
+            ),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{name}: archived {moved['chick_requests']} chick request(s) and {moved['sales']} sale(s) "
+            f"closed before {cutoff:%Y-%m-%d}."
+        ))
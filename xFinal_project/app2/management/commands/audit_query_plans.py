@@ -0,0 +1,218 @@
+import json
+import logging
+import re
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, DatabaseError
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import URLPattern, get_resolver, reverse
+
+from app2.seed import seed_demo_data
+
+# url name prefix -> key of the seeded objects used to fill in <int:pk>
+PK_SOURCES = [
+    ('chick_request', 'chick_requests'),
+    ('chick_stock', 'stocks'),
+    ('feed_stock', 'feeds'),
+    ('farmer', 'farmers'),
+    ('sale', 'sales'),
+]
+# url name -> values of its other parameters; routes with a parameter that has
+# neither a value here nor a seeded pk are listed as skipped
+ROUTE_ARGUMENTS = {
+    'api_resource_list': {'resource': 'farmers'},
+}
+ROLES = ('brooder_manager', 'sales_rep')
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(.*)$')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)(?: (\w+))?')
+
+
+# Whether `sql` compares a column of the scanned table (or its alias) with
+# LIKE/ILIKE, bare or through UPPER("t"."col"::text) as Django writes iexact
+# and icontains: that scan is what a case-insensitive lookup costs, any other
+# table in the same statement is an ordinary full scan.
+def case_insensitive_on(sql, *names):
+    for name in filter(None, names):
+        column = rf'"?{re.escape(name)}"?\."\w+"(?:::\w+)?\)?'
+        if re.search(rf'{column}\s+I?LIKE\b', sql, re.IGNORECASE):
+            return True
+    return False
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests every url in chicks/urls.py against a seeded test database, "
+        "runs EXPLAIN on every SELECT issued and reports full table scans, "
+        "temporary sorts, case-insensitive scans and N+1 query patterns per view."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20,
+                            help="Number of farmers to seed (requests are seeded at twice this).")
+        parser.add_argument('--n-plus-one', type=int, default=3,
+                            help="Repeats of the same statement in one request that count as N+1.")
+        parser.add_argument('--baseline', default=str(Path(settings.BASE_DIR) / 'query_plan_baseline.json'),
+                            help="JSON file of accepted findings. Only findings not in it fail the run.")
+        parser.add_argument('--update-baseline', action='store_true',
+                            help="Write the current findings to the baseline file and exit 0.")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            seeded = seed_demo_data(options['rows'])
+            report = self.audit(seeded, options['n_plus_one'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        baseline_path = Path(options['baseline'])
+        if options['update_baseline']:
+            baseline_path.write_text(json.dumps(
+                {view: sorted({f['key'] for f in entry['findings']}) for view, entry in report.items()},
+                indent=2, sort_keys=True,
+            ))
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {baseline_path}"))
+            return
+
+        baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+        new_findings = 0
+        for view, entry in report.items():
+            accepted = set(baseline.get(view, []))
+            for finding in entry['findings']:
+                finding['new'] = finding['key'] not in accepted
+                new_findings += finding['new']
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+
+        if new_findings:
+            raise CommandError(f"{new_findings} new query plan finding(s). "
+                               f"Fix them or accept them with --update-baseline.")
+        self.stdout.write(self.style.SUCCESS("No new query plan findings."))
+
+    def audit(self, seeded, n_plus_one):
+        # views that fail are reported by status, not by a traceback per request
+        client = Client(raise_request_exception=False)
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            return self.request_routes(client, seeded, n_plus_one)
+        finally:
+            request_logger.setLevel(level)
+
+    def request_routes(self, client, seeded, n_plus_one):
+        report = {}
+        for name, pattern in self.get_routes():
+            url, skipped = self.route_url(name, pattern, seeded)
+            if skipped:
+                report[name] = {'url': '/' + str(pattern.pattern), 'skipped': skipped, 'findings': []}
+                continue
+            for role in ROLES:
+                client.force_login(seeded[role])
+                statements = []
+                with connection.execute_wrapper(self.capture(statements)):
+                    status = client.get(url).status_code
+                report[f"{name} [{role}]"] = {
+                    'url': url,
+                    'status': status,
+                    'queries': len(statements),
+                    'findings': self.analyse(statements, n_plus_one),
+                }
+        return report
+
+    # Walks the project urls (skipping included urlconfs such as the admin),
+    # keeping the first route registered under each url name.
+    def get_routes(self):
+        seen = set()
+        for pattern in get_resolver().url_patterns:
+            if not isinstance(pattern, URLPattern) or not pattern.name or pattern.name in seen:
+                continue
+            seen.add(pattern.name)
+            yield pattern.name, pattern
+
+    # The url to request for a route, or why it cannot be requested: <int:pk>
+    # is the first seeded object of the route's model, other parameters come
+    # from ROUTE_ARGUMENTS.
+    def route_url(self, name, pattern, seeded):
+        kwargs = {}
+        for parameter in getattr(pattern.pattern, 'converters', {}):
+            if parameter == 'pk':
+                source = next((key for prefix, key in PK_SOURCES if name.startswith(prefix)), None)
+                if not seeded.get(source):
+                    return None, "no seeded object for <pk>"
+                kwargs['pk'] = seeded[source][0].pk
+            elif parameter in ROUTE_ARGUMENTS.get(name, {}):
+                kwargs[parameter] = ROUTE_ARGUMENTS[name][parameter]
+            else:
+                return None, f"no value for <{parameter}>"
+        return reverse(name, kwargs=kwargs), None
+
+    def capture(self, statements):
+        def wrapper(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+        return wrapper
+
+    def explain(self, sql, params):
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [str(row[-1]) for row in cursor.fetchall()]
+
+    def analyse(self, statements, n_plus_one):
+        findings = {}
+
+        def add(kind, subject, sql, detail):
+            key = f"{kind}:{subject}"
+            findings.setdefault(key, {'key': key, 'kind': kind, 'sql': sql, 'detail': detail})
+
+        selects = [(sql, params) for sql, params in statements if sql.lstrip().upper().startswith('SELECT')]
+        for sql, params in selects:
+            try:
+                plan = self.explain(sql, params)
+            except DatabaseError as exc:
+                add('explain_failed', sql, sql, str(exc))
+                continue
+            for line in plan:
+                line = line.strip()
+                scan = SQLITE_SCAN.match(line)
+                if scan and 'INDEX' in scan.group(3):
+                    # walking an index in order is not a full table scan
+                    scan = None
+                scan = scan or POSTGRES_SCAN.search(line)
+                if scan:
+                    table, alias = scan.group(1), scan.group(2)
+                    kind = 'case_insensitive_scan' if case_insensitive_on(sql, table, alias) else 'full_scan'
+                    add(kind, table, sql, line)
+                elif 'TEMP B-TREE' in line or line.startswith('Sort'):
+                    add('temp_sort', sql, sql, line)
+
+        # the same parametrised statement repeated inside one request is an N+1
+        for sql, count in Counter(sql for sql, _ in selects).items():
+            if count >= n_plus_one:
+                add('n_plus_one', sql, sql, f"executed {count} times")
+        return list(findings.values())
+
+    def print_report(self, report):
+        for view, entry in report.items():
+            if 'skipped' in entry:
+                self.stdout.write(f"{view} {entry['url']} skipped: {entry['skipped']}")
+                continue
+            header = f"{view} {entry['url']} -> {entry['status']}, {entry['queries']} queries"
+            if not entry['findings']:
+                self.stdout.write(self.style.SUCCESS(header))
+                continue
+            self.stdout.write(self.style.WARNING(header))
+            for finding in entry['findings']:
+                marker = 'NEW ' if finding.get('new') else ''
+                self.stdout.write(f"    {marker}{finding['kind']}: {finding['detail']}")
+                self.stdout.write(f"        {finding['sql'][:200]}")
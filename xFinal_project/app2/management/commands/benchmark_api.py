@@ -0,0 +1,63 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from app2.api import RESOURCES
+from app2.seed import seed_demo_data
+
+
+class Command(BaseCommand):
+    help = "Seeds a throwaway test database and reports rows/sec served by every read-only JSON api resource."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000,
+                            help="Number of farmers to seed (requests are seeded at twice this).")
+        parser.add_argument('--limit', type=int, default=1000, help="Page size requested.")
+        parser.add_argument('--fields', default='', help="Projection passed as ?fields= to every resource.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            seeded = seed_demo_data(options['rows'])
+            client = Client(HTTP_ACCEPT_ENCODING='gzip')
+            client.force_login(seeded['brooder_manager'])
+            for resource in RESOURCES:
+                self.benchmark(client, resource, options['limit'], options['fields'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def benchmark(self, client, resource, limit, fields):
+        url = reverse('api_resource_list', args=[resource])
+        params = {'limit': limit}
+        if fields:
+            params['fields'] = fields
+        rows = pages = transferred = 0
+        started = time.perf_counter()
+        while True:
+            response = client.get(url, params)
+            if response.status_code != 200:
+                self.stderr.write(f"{resource}: HTTP {response.status_code} {response.content[:200]!r}")
+                return
+            transferred += len(response.content)
+            body = response.content
+            if response.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            data = json.loads(body)
+            rows += len(data['results'])
+            pages += 1
+            if not data['next_cursor']:
+                break
+            params['cursor'] = data['next_cursor']
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"{resource:15} {rows:>8} rows  {pages:>4} pages  {transferred / 1024:>9.1f} KiB gzip  "
+            f"{rows / elapsed if elapsed else 0:>10.0f} rows/sec"
+        )
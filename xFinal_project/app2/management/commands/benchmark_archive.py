@@ -0,0 +1,96 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils.timezone import now
+
+from app2.archive import archive_closed_records, archive_cutoff
+from app2.models import ChickRequest, Sale
+from app2.seed import seed_demo_data
+
+# pages rendered before and after archiving, and the role that can open them
+PAGES = [
+    ('brooder_manager_dashboard', 'brooder_manager'),
+    ('manage_requests', 'brooder_manager'),
+    ('sales_rep_dashboard', 'sales_rep'),
+    ('view_all_sales', 'sales_rep'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database, closes and backdates 90% of the chick requests and sales, "
+        "and reports dashboard latency before and after archiving them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000,
+                            help="Number of farmers to seed (requests are seeded at twice this).")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed requests per page.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # pages are rendered without collectstatic
+            with override_settings(STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            }):
+                self.run(options['rows'], options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, rows, repeat):
+        seeded = seed_demo_data(rows)
+        old = now() - timedelta(days=800)
+        # every tenth request stays open, the rest are closed two years ago
+        closed_ids = [req.pk for req in seeded['chick_requests'] if req.pk % 10]
+        for start in range(0, len(closed_ids), 500):
+            chunk = closed_ids[start:start + 500]
+            ChickRequest.objects.filter(pk__in=chunk, request_status__in=('Pending', 'Approved')).update(
+                request_status='Rejected')
+            ChickRequest.objects.filter(pk__in=chunk).update(request_date=old)
+            Sale.objects.filter(chick_request_id__in=chunk).update(payment_status='paid', sale_date=old)
+
+        clients = {}
+        for role in ('brooder_manager', 'sales_rep'):
+            clients[role] = Client()
+            clients[role].force_login(seeded[role])
+
+        before = self.measure(clients, repeat)
+        started = time.perf_counter()
+        moved = archive_closed_records(archive_cutoff())
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Archived {moved['chick_requests']} request(s) and {moved['sales']} sale(s) in {elapsed:.1f}s; "
+            f"{ChickRequest.objects.count()} request(s) and {Sale.objects.count()} sale(s) stay hot."
+        )
+        after = self.measure(clients, repeat)
+
+        self.stdout.write(f"{'page':28} {'before ms':>10} {'after ms':>10}")
+        for name, _ in PAGES:
+            self.stdout.write(f"{name:28} {before[name]:>10.1f} {after[name]:>10.1f}")
+
+    def measure(self, clients, repeat):
+        timings = {}
+        for name, role in PAGES:
+            url = reverse(name)
+            samples = []
+            for _ in range(repeat):
+                # the dashboard forecast is cached, drop it so every sample does the full work
+                cache.clear()
+                started = time.perf_counter()
+                response = clients[role].get(url)
+                samples.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    self.stderr.write(f"{name}: HTTP {response.status_code}")
+            timings[name] = statistics.median(samples)
+        return timings
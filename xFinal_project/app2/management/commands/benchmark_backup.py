@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils.timezone import now
+
+from app2.backup import backup_models, modified_field, read_manifest, restore_snapshots, write_snapshot
+from app2.models import ChickRequest, Farmer
+from app2.seed import seed_demo_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database and compares dumpdata/loaddata with backup_snapshot/"
+        "restore_snapshot: time, size on disk and, with --trace-memory, peak Python memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=300000,
+                            help="Number of farmers to seed; each brings about 2.3 more rows (about 1M in all).")
+        parser.add_argument('--trace-memory', action='store_true',
+                            help="Report peak traced memory of each step (makes every step slower).")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        directory = tempfile.mkdtemp()
+        try:
+            self.trace_memory = options['trace_memory']
+            self.run(options['rows'], directory)
+        finally:
+            shutil.rmtree(directory)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, rows, directory):
+        seeded = seed_demo_data(rows)
+        models = backup_models()
+        # the seeded rows were last changed well before the full backup
+        for model in models:
+            field = modified_field(model)
+            if field is not None:
+                model._base_manager.update(**{field: now() - timedelta(days=1)})
+        labels = [model._meta.label for model in models]
+        expected = self.counts(models)
+        self.stdout.write(f"Seeded {sum(expected.values())} row(s) in {len(models)} table(s).")
+        dump = os.path.join(directory, 'dump.json.gz')
+        full = os.path.join(directory, 'full')
+        incremental = os.path.join(directory, 'incremental')
+
+        results = [
+            self.measure('dumpdata', lambda: call_command('dumpdata', *labels, output=dump, verbosity=0), dump),
+            self.measure('backup_snapshot (full)', lambda: write_snapshot(full), full),
+        ]
+        # one farmer in a hundred and their requests change before the incremental backup
+        changed = [farmer.pk for farmer in seeded['farmers'][::100]]
+        Farmer.objects.filter(pk__in=changed).update(address='Entebbe', updated_at=now())
+        ChickRequest.objects.filter(farmer_id__in=changed).update(took_feeds='NO', updated_at=now())
+        results.append(self.measure(
+            'backup_snapshot (incremental)', lambda: write_snapshot(incremental, base=read_manifest(full)), incremental,
+        ))
+
+        self.clear(models)
+        results.append(self.measure('loaddata', lambda: call_command('loaddata', dump, verbosity=0)))
+        self.verify(models, expected, 'loaddata')
+        results.append(self.measure('restore_snapshot (full + incr.)', lambda: restore_snapshots([full, incremental])))
+        self.verify(models, expected, 'restore_snapshot')
+
+        self.stdout.write(f"{'step':34} {'seconds':>8} {'MB on disk':>11} {'peak MB':>8}")
+        for name, seconds, size, peak in results:
+            size = f"{size / 2 ** 20:.1f}" if size is not None else '-'
+            peak = f"{peak / 2 ** 20:.1f}" if peak is not None else '-'
+            self.stdout.write(f"{name:34} {seconds:>8.1f} {size:>11} {peak:>8}")
+
+    def measure(self, name, step, output=None):
+        if self.trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        step()
+        elapsed = time.perf_counter() - started
+        peak = None
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return name, elapsed, self.size(output) if output else None, peak
+
+    def size(self, path):
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    def counts(self, models):
+        return {model._meta.label: model._base_manager.count() for model in models}
+
+    def clear(self, models):
+        with transaction.atomic(), connection.constraint_checks_disabled():
+            for model in reversed(models):
+                model._base_manager.all()._raw_delete(connection.alias)
+
+    def verify(self, models, expected, name):
+        counts = self.counts(models)
+        for label, count in counts.items():
+            if count != expected[label]:
+                # loaddata's raw saves still send post_save, e.g. FarmerBalance rows appear
+                self.stderr.write(f"{name}: {label} has {count} row(s), the backup had {expected[label]}.")
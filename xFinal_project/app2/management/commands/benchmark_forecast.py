@@ -0,0 +1,63 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils.timezone import now
+
+from app2.forecasting import compute_forecast
+from app2.models import ChickRequest
+from app2.seed import seed_demo_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database with several years of chick requests and times a full "
+        "recomputation of the demand forecast."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=5)
+        parser.add_argument('--requests-per-day', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=3, help="Timed recomputations.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            total = self.seed(options['years'], options['requests_per_day'])
+            self.stdout.write(f"Seeded {total} chick requests over {options['years']} year(s).")
+            for attempt in range(1, options['repeat'] + 1):
+                started = time.perf_counter()
+                result = compute_forecast()
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"Run {attempt}: {elapsed * 1000:.0f} ms for {len(result['series'])} series "
+                    f"x {result['history_weeks']} weeks"
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def seed(self, years, per_day):
+        farmers = seed_demo_data(100)['farmers']
+        ChickRequest.objects.all().delete()
+        today = now()
+        kinds = [(chick_type, breed) for chick_type, _ in ChickRequest.CHICK_TYPE_CHOICES
+                 for breed, _ in ChickRequest.CHICK_BREED_CHOICES]
+        for day in range(years * 365):
+            created = ChickRequest.objects.bulk_create([
+                ChickRequest(
+                    farmer=random.choice(farmers), farmer_type='Starter',
+                    chick_type=kind[0], chick_breed=kind[1],
+                    quantity_requested=random.randint(50, 500), took_feeds='NO',
+                )
+                for kind in random.choices(kinds, k=per_day)
+            ])
+            # request_date is auto_now_add, so it is moved back after the insert
+            ChickRequest.objects.filter(pk__in=[row.pk for row in created]).update(
+                request_date=today - timedelta(days=day),
+            )
+        return ChickRequest.objects.count()
@@ -0,0 +1,128 @@
+import gzip
+import statistics
+import time
+from copy import deepcopy
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.template.backends.django import Template
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from app2.seed import seed_demo_data
+
+try:
+    import brotli
+except ImportError:  # optional, the brotli column is left out without it
+    brotli = None
+
+# the largest pages, and the role that can open them
+PAGES = [
+    ('list_farmers', 'brooder_manager'),
+    ('view_all_sales', 'sales_rep'),
+    ('manage_requests', 'brooder_manager'),
+    ('brooder_manager_dashboard', 'brooder_manager'),
+    ('sales_rep_dashboard', 'sales_rep'),
+]
+
+PLAIN_LOADERS = ['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader']
+MINIFYING_LOADERS = ['app2.template_loaders.FilesystemLoader', 'app2.template_loaders.AppDirectoriesLoader']
+VARIANTS = [
+    ('uncached', PLAIN_LOADERS),
+    ('cached', [('django.template.loaders.cached.Loader', PLAIN_LOADERS)]),
+    ('cached+minified', [('django.template.loaders.cached.Loader', MINIFYING_LOADERS)]),
+]
+
+
+def templates_with(loaders):
+    templates = deepcopy(settings.TEMPLATES)
+    templates[0]['APP_DIRS'] = False
+    templates[0]['OPTIONS']['loaders'] = loaders
+    return templates
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a throwaway test database and reports, for the largest pages, the bytes sent (raw, gzip and "
+        "brotli) and the template render time with the uncached, cached and cached+minifying loaders."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000,
+                            help="Number of farmers to seed (requests are seeded at twice this).")
+        parser.add_argument('--repeat', type=int, default=10, help="Timed renders per page and loader.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # pages are rendered without collectstatic
+            with override_settings(STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            }):
+                self.run(options['rows'], options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, rows, repeat):
+        seeded = seed_demo_data(rows)
+        clients = {}
+        for role in ('brooder_manager', 'sales_rep'):
+            clients[role] = Client()
+            clients[role].force_login(seeded[role])
+
+        results = {}
+        for variant, loaders in VARIANTS:
+            with override_settings(TEMPLATES=templates_with(loaders)):
+                results[variant] = self.measure(clients, repeat)
+
+        columns = ['raw', 'gzip'] + (['br'] if brotli is not None else [])
+        self.stdout.write("Bytes sent (KiB):")
+        self.stdout.write(f"  {'page':28} {'loader':16} " + ' '.join(f"{column:>8}" for column in columns))
+        for name, _ in PAGES:
+            for variant, _ in VARIANTS:
+                body = results[variant][name][1]
+                sizes = [len(body), len(gzip.compress(body, compresslevel=6))]
+                if brotli is not None:
+                    sizes.append(len(brotli.compress(body, quality=settings.RESPONSE_COMPRESSION_BROTLI_QUALITY)))
+                self.stdout.write(f"  {name:28} {variant:16} " + ' '.join(f"{size / 1024:>8.1f}" for size in sizes))
+        self.stdout.write(f"Template render time (median of {repeat}, ms):")
+        self.stdout.write(f"  {'page':28} " + ' '.join(f"{variant:>16}" for variant, _ in VARIANTS))
+        for name, _ in PAGES:
+            self.stdout.write(
+                f"  {name:28} " + ' '.join(f"{results[variant][name][0]:>16.2f}" for variant, _ in VARIANTS)
+            )
+
+    # Median time spent in the view's render() call (loading, compiling when
+    # not cached, and rendering the template) and the page it produced.
+    def measure(self, clients, repeat):
+        samples = []
+        render = Template.render
+
+        def timed_render(template, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return render(template, *args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - started)
+
+        results = {}
+        with mock.patch.object(Template, 'render', timed_render):
+            for name, role in PAGES:
+                timings = []
+                for _ in range(repeat):
+                    # the dashboard forecast is cached, drop it so every sample does the full work
+                    cache.clear()
+                    samples.clear()
+                    response = clients[role].get(reverse(name))
+                    if response.status_code != 200:
+                        self.stderr.write(f"{name}: HTTP {response.status_code}")
+                    timings.append(sum(samples) * 1000)
+                results[name] = (statistics.median(timings), response.content)
+        return results
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app2.dedupe import find_duplicates, get_threshold, record_candidates
+from app2.models import Farmer
+from app2.sites import each_site, site_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Finds farmers registered more than once (typo'd NIN, other spelling of the name) by comparing only "
+        "the farmers that share a blocking key: phonetic name, phone number, date of birth or recommender NIN. "
+        "Candidates are stored for review on the duplicates page, best first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=None,
+                            help="Lowest score reported (0-1), defaults to DUPLICATE_FARMER_THRESHOLD.")
+        parser.add_argument('--top', type=int, default=20, help="Candidates printed per site.")
+        parser.add_argument('--dry-run', action='store_true', help="Print the candidates without storing them.")
+
+    def handle(self, *args, **options):
+        threshold = get_threshold() if options['threshold'] is None else options['threshold']
+        for site in each_site():
+            started = time.perf_counter()
+            candidates, stats = find_duplicates(threshold)
+            elapsed = time.perf_counter() - started
+            if not options['dry_run']:
+                record_candidates(candidates)
+            all_pairs = stats['farmers'] * (stats['farmers'] - 1) // 2
+            self.stdout.write(self.style.SUCCESS(
+                f"{site_name(site)}: {len(candidates)} candidate(s) at score >= {threshold} among "
+                f"{stats['farmers']} farmer(s) in {elapsed:.1f}s; {stats['comparisons']} pair(s) compared "
+                f"in {stats['blocks']} block(s) instead of {all_pairs}."
+            ))
+            if stats['keys_fixed']:
+                self.stdout.write(f"  blocking keys updated on {stats['keys_fixed']} farmer(s)")
+            names = dict(Farmer.objects.filter(
+                pk__in={farmer_id for candidate in candidates[:options['top']]
+                        for farmer_id in (candidate.farmer_id, candidate.other_id)},
+            ).values_list('pk', 'farmer_name'))
+            for candidate in candidates[:options['top']]:
+                self.stdout.write(
+                    f"  {candidate.score:.3f}  {candidate.farmer_id:>8} {names[candidate.farmer_id]:25} "
+                    f"{candidate.other_id:>8} {names[candidate.other_id]:25} {', '.join(candidate.reasons)}"
+                )
@@ -0,0 +1,50 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import localdate
+
+from app2.statements import generate_statements, get_workers, weasyprint
+
+
+def previous_month():
+    first = localdate().replace(day=1)
+    last_month = date.fromordinal(first.toordinal() - 1)
+    return f"{last_month:%Y-%m}"
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes the monthly statement of every farmer (requests, purchases and outstanding feed payments) "
+        "as HTML, and PDF when weasyprint is installed, rendered in a pool of worker processes. "
+        "An interrupted run picks up where it stopped when started again for the same month."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Directory to write the statements to, one subdirectory per month.")
+        parser.add_argument('--month', default=None, help="YYYY-MM, defaults to last month.")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Rendering processes, defaults to the number of cores.")
+        parser.add_argument('--chunk-size', type=int, default=500, help="Farmers loaded and rendered together.")
+        parser.add_argument('--no-pdf', action='store_true', help="Only write HTML.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Regenerate every statement instead of resuming.")
+
+    def handle(self, *args, **options):
+        month = options['month'] or previous_month()
+        try:
+            date.fromisoformat(f"{month}-01")
+        except ValueError:
+            raise CommandError(f"--month must look like 2025-01, not {month!r}.")
+        if weasyprint is None and not options['no_pdf']:
+            self.stdout.write("weasyprint is not installed, writing HTML statements only.")
+        manifest = generate_statements(
+            options['path'], month, options['workers'] or get_workers(), options['chunk_size'],
+            pdf=False if options['no_pdf'] else None, restart=options['restart'],
+            progress=self.report_chunk if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{manifest['statements']} statement(s) for {month} written to {options['path']}."
+        ))
+
+    def report_chunk(self, site, written):
+        self.stdout.write(f"  {site}: {written} statement(s)")
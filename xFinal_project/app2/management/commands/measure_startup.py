@@ -0,0 +1,124 @@
+import json
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+# Runs in a fresh interpreter: starts the WSGI application the way
+# chicks.wsgi does, optionally warms it up, then times two requests.
+PROBE = r'''
+import io, json, os, sys, time
+started = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chicks.settings')
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+timings = {'startup': time.perf_counter() - started}
+if sys.argv[2] == 'warm':
+    from app2.warmup import warm_up
+    timings['warm_up'] = warm_up()
+from django.conf import settings
+host = next((h for h in settings.ALLOWED_HOSTS if '*' not in h), 'localhost').lstrip('.')
+
+def get(path):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': host,
+        'SERVER_PORT': '80', 'HTTP_HOST': host, 'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+        'wsgi.multithread': False, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    status = []
+    request_started = time.perf_counter()
+    response = application(environ, lambda line, headers, exc_info=None: status.append(line))
+    b''.join(response)
+    response.close()
+    return time.perf_counter() - request_started, status[0]
+
+timings['first_request'], timings['status'] = get(sys.argv[1])
+timings['second_request'], _ = get(sys.argv[1])
+print(json.dumps(timings))
+'''
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+# One cold start in a new interpreter. Returns the probe's timings and the
+# -X importtime lines as (module, self seconds, cumulative seconds, depth).
+def run_probe(path, warm):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE, path, 'warm' if warm else 'cold'],
+        cwd=settings.BASE_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise CommandError(f"Startup probe failed:\n{result.stderr[-2000:]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            own, cumulative, indent, module = match.groups()
+            imports.append((module, int(own) / 1e6, int(cumulative) / 1e6, len(indent) // 2))
+    return json.loads(result.stdout.strip().splitlines()[-1]), imports
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures cold starts in fresh interpreters: import time per module, application startup, "
+        "each warm-up step, and the latency of the first and second request with and without the "
+        "warm-up, against COLD_START_TARGET_MS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help="Page requested, defaults to the login page.")
+        parser.add_argument('--runs', type=int, default=5, help="Cold starts measured per variant (median).")
+        parser.add_argument('--top', type=int, default=20, help="Modules listed in the import table.")
+
+    def handle(self, *args, **options):
+        path = options['path'] or reverse('loginpage')
+        runs = {
+            warm: [run_probe(path, warm) for _ in range(options['runs'])]
+            for warm in (False, True)
+        }
+        self.report_imports([imports for _, imports in runs[True]], options['top'])
+        self.report_startup({warm: [timings for timings, _ in probes] for warm, probes in runs.items()}, path)
+
+    def report_imports(self, runs, top):
+        own = defaultdict(list)
+        cumulative = defaultdict(list)
+        packages = defaultdict(float)
+        for imports in runs:
+            for module, own_seconds, cumulative_seconds, _ in imports:
+                own[module].append(own_seconds)
+                cumulative[module].append(cumulative_seconds)
+                packages[module.split('.')[0]] += own_seconds / len(runs)
+        self.stdout.write(f"Import time by package (average of {len(runs)} cold start(s), ms):")
+        for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+            self.stdout.write(f"  {package:40} {seconds * 1000:>8.1f}")
+        self.stdout.write("Slowest modules (ms, own / including their imports):")
+        medians = {module: statistics.median(values) for module, values in own.items()}
+        for module in sorted(medians, key=lambda module: -medians[module])[:top]:
+            self.stdout.write(
+                f"  {module:60} {medians[module] * 1000:>8.1f} {statistics.median(cumulative[module]) * 1000:>8.1f}"
+            )
+
+    def report_startup(self, runs, path):
+        def median(samples, key):
+            return statistics.median(sample[key] for sample in samples) * 1000
+
+        self.stdout.write(f"Cold start, GET {path} (ms):")
+        self.stdout.write(f"  {'':24} {'no warm-up':>11} {'warm-up':>11}")
+        for key in ('startup', 'first_request', 'second_request'):
+            self.stdout.write(f"  {key:24} {median(runs[False], key):>11.1f} {median(runs[True], key):>11.1f}")
+        for step in runs[True][0]['warm_up']:
+            seconds = statistics.median(sample['warm_up'][step] for sample in runs[True]) * 1000
+            self.stdout.write(f"  warm-up: {step:15} {'':>11} {seconds:>11.1f}")
+        target = getattr(settings, 'COLD_START_TARGET_MS', 50)
+        first = median(runs[True], 'first_request')
+        style = self.style.SUCCESS if first <= target else self.style.ERROR
+        self.stdout.write(style(
+            f"First request after a warmed-up start: {first:.1f} ms (target {target} ms, status "
+            f"{runs[True][0]['status']})."
+        ))
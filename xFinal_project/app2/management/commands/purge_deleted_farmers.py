@@ -0,0 +1,70 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils.timezone import now
+
+from app2.models import FarmerDeletion
+from app2.purge import DEFAULT_CHUNK_SIZE, run_deletion
+from app2.sites import override
+
+
+class Command(BaseCommand):
+    help = (
+        "Works through queued farmer deletions: removes each tombstoned farmer's requests, sales and "
+        "other rows in bounded chunks, one short transaction per chunk, reporting progress on the job."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--claim-timeout', type=int, default=300,
+                            help="Seconds without progress after which a running job is picked up again.")
+        parser.add_argument('--poll-interval', type=float, default=5,
+                            help="Seconds to sleep when no deletion is queued.")
+        parser.add_argument('--once', action='store_true', help="Exit once no deletion is queued.")
+
+    def handle(self, *args, **options):
+        while True:
+            job = self.claim_job(options['claim_timeout'])
+            if job:
+                self.process(job, options['chunk_size'])
+                continue
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
+
+    # Same conditional-UPDATE claim as send_notifications. A job whose worker
+    # died resumes where it stopped, since every finished chunk is committed.
+    def claim_job(self, claim_timeout):
+        current = now()
+        claimable = (
+            Q(status='pending')
+            | Q(status='running', updated_at__lt=current - timedelta(seconds=claim_timeout))
+        )
+        for job_id in FarmerDeletion.objects.filter(claimable).order_by('created_at').values_list('pk', flat=True)[:5]:
+            if FarmerDeletion.objects.filter(claimable, pk=job_id).update(status='running', updated_at=current):
+                job = FarmerDeletion.objects.get(pk=job_id)
+                if job.started_at is None:
+                    job.started_at = current
+                    job.save(update_fields=['started_at'])
+                return job
+        return None
+
+    def process(self, job, chunk_size):
+        self.stdout.write(f"Deleting farmer {job.farmer_id} ({job.farmer_name})...")
+        try:
+            # the farmer's rows live at (and in the database of) their site
+            with override(job.site):
+                run_deletion(job, chunk_size)
+        except Exception as exc:
+            job.status = 'failed'
+            job.last_error = str(exc)
+            job.save(update_fields=['status', 'last_error', 'updated_at'])
+            self.stderr.write(f"  failed: {exc}")
+            return
+        job.status = 'done'
+        job.finished_at = now()
+        job.save(update_fields=['status', 'finished_at', 'updated_at'])
+        summary = ', '.join(f"{count} {label}" for label, count in job.progress.items())
+        self.stdout.write(self.style.SUCCESS(f"  done: {summary}"))
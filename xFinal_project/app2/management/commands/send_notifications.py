@@ -0,0 +1,123 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils.timezone import now
+
+from app2.models import Farmer, Notification
+from app2.notifications import get_providers, render_message
+from app2.sites import each_site
+
+
+class Command(BaseCommand):
+    help = (
+        "Drains the notification outbox: claims due notifications in batches, delivers them "
+        "through every configured provider concurrently and retries failures with exponential backoff."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=8, help="Messages delivered in parallel.")
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--backoff', type=float, default=30,
+                            help="Seconds before the first retry; doubles with every attempt.")
+        parser.add_argument('--claim-timeout', type=int, default=300,
+                            help="Seconds after which a batch claimed by a dead worker is picked up again.")
+        parser.add_argument('--poll-interval', type=float, default=5,
+                            help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument('--once', action='store_true', help="Exit once no notification is due.")
+
+    def handle(self, *args, **options):
+        providers = get_providers()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            while True:
+                claimed = 0
+                # the outbox of every site, in its own database when the router splits them
+                for site in each_site():
+                    batch = self.claim_batch(options['batch_size'], options['claim_timeout'])
+                    if batch:
+                        self.deliver(pool, providers, batch, options)
+                        claimed += len(batch)
+                if claimed:
+                    continue
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+
+    # Claims with a conditional UPDATE so several workers never send the same
+    # row. Every claim gets its own token: a worker that outlived its claim
+    # timeout finds its rows taken over and writes nothing back.
+    def claim_batch(self, batch_size, claim_timeout):
+        current = now()
+        token = uuid.uuid4().hex
+        claimable = (
+            Q(status='pending', next_attempt_at__lte=current)
+            | Q(status='sending', claimed_at__lt=current - timedelta(seconds=claim_timeout))
+        )
+        ids = list(Notification.objects.filter(claimable).order_by('next_attempt_at')
+                   .values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+        Notification.objects.filter(claimable, pk__in=ids).update(
+            status='sending', claimed_at=current, claimed_by=token,
+        )
+        # rows another worker claimed between the two statements are left to it
+        return list(Notification.objects.filter(pk__in=ids, status='sending', claimed_by=token))
+
+    def deliver(self, pool, providers, batch, options):
+        farmers = Farmer.all_objects.in_bulk({notification.farmer_id for notification in batch})
+        jobs = []
+        errors = {}
+        # a message that cannot be rendered will not render on a retry either
+        unrenderable = set()
+        for notification in batch:
+            farmer = farmers[notification.farmer_id]
+            try:
+                subject, body = render_message(notification, farmer)
+            except Exception as exc:
+                errors[notification.pk] = [f"render: {exc}"]
+                unrenderable.add(notification.pk)
+                continue
+            for channel, provider in providers.items():
+                if channel not in notification.delivered_channels:
+                    future = pool.submit(provider.send, provider.recipient(farmer), subject, body)
+                    jobs.append((notification, channel, future))
+
+        for notification, channel, future in jobs:
+            try:
+                future.result()
+            except Exception as exc:
+                errors.setdefault(notification.pk, []).append(f"{channel}: {exc}")
+            else:
+                notification.delivered_channels.append(channel)
+
+        current = now()
+        token = batch[0].claimed_by
+        sent = failed = 0
+        for notification in batch:
+            notification.attempts += 1
+            notification.claimed_at = None
+            notification.claimed_by = ''
+            if notification.pk not in errors:
+                notification.status = 'sent'
+                notification.sent_at = current
+                notification.last_error = ''
+                sent += 1
+                continue
+            notification.last_error = '\n'.join(errors[notification.pk])
+            if notification.attempts >= options['max_attempts'] or notification.pk in unrenderable:
+                notification.status = 'failed'
+                failed += 1
+            else:
+                notification.status = 'pending'
+                delay = options['backoff'] * 2 ** (notification.attempts - 1)
+                notification.next_attempt_at = current + timedelta(seconds=delay)
+        Notification.objects.filter(claimed_by=token).bulk_update(batch, [
+            'status', 'attempts', 'claimed_at', 'claimed_by', 'sent_at', 'last_error', 'next_attempt_at',
+            'delivered_channels',
+        ])
+        retrying = len(batch) - sent - failed
+        self.stdout.write(f"Batch of {len(batch)}: {sent} sent, {retrying} to retry, {failed} failed.")
@@ -0,0 +1,31 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from app2.receivables import refresh_balances, snapshot_ageing
+from app2.sites import each_site, site_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Daily receivables job: writes the 0-30 / 31-60 / 60+ days ageing snapshot of every farmer's "
+        "open sales with one grouped query. Run it from cron once a day."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, default=None,
+                            help="Snapshot date (YYYY-MM-DD), defaults to today.")
+        parser.add_argument('--rebuild-balances', action='store_true',
+                            help="Also recompute every farmer's outstanding balance from scratch.")
+
+    def handle(self, *args, **options):
+        snapshot_date = options['date'] or now().date()
+        for site in each_site():
+            if options['rebuild_balances']:
+                refresh_balances()
+                self.stdout.write(f"{site_name(site)}: farmer balances rebuilt.")
+            written = snapshot_ageing(snapshot_date)
+            self.stdout.write(self.style.SUCCESS(
+                f"{site_name(site)}: ageing snapshot for {snapshot_date}: {written} farmer(s)."
+            ))
@@ -0,0 +1,108 @@
+import re
+import unicodedata
+
+try:
+    from rapidfuzz.distance import JaroWinkler, Levenshtein
+except ImportError:  # optional, the pure Python versions below are used without it
+    JaroWinkler = Levenshtein = None
+
+SOUNDEX_CODES = {
+    letter: str(code)
+    for code, letters in enumerate(('aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'))
+    for letter in letters
+}
+
+
+# Lower case ASCII letters and spaces: accents dropped, punctuation and
+# digits turned into spaces
+def fold(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return re.sub(r'[^a-z]+', ' ', text).strip()
+
+
+def soundex(word):
+    word = ''.join(letter for letter in word if letter in SOUNDEX_CODES)
+    if not word:
+        return ''
+    codes = []
+    previous = SOUNDEX_CODES[word[0]]
+    for letter in word[1:]:
+        code = SOUNDEX_CODES[letter]
+        if code != '0' and code != previous:
+            codes.append(code)
+        # h and w do not separate two letters with the same code, vowels do
+        if letter not in 'hw':
+            previous = code
+    return (word[0].upper() + ''.join(codes) + '000')[:4]
+
+
+# The name's words in alphabetical order, so "Okello John" and "John Okello"
+# compare as the same name
+def normalise_name(name):
+    return ' '.join(sorted(fold(name).split()))
+
+
+# Phonetic blocking key of a name: the sorted Soundex codes of its words
+def name_key(name):
+    return ' '.join(sorted({soundex(word) for word in fold(name).split()}))[:50]
+
+
+# The last nine digits, the subscriber number without the 0 or +256 prefix
+def phone_key(phone):
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[-9:]
+
+
+def nin_key(nin):
+    return re.sub(r'[^0-9A-Z]', '', (nin or '').upper())
+
+
+def jaro_winkler(a, b):
+    if JaroWinkler is not None:
+        return JaroWinkler.similarity(a, b)
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    window = max(len(a), len(b)) // 2 - 1
+    a_matched = [False] * len(a)
+    b_matched = [False] * len(b)
+    matches = 0
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not b_matched[j] and b[j] == char:
+                a_matched[i] = b_matched[j] = True
+                matches += 1
+                break
+    if not matches:
+        return 0.0
+    b_chars = [char for char, matched in zip(b, b_matched) if matched]
+    a_chars = [char for char, matched in zip(a, a_matched) if matched]
+    transpositions = sum(x != y for x, y in zip(a_chars, b_chars)) / 2
+    jaro = (matches / len(a) + matches / len(b) + (matches - transpositions) / matches) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+# 1 - edit distance / length of the longer string: one mistyped character in
+# a 14 character NIN still scores 0.93, while two unrelated NINs sharing the
+# usual prefix score low (Jaro-Winkler would rate them close)
+def edit_similarity(a, b):
+    if Levenshtein is not None:
+        return Levenshtein.normalized_similarity(a, b)
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return 1 - previous[-1] / max(len(a), len(b))
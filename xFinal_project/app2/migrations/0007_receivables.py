@@ -0,0 +1,60 @@
+# Generated by Django 4.2.23 on 2026-10-19 11:55
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+import django.db.models.deletion
+
+
+# balances for the sales that exist before the signals start maintaining them
+def populate_balances(apps, schema_editor):
+    Sale = apps.get_model('app2', 'Sale')
+    FarmerBalance = apps.get_model('app2', 'FarmerBalance')
+    rows = Sale.objects.filter(payment_status__in=('pending', 'partially_paid')).values('customer_id').annotate(
+        outstanding=Sum('amount'), open_sales=Count('pk'), next_due_date=Min('feed_payment_due_date'),
+    )
+    FarmerBalance.objects.bulk_create([
+        FarmerBalance(farmer_id=row['customer_id'], outstanding=row['outstanding'],
+                      open_sales=row['open_sales'], next_due_date=row['next_due_date'])
+        for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app2', '0006_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReceivablesSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot_date', models.DateField()),
+                ('current', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('days_0_30', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('days_31_60', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('days_over_60', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('farmer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='receivables_snapshots', to='app2.farmer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FarmerBalance',
+            fields=[
+                ('farmer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='app2.farmer')),
+                ('outstanding', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('open_sales', models.PositiveIntegerField(default=0)),
+                ('next_due_date', models.DateField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_due_date', 'outstanding'], name='app2_farmer_next_du_b57ccb_idx'), models.Index(fields=['-outstanding'], name='app2_farmer_outstan_2bf3d8_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='receivablessnapshot',
+            constraint=models.UniqueConstraint(fields=('snapshot_date', 'farmer'), name='unique_snapshot_per_farmer'),
+        ),
+        migrations.RunPython(populate_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.23 on 2026-10-19 12:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app2', '0007_receivables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedChickRequest',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('farmer_type', models.CharField(choices=[('Starter', 'Starter'), ('Returning', 'Returning')], max_length=10)),
+                ('chick_type', models.CharField(choices=[('Broilers', 'Broilers'), ('Layers', 'Layers')], max_length=15)),
+                ('chick_breed', models.CharField(choices=[('local', 'Local'), ('exotic', 'Exotic')], max_length=15)),
+                ('quantity_requested', models.PositiveIntegerField()),
+                ('request_date', models.DateTimeField(db_index=True)),
+                ('chick_period', models.PositiveIntegerField(default=0)),
+                ('took_feeds', models.CharField(choices=[('YES', 'Yes'), ('NO', 'No')], max_length=3)),
+                ('request_status', models.CharField(choices=[('Pending', 'Pending'), ('Approved', 'Approved'), ('Rejected', 'Rejected'), ('Fulfilled', 'Fulfilled')], max_length=10)),
+                ('delivered', models.CharField(choices=[('YES', 'Yes'), ('NO', 'No')], max_length=3)),
+                ('delivery_date', models.DateField(blank=True, null=True)),
+                ('payment_status', models.CharField(choices=[('pending', 'Pending'), ('paid', 'Paid'), ('partially paid', 'Partially Paid')], max_length=15)),
+                ('approval_date', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('farmer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_requests', to='app2.farmer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedSale',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('sale_date', models.DateTimeField(db_index=True)),
+                ('quantity_sold', models.PositiveIntegerField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('feed_bags_eligible', models.PositiveIntegerField(default=2)),
+                ('feed_payment_due_date', models.DateField()),
+                ('payment_status', models.CharField(choices=[('pending', 'Pending'), ('paid', 'Paid'), ('partially_paid', 'Partially Paid'), ('refunded', 'Refunded'), ('cancelled', 'Cancelled')], max_length=15)),
+                ('payment_method', models.CharField(choices=[('cash', 'Cash'), ('credit_card', 'Credit Card'), ('mobile_money', 'Mobile Money')], max_length=20)),
+                ('notes', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('chick_request', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sale', to='app2.archivedchickrequest')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_sales', to='app2.farmer')),
+            ],
+        ),
+    ]
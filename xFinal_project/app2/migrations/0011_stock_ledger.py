@@ -0,0 +1,76 @@
+# Generated by Django 4.2.23 on 2026-10-19 12:09
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# opening balance of every stock row that exists before the ledger starts
+def record_opening_balances(apps, schema_editor):
+    ChickStock = apps.get_model('app2', 'ChickStock')
+    FeedStock = apps.get_model('app2', 'FeedStock')
+    StockMovement = apps.get_model('app2', 'StockMovement')
+    movements = [
+        StockMovement(item_kind='chick', item_id=stock.pk,
+                      item_label=f"{stock.batch_number} ({stock.chick_type} {stock.chick_breed})",
+                      delta=stock.chick_quantity, unit_value=stock.chick_price, reason='opening')
+        for stock in ChickStock.objects.all()
+    ] + [
+        StockMovement(item_kind='feed', item_id=feed.pk, item_label=f"{feed.name} ({feed.feed_brand})",
+                      delta=feed.quantity, unit_value=feed.unit_price, reason='opening')
+        for feed in FeedStock.objects.all()
+    ]
+    StockMovement.objects.bulk_create(movements, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app2', '0010_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_kind', models.CharField(choices=[('chick', 'Chicks'), ('feed', 'Feed')], max_length=5)),
+                ('item_id', models.BigIntegerField()),
+                ('item_label', models.CharField(max_length=100)),
+                ('delta', models.IntegerField()),
+                ('unit_value', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('reason', models.CharField(choices=[('opening', 'Opening Balance'), ('received', 'Received'), ('adjustment', 'Adjustment'), ('request_approved', 'Request Approved'), ('feed_issued', 'Feed Issued With Sale'), ('revalued', 'Revalued'), ('removed', 'Removed')], max_length=20)),
+                ('source_type', models.CharField(blank=True, max_length=30)),
+                ('source_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(db_index=True)),
+                ('item_kind', models.CharField(choices=[('chick', 'Chicks'), ('feed', 'Feed')], max_length=5)),
+                ('item_id', models.BigIntegerField()),
+                ('item_label', models.CharField(max_length=100)),
+                ('quantity', models.IntegerField()),
+                ('unit_value', models.DecimalField(decimal_places=2, max_digits=12)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='stocksnapshot',
+            constraint=models.UniqueConstraint(fields=('taken_at', 'item_kind', 'item_id'), name='unique_stock_snapshot_item'),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='created_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['item_kind', 'item_id', 'created_at'], name='app2_stockm_item_ki_dfed68_idx'),
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
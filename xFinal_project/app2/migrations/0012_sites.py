@@ -0,0 +1,113 @@
+# Generated by Django 4.2.23 on 2026-10-19 12:20
+
+import app2.sites
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app2', '0011_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='stocksnapshot',
+            name='unique_stock_snapshot_item',
+        ),
+        migrations.AddField(
+            model_name='archivedchickrequest',
+            name='site',
+            field=models.CharField(default=app2.sites.current_or_default_site, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='archivedsale',
+            name='site',
+            field=models.CharField(default=app2.sites.current_or_default_site, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='chickrequest',
+            name='site',
+            field=models.CharField(default=app2.sites.current_or_default_site, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='chickstock',
+            name='site',
+            field=models.CharField(default=app2.sites.current_or_default_site, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='farmer',
+            name='site',
+            field=models.CharField(default=app2.sites.current_or_default_site, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='farmerdeletion',
+            name='site',
+            field=models.CharField(default=app2.sites.current_or_default_site, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='feedstock',
+            name='site',
+            field=models.CharField(default=app2.sites.current_or_default_site, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='site',
+            field=models.CharField(default=app2.sites.current_or_default_site, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='site',
+            field=models.CharField(default=app2.sites.current_or_default_site, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='stocksnapshot',
+            name='site',
+            field=models.CharField(default=app2.sites.current_or_default_site, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='site',
+            field=models.CharField(default=app2.sites.get_default_site, max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='chickrequest',
+            index=models.Index(fields=['site', 'request_status', 'request_date'], name='app2_chickr_site_f570ba_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chickrequest',
+            index=models.Index(fields=['site', 'request_date'], name='app2_chickr_site_91f17e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chickstock',
+            index=models.Index(fields=['site', 'chick_type', 'chick_breed'], name='app2_chicks_site_72587d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='farmer',
+            index=models.Index(fields=['site', 'farmer_name'], name='app2_farmer_site_373fd3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='farmer',
+            index=models.Index(fields=['site', 'registration_date'], name='app2_farmer_site_cee409_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedstock',
+            index=models.Index(fields=['site', 'name'], name='app2_feedst_site_46d224_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['site', 'sale_date'], name='app2_sale_site_978c45_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['site', 'payment_status'], name='app2_sale_site_5834bb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['site', 'created_at'], name='app2_stockm_site_aa297a_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='stocksnapshot',
+            constraint=models.UniqueConstraint(fields=('site', 'taken_at', 'item_kind', 'item_id'), name='unique_stock_snapshot_item'),
+        ),
+    ]
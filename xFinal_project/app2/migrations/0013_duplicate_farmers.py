@@ -0,0 +1,90 @@
+# Generated by Django 4.2.23 on 2026-10-19 12:48
+
+import app2.sites
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from app2.matching import name_key, phone_key
+
+
+# blocking keys of the farmers registered before save() started setting them
+def populate_blocking_keys(apps, schema_editor):
+    Farmer = apps.get_model('app2', 'Farmer')
+    manager = Farmer._base_manager.db_manager(schema_editor.connection.alias)
+    farmers = []
+    for farmer in manager.only('farmer_name', 'phone_number').iterator(chunk_size=2000):
+        farmer.name_key = name_key(farmer.farmer_name)
+        farmer.phone_key = phone_key(farmer.phone_number)
+        farmers.append(farmer)
+        if len(farmers) >= 2000:
+            manager.bulk_update(farmers, ['name_key', 'phone_key'])
+            farmers = []
+    manager.bulk_update(farmers, ['name_key', 'phone_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app2', '0012_sites'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('farmer_id', models.BigIntegerField()),
+                ('other_id', models.BigIntegerField()),
+                ('score', models.FloatField()),
+                ('reasons', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('merged', 'Merged'), ('dismissed', 'Not a duplicate')], default='open', max_length=10)),
+                ('found_at', models.DateTimeField(auto_now_add=True)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('kept_id', models.BigIntegerField(blank=True, null=True)),
+                ('moved', models.JSONField(default=dict)),
+                ('site', models.CharField(default=app2.sites.current_or_default_site, max_length=20)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='farmer',
+            name='name_key',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='farmer',
+            name='phone_key',
+            field=models.CharField(blank=True, editable=False, max_length=15),
+        ),
+        migrations.AddIndex(
+            model_name='farmer',
+            index=models.Index(fields=['site', 'name_key'], name='app2_farmer_site_c3b917_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='farmer',
+            index=models.Index(fields=['site', 'phone_key'], name='app2_farmer_site_5beeb1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='farmer',
+            index=models.Index(fields=['site', 'date_of_birth'], name='app2_farmer_site_be9221_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='farmer',
+            index=models.Index(fields=['site', 'recommender_nin'], name='app2_farmer_site_288eda_idx'),
+        ),
+        migrations.AddField(
+            model_name='duplicatecandidate',
+            name='resolved_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='duplicatecandidate',
+            index=models.Index(fields=['site', 'status', '-score'], name='app2_duplic_site_30c34d_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='duplicatecandidate',
+            constraint=models.UniqueConstraint(fields=('farmer_id', 'other_id'), name='unique_duplicate_candidate'),
+        ),
+        migrations.RunPython(populate_blocking_keys, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,11 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 
+from .concurrency import VersionedModel
+from .matching import name_key, phone_key
+from .sites import SiteManager, current_or_default_site, get_default_site, site_databases
+
 class UserProfile(models.Model):
     ROLE_CHOICES = (
         ('brooder_manager', 'Brooder Manager'),
@@ -8,11 +13,30 @@ class UserProfile(models.Model):
     )
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+    # brooder site the user works at, see BROODER_SITES
+    site = models.CharField(max_length=20, default=get_default_site)
     def __str__(self):
         return f"{self.user.username} ({self.get_role_display()})"
 
+# Farmers waiting for their background delete are hidden everywhere
+class ActiveFarmerManager(SiteManager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+# Every farmer, tombstones included, without site scoping
+class AllFarmersManager(models.Manager):
+    # The given values of a unique field (farmer_nin, email) some farmer already
+    # holds. The database constraint only covers one database, so every site
+    # database is asked.
+    def taken(self, field, values):
+        values = list(values)
+        taken = set()
+        for database in site_databases():
+            taken.update(self.using(database).filter(**{f'{field}__in': values}).values_list(field, flat=True))
+        return taken
+
 # Farmer model for non-authenticated users (farmers don't login)
-class Farmer(models.Model):
+class Farmer(VersionedModel):
     GENDER_CHOICES = [
         ('Male', 'Male'),
         ('Female', 'Female'),
@@ -21,7 +45,7 @@ class Farmer(models.Model):
         ('Starter', 'Starter'),
         ('Returning', 'Returning'),
     ]
-    farmer_name = models.CharField(max_length=50)
+    farmer_name = models.CharField(max_length=50, db_index=True)
     date_of_birth = models.DateField()
     gender = models.CharField(max_length=10, choices=GENDER_CHOICES)
     farmer_nin = models.CharField(max_length=30, unique=True)
@@ -32,12 +56,76 @@ class Farmer(models.Model):
     email = models.EmailField(max_length=50, unique=True)
     recommender_tel = models.CharField(max_length=15)
     farmer_type = models.CharField(max_length=10, choices=FARMER_CHOICES)
-    registration_date = models.DateTimeField(auto_now_add=True)
+    registration_date = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # tombstone set by farmer_delete; purge_deleted_farmers removes the rows later
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    site = models.CharField(max_length=20, default=current_or_default_site)
+    # blocking keys of the duplicate check (app2.dedupe), kept in step with
+    # farmer_name and phone_number by save()
+    name_key = models.CharField(max_length=50, blank=True, editable=False)
+    phone_key = models.CharField(max_length=15, blank=True, editable=False)
+
+    objects = ActiveFarmerManager()
+    # every site, tombstones included: the nin and email are unique across
+    # sites, check new ones with all_objects.taken()
+    all_objects = AllFarmersManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['site', 'farmer_name']),
+            models.Index(fields=['site', 'registration_date']),
+            models.Index(fields=['site', 'name_key']),
+            models.Index(fields=['site', 'phone_key']),
+            models.Index(fields=['site', 'date_of_birth']),
+            models.Index(fields=['site', 'recommender_nin']),
+        ]
+
     def __str__(self):
         return self.farmer_name
 
+    # bulk_create skips save(), callers set the keys themselves
+    def set_blocking_keys(self):
+        self.name_key = name_key(self.farmer_name)
+        self.phone_key = phone_key(self.phone_number)
+
+    def save(self, *args, **kwargs):
+        self.set_blocking_keys()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'farmer_name', 'phone_number'}.intersection(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'name_key', 'phone_key'}
+        super().save(*args, **kwargs)
+
+# Stock rows remember the quantity and unit value they were loaded with, so
+# the post_save signal can append the difference to the stock ledger
+class LedgerTracked:
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_ledger_values()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.remember_ledger_values()
+
+    def remember_ledger_values(self):
+        self._ledger_loaded = (
+            self.__dict__.get(self.LEDGER_QUANTITY_FIELD), self.__dict__.get(self.LEDGER_VALUE_FIELD),
+        )
+
+    def ledger_quantity(self):
+        return getattr(self, self.LEDGER_QUANTITY_FIELD)
+
+    def ledger_unit_value(self):
+        return getattr(self, self.LEDGER_VALUE_FIELD) or 0
+
 # Chick Stock: available chicks for sale
-class ChickStock(models.Model):
+class ChickStock(LedgerTracked, VersionedModel):
+    LEDGER_KIND = 'chick'
+    LEDGER_QUANTITY_FIELD = 'chick_quantity'
+    LEDGER_VALUE_FIELD = 'chick_price'
+
     CHICK_TYPE_CHOICES = [
         ('Broilers', 'Broilers'),
         ('Layers', 'Layers'),
@@ -54,9 +142,22 @@ class ChickStock(models.Model):
     date_added = models.DateField(auto_now_add=True)
     registered_by = models.CharField(max_length=50)
     chicks_period = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    site = models.CharField(max_length=20, default=current_or_default_site)
+
+    objects = SiteManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['site', 'chick_type', 'chick_breed']),
+        ]
+
     def __str__(self):
         return self.batch_number
 
+    def ledger_label(self):
+        return f"{self.batch_number} ({self.chick_type} {self.chick_breed})"
+
 # Chick Request: farmers request chicks, to be approved by manager
 class ChickRequest(models.Model):
     CHICK_TYPE_CHOICES = [
@@ -91,19 +192,38 @@ class ChickRequest(models.Model):
     chick_type = models.CharField(max_length=15, choices=CHICK_TYPE_CHOICES)
     chick_breed = models.CharField(max_length=15, choices=CHICK_BREED_CHOICES)
     quantity_requested = models.PositiveIntegerField()
-    request_date = models.DateTimeField(auto_now_add=True)
+    request_date = models.DateTimeField(auto_now_add=True, db_index=True)
     chick_period = models.PositiveIntegerField(default=0)
     took_feeds = models.CharField(max_length=3, choices=YES_NO_CHOICES)
-    request_status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
+    request_status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending', db_index=True)
     delivered = models.CharField(max_length=3, choices=YES_NO_CHOICES, default='NO')
     delivery_date = models.DateField(blank=True, null=True)
     payment_status = models.CharField(max_length=15, choices=PAYMENT_STATUS_CHOICES, default='pending')
     approval_date = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    site = models.CharField(max_length=20, default=current_or_default_site)
+
+    objects = SiteManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['site', 'request_status', 'request_date']),
+            models.Index(fields=['site', 'request_date']),
+        ]
+
+    # the status as last read or saved, so live events can send the change of
+    # the pending count instead of recounting (see live.pending_delta)
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get('request_status')
+        return instance
+
     def __str__(self):
         return f"Request by {self.farmer} for {self.quantity_requested} chicks"
 
 # Sales records of fulfilled chick requests
-class Sale(models.Model):
+class Sale(VersionedModel):
     PAYMENT_STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('paid', 'Paid'),
@@ -118,20 +238,35 @@ class Sale(models.Model):
     ]
     customer = models.ForeignKey(Farmer, on_delete=models.CASCADE, related_name='sales')
     chick_request = models.OneToOneField(ChickRequest, on_delete=models.SET_NULL, null=True, blank=True, related_name='sale')
-    sale_date = models.DateTimeField(auto_now_add=True)
+    sale_date = models.DateTimeField(auto_now_add=True, db_index=True)
     quantity_sold = models.PositiveIntegerField()
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     feed_bags_eligible = models.PositiveIntegerField(default=2)
     feed_payment_due_date = models.DateField()
-    payment_status = models.CharField(max_length=15, choices=PAYMENT_STATUS_CHOICES, default='pending')
+    payment_status = models.CharField(max_length=15, choices=PAYMENT_STATUS_CHOICES, default='pending', db_index=True)
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES)
     notes = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    site = models.CharField(max_length=20, default=current_or_default_site)
+
+    objects = SiteManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['site', 'sale_date']),
+            models.Index(fields=['site', 'payment_status']),
+        ]
+
     def __str__(self):
         return f"Sale to {self.customer.farmer_name} on {self.sale_date.date()}"
 
 # FeedStock model
-class FeedStock(models.Model):
-    name = models.CharField(max_length=50)
+class FeedStock(LedgerTracked, VersionedModel):
+    LEDGER_KIND = 'feed'
+    LEDGER_QUANTITY_FIELD = 'quantity'
+    LEDGER_VALUE_FIELD = 'unit_price'
+
+    name = models.CharField(max_length=50, db_index=True)
     feed_type = models.CharField(max_length=25)
     feed_brand = models.CharField(max_length=25)
     quantity = models.PositiveIntegerField()
@@ -141,9 +276,299 @@ class FeedStock(models.Model):
     supplier = models.CharField(max_length=255)
     supplier_contact = models.CharField(max_length=15, unique=True)
     date_added = models.DateField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    site = models.CharField(max_length=20, default=current_or_default_site)
+
+    objects = SiteManager()
 
     def __str__(self):
         return self.name
 
+    def ledger_label(self):
+        return f"{self.name} ({self.feed_brand})"
+
+    class Meta:
+        ordering = ['-date_added']
+        indexes = [
+            models.Index(fields=['site', 'name']),
+        ]
+
+# Idempotency keys of records uploaded through the batch sync api, so a
+# retried upload returns the original record instead of creating a duplicate
+class SyncReceipt(models.Model):
+    ITEM_TYPE_CHOICES = [
+        ('farmer', 'Farmer'),
+        ('chick_request', 'Chick Request'),
+    ]
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    item_type = models.CharField(max_length=20, choices=ITEM_TYPE_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    submitted_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.item_type} {self.object_id} ({self.idempotency_key})"
+
+# Outbox of farmer notifications, written in the same transaction as the
+# status change and delivered later by the send_notifications worker
+class Notification(models.Model):
+    EVENT_CHOICES = [
+        ('request_approved', 'Request Approved'),
+        ('sale_recorded', 'Sale Recorded'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    event = models.CharField(max_length=30, choices=EVENT_CHOICES)
+    farmer = models.ForeignKey(Farmer, on_delete=models.CASCADE, related_name='notifications')
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # channels already delivered, so a retry only resends the failed ones
+    delivered_channels = models.JSONField(default=list)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # token of the worker run holding the claim; its results are only written
+    # while it still does
+    claimed_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    objects = SiteManager('farmer__site')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_event_display()} for farmer {self.farmer_id} ({self.status})"
+
+# Per-farmer receivables kept up to date whenever a Sale changes, so the
+# collections page never has to scan the sales table
+class FarmerBalance(models.Model):
+    farmer = models.OneToOneField(Farmer, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    outstanding = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    open_sales = models.PositiveIntegerField(default=0)
+    next_due_date = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SiteManager('farmer__site')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_due_date', 'outstanding']),
+            models.Index(fields=['-outstanding']),
+        ]
+
+    def __str__(self):
+        return f"{self.farmer_id}: {self.outstanding} due {self.next_due_date}"
+
+# Daily ageing of each farmer's open sales, written by snapshot_receivables
+class ReceivablesSnapshot(models.Model):
+    snapshot_date = models.DateField()
+    farmer = models.ForeignKey(Farmer, on_delete=models.CASCADE, related_name='receivables_snapshots')
+    current = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    days_0_30 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    days_31_60 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    days_over_60 = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    objects = SiteManager('farmer__site')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['snapshot_date', 'farmer'], name='unique_snapshot_per_farmer'),
+        ]
+
+    def __str__(self):
+        return f"{self.snapshot_date} farmer {self.farmer_id}: {self.total}"
+
+# Cold copies of closed requests and sales, moved out of the hot tables by
+# archive_closed_records. Ids are kept, so an archived sale still points at its
+# (also archived) request and old links keep resolving.
+class ArchivedChickRequest(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    farmer = models.ForeignKey(Farmer, on_delete=models.CASCADE, related_name='archived_requests')
+    farmer_type = models.CharField(max_length=10, choices=ChickRequest.FARMER_TYPES)
+    chick_type = models.CharField(max_length=15, choices=ChickRequest.CHICK_TYPE_CHOICES)
+    chick_breed = models.CharField(max_length=15, choices=ChickRequest.CHICK_BREED_CHOICES)
+    quantity_requested = models.PositiveIntegerField()
+    request_date = models.DateTimeField(db_index=True)
+    chick_period = models.PositiveIntegerField(default=0)
+    took_feeds = models.CharField(max_length=3, choices=ChickRequest.YES_NO_CHOICES)
+    request_status = models.CharField(max_length=10, choices=ChickRequest.STATUS_CHOICES)
+    delivered = models.CharField(max_length=3, choices=ChickRequest.YES_NO_CHOICES)
+    delivery_date = models.DateField(blank=True, null=True)
+    payment_status = models.CharField(max_length=15, choices=ChickRequest.PAYMENT_STATUS_CHOICES)
+    approval_date = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    site = models.CharField(max_length=20, default=current_or_default_site)
+
+    objects = SiteManager()
+
+    def __str__(self):
+        return f"Archived request by {self.farmer} for {self.quantity_requested} chicks"
+
+class ArchivedSale(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(Farmer, on_delete=models.CASCADE, related_name='archived_sales')
+    chick_request = models.OneToOneField(ArchivedChickRequest, on_delete=models.SET_NULL, null=True, blank=True, related_name='sale')
+    sale_date = models.DateTimeField(db_index=True)
+    quantity_sold = models.PositiveIntegerField()
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    feed_bags_eligible = models.PositiveIntegerField(default=2)
+    feed_payment_due_date = models.DateField()
+    payment_status = models.CharField(max_length=15, choices=Sale.PAYMENT_STATUS_CHOICES)
+    payment_method = models.CharField(max_length=20, choices=Sale.PAYMENT_METHOD_CHOICES)
+    notes = models.TextField(blank=True)
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    site = models.CharField(max_length=20, default=current_or_default_site)
+
+    objects = SiteManager()
+
+    def __str__(self):
+        return f"Archived sale to {self.customer.farmer_name} on {self.sale_date.date()}"
+
+# Background delete of a tombstoned farmer and everything that cascades from
+# it, worked through in chunks by purge_deleted_farmers
+class FarmerDeletion(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    # not a ForeignKey: the job outlives the farmer row
+    farmer_id = models.BigIntegerField(db_index=True)
+    farmer_name = models.CharField(max_length=50)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    total = models.PositiveIntegerField(default=0)
+    deleted = models.PositiveIntegerField(default=0)
+    # model label -> rows deleted so far
+    progress = models.JSONField(default=dict)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # the farmer's site, whose database the worker deletes from
+    site = models.CharField(max_length=20, default=current_or_default_site)
+
+    objects = SiteManager()
+
+    def percent_done(self):
+        if self.status == 'done':
+            return 100
+        return int(self.deleted * 100 / self.total) if self.total else 0
+
+    def __str__(self):
+        return f"Delete {self.farmer_name} ({self.status})"
+
+# Append-only stock ledger: one row per change of a ChickStock or FeedStock
+# quantity (or unit value), written by the post_save/post_delete signals.
+# Rows are never updated; item_id is not a ForeignKey so the history outlives
+# a deleted stock row.
+class StockMovement(models.Model):
+    KIND_CHOICES = [
+        ('chick', 'Chicks'),
+        ('feed', 'Feed'),
+    ]
+    REASON_CHOICES = [
+        ('opening', 'Opening Balance'),
+        ('received', 'Received'),
+        ('adjustment', 'Adjustment'),
+        ('request_approved', 'Request Approved'),
+        ('feed_issued', 'Feed Issued With Sale'),
+        ('revalued', 'Revalued'),
+        ('removed', 'Removed'),
+    ]
+    item_kind = models.CharField(max_length=5, choices=KIND_CHOICES)
+    item_id = models.BigIntegerField()
+    item_label = models.CharField(max_length=100)
+    delta = models.IntegerField()
+    unit_value = models.DecimalField(max_digits=12, decimal_places=2)
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    source_type = models.CharField(max_length=30, blank=True)
+    source_id = models.BigIntegerField(null=True, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    # item ids are only unique within a site once sites have their own databases
+    site = models.CharField(max_length=20, default=current_or_default_site)
+
+    objects = SiteManager()
+
     class Meta:
-        ordering = ['-date_added']
\ No newline at end of file
+        indexes = [
+            models.Index(fields=['item_kind', 'item_id', 'created_at']),
+            models.Index(fields=['site', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.item_label}: {self.delta:+d} ({self.reason})"
+
+# Checkpoint of every stock item's quantity and unit value at `taken_at`,
+# written by snapshot_stock; point-in-time inventory starts from the latest
+# checkpoint and only adds the movements after it
+class StockSnapshot(models.Model):
+    taken_at = models.DateTimeField(db_index=True)
+    item_kind = models.CharField(max_length=5, choices=StockMovement.KIND_CHOICES)
+    item_id = models.BigIntegerField()
+    item_label = models.CharField(max_length=100)
+    quantity = models.IntegerField()
+    unit_value = models.DecimalField(max_digits=12, decimal_places=2)
+    site = models.CharField(max_length=20, default=current_or_default_site)
+
+    objects = SiteManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['site', 'taken_at', 'item_kind', 'item_id'], name='unique_stock_snapshot_item'),
+        ]
+
+    def __str__(self):
+        return f"{self.taken_at:%Y-%m-%d %H:%M} {self.item_label}: {self.quantity}"
+
+# Pair of farmers that app2.dedupe thinks may be the same person, ranked by
+# score for review. Farmer ids are not ForeignKeys: a merged candidate is kept
+# as the record of the merge after the duplicate row is purged.
+class DuplicateCandidate(models.Model):
+    STATUS_CHOICES = [
+        ('open', 'Open'),
+        ('merged', 'Merged'),
+        ('dismissed', 'Not a duplicate'),
+    ]
+    # the lower id first, so a pair is stored once
+    farmer_id = models.BigIntegerField()
+    other_id = models.BigIntegerField()
+    score = models.FloatField()
+    # fields that agree, e.g. ["name", "phone"]
+    reasons = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open')
+    found_at = models.DateTimeField(auto_now_add=True)
+    resolved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+    # id of the farmer kept by the merge, and the rows moved to it per model
+    kept_id = models.BigIntegerField(null=True, blank=True)
+    moved = models.JSONField(default=dict)
+    site = models.CharField(max_length=20, default=current_or_default_site)
+
+    objects = SiteManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['farmer_id', 'other_id'], name='unique_duplicate_candidate'),
+        ]
+        indexes = [
+            models.Index(fields=['site', 'status', '-score']),
+        ]
+
+    def __str__(self):
+        return f"Farmers {self.farmer_id} and {self.other_id}: {self.score:.2f} ({self.status})"
@@ -0,0 +1,84 @@
+import json
+import sys
+import threading
+
+from django.conf import settings
+from django.core.mail import send_mail
+from django.utils.module_loading import import_string
+
+from .models import Notification
+
+MESSAGES = {
+    'request_approved': (
+        "Chick request approved",
+        "Hello {farmer_name}, your request #{request_id} for {quantity} chicks has been approved.",
+    ),
+    'sale_recorded': (
+        "Chick sale recorded",
+        "Hello {farmer_name}, your purchase of {quantity} chicks (UGX {amount}) has been recorded. "
+        "Feed payment is due on {due_date}.",
+    ),
+}
+
+
+# Called inside the view's transaction: the request path pays for this one
+# INSERT and the worker does the slow delivery after commit.
+def enqueue(event, farmer_id, **payload):
+    return Notification.objects.create(event=event, farmer_id=farmer_id, payload=payload)
+
+
+def render_message(notification, farmer):
+    subject, body = MESSAGES[notification.event]
+    return subject, body.format(farmer_name=farmer.farmer_name, **notification.payload)
+
+
+# Providers deliver one message to one farmer and raise on failure. They run
+# in worker threads, so they must not touch the database.
+class BaseProvider:
+    def recipient(self, farmer):
+        raise NotImplementedError
+
+    def send(self, recipient, subject, body):
+        raise NotImplementedError
+
+
+class ConsoleProvider(BaseProvider):
+    lock = threading.Lock()
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def recipient(self, farmer):
+        return farmer.phone_number if self.channel == 'sms' else farmer.email
+
+    def send(self, recipient, subject, body):
+        with self.lock:
+            sys.stdout.write(f"[{self.channel}] to {recipient}: {subject} - {body}\n")
+
+
+# Appends one JSON line per message, handy for checking what would be sent.
+class FileProvider(ConsoleProvider):
+    def send(self, recipient, subject, body):
+        line = json.dumps({'channel': self.channel, 'to': recipient, 'subject': subject, 'body': body})
+        with self.lock, open(settings.NOTIFICATION_FILE_PATH, 'a') as outbox_file:
+            outbox_file.write(line + '\n')
+
+
+# Sends through EMAIL_HOST/EMAIL_PORT; locally that is a debug SMTP server:
+#   python -m aiosmtpd -n -l localhost:1025
+class EmailProvider(BaseProvider):
+    def __init__(self, channel):
+        self.channel = channel
+
+    def recipient(self, farmer):
+        return farmer.email
+
+    def send(self, recipient, subject, body):
+        send_mail(subject, body, settings.DEFAULT_FROM_EMAIL, [recipient])
+
+
+def get_providers():
+    return {
+        channel: import_string(path)(channel)
+        for channel, path in settings.NOTIFICATION_PROVIDERS.items()
+    }
@@ -0,0 +1,136 @@
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.timezone import now
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = 'profile'
+
+
+def get_profile_dir():
+    return getattr(settings, 'PROFILER_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+# Samples the call stack of one thread at a fixed interval and counts every
+# distinct stack, which is the "collapsed" input flamegraph tools expect.
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval=0.001):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+# Staff can profile a single request with the X-Profile header or ?profile=1,
+# and PROFILER_SAMPLE_RATE (a percentage) profiles that share of all requests.
+# Keep this last in MIDDLEWARE so csrf and the other process_view hooks still run.
+class ProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def should_profile(self, request):
+        requested = request.headers.get(PROFILE_HEADER) or request.GET.get(PROFILE_PARAM)
+        if requested and request.user.is_authenticated and request.user.is_staff:
+            return True
+        sample_rate = getattr(settings, 'PROFILER_SAMPLE_RATE', 0)
+        return sample_rate > 0 and random.random() * 100 < sample_rate
+
+    # Async views (the live event stream) are left alone: runcall would only
+    # time building their coroutine, and the response would be the coroutine.
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if iscoroutinefunction(view_func) or not self.should_profile(request):
+            return None
+        profiler = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident())
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+        finally:
+            sampler.stop()
+        save_profile(request, profiler, sampler, time.perf_counter() - started)
+        return response
+
+
+def save_profile(request, profiler, sampler, duration):
+    profile_dir = get_profile_dir()
+    os.makedirs(profile_dir, exist_ok=True)
+    url_name = request.resolver_match.url_name if request.resolver_match else None
+    created = now()
+    base = os.path.join(profile_dir, f"{url_name or 'unnamed'}-{created:%Y%m%d-%H%M%S-%f}")
+
+    profiler.dump_stats(base + '.prof')
+    with open(base + '.collapsed', 'w') as collapsed:
+        collapsed.write(sampler.collapsed())
+    with open(base + '.json', 'w') as meta:
+        json.dump({
+            'url_name': url_name,
+            'path': request.get_full_path(),
+            'method': request.method,
+            'user': request.user.username if request.user.is_authenticated else None,
+            'duration_ms': round(duration * 1000, 2),
+            'created': created.isoformat(),
+        }, meta)
+    prune_profiles(profile_dir, getattr(settings, 'PROFILER_KEEP', 200))
+
+
+def prune_profiles(profile_dir, keep):
+    metas = sorted(
+        (name for name in os.listdir(profile_dir) if name.endswith('.json')),
+        key=lambda name: os.path.getmtime(os.path.join(profile_dir, name)),
+        reverse=True,
+    )
+    for name in metas[keep:]:
+        base = os.path.join(profile_dir, name[:-len('.json')])
+        for extension in ('.json', '.prof', '.collapsed'):
+            if os.path.exists(base + extension):
+                os.remove(base + extension)
+
+
+# Newest first, as dictionaries for the staff profiles page.
+def recent_profiles(limit=50):
+    profile_dir = get_profile_dir()
+    if not os.path.isdir(profile_dir):
+        return []
+    metas = sorted(
+        (name for name in os.listdir(profile_dir) if name.endswith('.json')),
+        key=lambda name: os.path.getmtime(os.path.join(profile_dir, name)),
+        reverse=True,
+    )[:limit]
+    profiles = []
+    for name in metas:
+        with open(os.path.join(profile_dir, name)) as meta:
+            profile = json.load(meta)
+        profile['name'] = name[:-len('.json')]
+        profiles.append(profile)
+    return profiles
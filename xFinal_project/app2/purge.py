@@ -0,0 +1,111 @@
+from django.db import models
+from django.utils.timezone import now
+
+from .backup import modified_field
+from .concurrency import VersionedModel
+from .models import Farmer, FarmerDeletion, Notification
+from . import live, sites
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+# Hides the farmer at once and queues the real delete for the worker. Their
+# undelivered notifications are dropped in the same transaction, and live
+# dashboards drop their open requests as if they had been deleted.
+def tombstone_farmer(farmer, user):
+    with sites.atomic():
+        Farmer.all_objects.filter(pk=farmer.pk).update(deleted_at=now(), updated_at=now())
+        Notification.objects.filter(farmer_id=farmer.pk, status__in=('pending', 'sending')).update(
+            status='failed', last_error="Farmer deleted.",
+        )
+        for chick_request in farmer.chickrequest_set.exclude(request_status='Fulfilled'):
+            delta = live.pending_delta(chick_request, deleted=True)
+            live.publish('requests', chick_request.site,
+                         lambda chick_request=chick_request, delta=delta: live.request_payload(chick_request, True, delta),
+                         farmer._state.db)
+        return FarmerDeletion.objects.create(
+            farmer_id=farmer.pk, farmer_name=farmer.farmer_name, requested_by=user, site=farmer.site,
+        )
+
+
+# Reverse relations of `model` as (related model, fk field name, on_delete).
+# Only what the repo's models use is supported: CASCADE, SET_NULL, DO_NOTHING.
+def dependents(model):
+    for relation in model._meta.related_objects:
+        if relation.many_to_many:
+            continue
+        on_delete = relation.on_delete
+        if on_delete not in (models.CASCADE, models.SET_NULL, models.DO_NOTHING):
+            raise ValueError(f"{relation.related_model._meta.label}.{relation.field.name} uses an unsupported on_delete.")
+        yield relation.related_model, relation.field.name, on_delete
+
+
+# queryset.update() skips auto_now, so bulk updates of other tables set the
+# modification time themselves (incremental backups select on it) and bump
+# the version, so open edit forms of these rows see the change as a conflict.
+def stamped(model, updates, stamp=None):
+    updates = dict(updates)
+    modified = modified_field(model)
+    if modified is not None:
+        updates[modified] = stamp or now()
+    if issubclass(model, VersionedModel):
+        updates['version'] = models.F('version') + 1
+    return updates
+
+
+# Rows that deleting everything matched by `filters` will remove, counted with
+# nested subqueries rather than by loading anything.
+def count_cascade(model, filters):
+    queryset = model._base_manager.filter(**filters)
+    total = queryset.count()
+    for related, field_name, on_delete in dependents(model):
+        if on_delete is models.CASCADE:
+            total += count_cascade(related, {f'{field_name}__in': queryset.values('pk')})
+    return total
+
+
+# Clears what points at the given rows: CASCADE relations are purged in chunks,
+# SET_NULL ones nulled with a single UPDATE.
+def clear_dependents(model, pks, chunk_size, report):
+    for related, field_name, on_delete in dependents(model):
+        if on_delete is models.CASCADE:
+            purge(related, {f'{field_name}__in': pks}, chunk_size, report)
+        elif on_delete is models.SET_NULL:
+            related._base_manager.filter(**{f'{field_name}__in': pks}).update(**stamped(related, {field_name: None}))
+
+
+# Deletes the rows matched by `filters` a chunk of primary keys at a time,
+# dependents first, each chunk in its own transaction (or savepoint when
+# called from a parent chunk). Rows are never loaded as model instances and
+# no delete signals are sent; the only receiver, the Sale balance refresh,
+# concerns a farmer whose balance row is deleted too.
+def purge(model, filters, chunk_size, report):
+    queryset = model._base_manager.filter(**filters).order_by()
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        with sites.atomic():
+            clear_dependents(model, pks, chunk_size, report)
+            model._base_manager.filter(pk__in=pks)._raw_delete(model._base_manager.db)
+        report(model, len(pks))
+
+
+def run_deletion(job, chunk_size=DEFAULT_CHUNK_SIZE):
+    if Farmer.objects.filter(pk=job.farmer_id).exists():
+        raise ValueError(f"Farmer {job.farmer_id} is not marked as deleted.")
+    if not job.total:
+        job.total = count_cascade(Farmer, {'pk': job.farmer_id})
+        job.save(update_fields=['total', 'updated_at'])
+
+    def report(model, count):
+        label = model._meta.label
+        job.progress[label] = job.progress.get(label, 0) + count
+        job.deleted += count
+        # also the worker's heartbeat, see purge_deleted_farmers --claim-timeout
+        job.save(update_fields=['progress', 'deleted', 'updated_at'])
+
+    # the farmer's own rows first, outside any transaction so every chunk
+    # commits on its own, then the farmer row itself
+    clear_dependents(Farmer, [job.farmer_id], chunk_size, report)
+    purge(Farmer, {'pk': job.farmer_id}, chunk_size, report)
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from django.db.models import Case, Count, DecimalField, Min, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Farmer, FarmerBalance, ReceivablesSnapshot, Sale
+from . import sites
+
+OPEN_PAYMENT_STATUSES = ('pending', 'partially_paid')
+ZERO = Value(0, output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def open_sales():
+    return Sale.objects.filter(payment_status__in=OPEN_PAYMENT_STATUSES)
+
+
+# Recomputes the balance rows of the given farmers from their open sales with
+# one grouped query and one upsert. Called for the single customer of a
+# saved/deleted Sale, and for every farmer by the nightly job.
+def refresh_balances(farmer_ids=None):
+    sales = open_sales()
+    farmers = Farmer.objects.all()
+    if farmer_ids is not None:
+        farmer_ids = set(farmer_ids)
+        sales = sales.filter(customer_id__in=farmer_ids)
+        farmers = farmers.filter(pk__in=farmer_ids)
+    totals = {
+        row['customer_id']: row
+        for row in sales.values('customer_id').annotate(
+            outstanding=Sum('amount'), open_sales=Count('pk'), next_due_date=Min('feed_payment_due_date'),
+        )
+    }
+    balances = [
+        FarmerBalance(
+            farmer_id=farmer_id,
+            outstanding=totals.get(farmer_id, {}).get('outstanding') or 0,
+            open_sales=totals.get(farmer_id, {}).get('open_sales') or 0,
+            next_due_date=totals.get(farmer_id, {}).get('next_due_date'),
+        )
+        for farmer_id in farmers.values_list('pk', flat=True).iterator()
+    ]
+    FarmerBalance.objects.bulk_create(
+        balances, batch_size=500, update_conflicts=True, unique_fields=['farmer'],
+        update_fields=['outstanding', 'open_sales', 'next_due_date', 'updated_at'],
+    )
+
+
+def bucket(condition):
+    return Coalesce(Sum(Case(When(condition, then='amount'), default=ZERO)), ZERO)
+
+
+# Writes one ageing row per farmer with open sales for `snapshot_date` from a
+# single grouped query; re-running a day replaces that day's rows.
+def snapshot_ageing(snapshot_date):
+    days_30 = snapshot_date - timedelta(days=30)
+    days_60 = snapshot_date - timedelta(days=60)
+    rows = open_sales().values('customer_id').annotate(
+        current=bucket(Q(feed_payment_due_date__gte=snapshot_date)),
+        days_0_30=bucket(Q(feed_payment_due_date__lt=snapshot_date, feed_payment_due_date__gte=days_30)),
+        days_31_60=bucket(Q(feed_payment_due_date__lt=days_30, feed_payment_due_date__gte=days_60)),
+        days_over_60=bucket(Q(feed_payment_due_date__lt=days_60)),
+        total=Sum('amount'),
+    )
+    snapshots = [
+        ReceivablesSnapshot(
+            snapshot_date=snapshot_date,
+            farmer_id=row['customer_id'],
+            current=row['current'],
+            days_0_30=row['days_0_30'],
+            days_31_60=row['days_31_60'],
+            days_over_60=row['days_over_60'],
+            total=row['total'],
+        )
+        for row in rows.iterator()
+    ]
+    with sites.atomic():
+        ReceivablesSnapshot.objects.filter(snapshot_date=snapshot_date).delete()
+        ReceivablesSnapshot.objects.bulk_create(snapshots, batch_size=500)
+    return len(snapshots)
+
+
+def ageing_totals(snapshot_date):
+    return ReceivablesSnapshot.objects.filter(snapshot_date=snapshot_date).aggregate(
+        current=Coalesce(Sum('current'), ZERO),
+        days_0_30=Coalesce(Sum('days_0_30'), ZERO),
+        days_31_60=Coalesce(Sum('days_31_60'), ZERO),
+        days_over_60=Coalesce(Sum('days_over_60'), ZERO),
+        total=Coalesce(Sum('total'), ZERO),
+    )
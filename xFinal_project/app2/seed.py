@@ -0,0 +1,98 @@
+from datetime import date, timedelta
+from django.contrib.auth.models import User
+from django.utils.timezone import now
+from .models import UserProfile, Farmer, ChickStock, ChickRequest, Sale, FeedStock
+from .ledger import record_opening_balances
+
+# Demo data used by the audit and benchmark commands. Every model gets at least
+# one row so that all the detail/update/delete urls resolve to a real object.
+def seed_demo_data(rows=20):
+    manager = User.objects.create_user('audit_manager', password='audit-pass', is_staff=True)
+    sales_rep = User.objects.create_user('audit_sales_rep', password='audit-pass', is_staff=True)
+    # the post_save signal creates the profiles, we only need to set the roles
+    UserProfile.objects.filter(user=manager).update(role='brooder_manager')
+    UserProfile.objects.filter(user=sales_rep).update(role='sales_rep')
+
+    farmers = Farmer.objects.bulk_create([
+        Farmer(
+            farmer_name=f"Farmer {i}",
+            date_of_birth=date(1995, 1, 1) + timedelta(days=i),
+            gender='Male' if i % 2 else 'Female',
+            farmer_nin=f"NIN{i:08d}",
+            phone_number=f"0700{i:06d}",
+            recommender_name=f"Recommender {i}",
+            recommender_nin=f"RNIN{i:08d}",
+            address="Kampala",
+            email=f"farmer{i}@example.com",
+            recommender_tel=f"0780{i:06d}",
+            farmer_type='Starter' if i % 3 else 'Returning',
+        )
+        for i in range(rows)
+    ])
+
+    stocks = ChickStock.objects.bulk_create([
+        ChickStock(
+            batch_number=f"BATCH-{chick_type}-{breed}",
+            chick_type=chick_type,
+            chick_breed=breed,
+            chick_quantity=10000,
+            registered_by=manager.username,
+            chicks_period=1,
+        )
+        for chick_type, _ in ChickStock.CHICK_TYPE_CHOICES
+        for breed, _ in ChickStock.CHICK_BREED_CHOICES
+    ])
+
+    statuses = [status for status, _ in ChickRequest.STATUS_CHOICES]
+    chick_requests = ChickRequest.objects.bulk_create([
+        ChickRequest(
+            farmer=farmers[i % len(farmers)],
+            farmer_type=farmers[i % len(farmers)].farmer_type,
+            chick_type=ChickRequest.CHICK_TYPE_CHOICES[i % 2][0],
+            chick_breed=ChickRequest.CHICK_BREED_CHOICES[(i // 2) % 2][0],
+            quantity_requested=50,
+            took_feeds='YES',
+            request_status=statuses[i % len(statuses)],
+        )
+        for i in range(rows * 2)
+    ])
+
+    fulfilled = [req for req in chick_requests if req.request_status == 'Fulfilled']
+    sales = Sale.objects.bulk_create([
+        Sale(
+            customer=req.farmer,
+            chick_request=req,
+            quantity_sold=req.quantity_requested,
+            amount=req.quantity_requested * 1650,
+            feed_payment_due_date=now().date() + timedelta(days=60),
+            payment_method='cash',
+        )
+        for req in fulfilled
+    ])
+
+    feeds = FeedStock.objects.bulk_create([
+        FeedStock(
+            name='generic feed' if i == 0 else f"Feed {i}",
+            feed_type='Starter mash',
+            feed_brand='Ugachick',
+            quantity=500,
+            unit_price=120000,
+            buying_price=100000,
+            selling_price=120000,
+            supplier='Ugachick',
+            supplier_contact=f"0750{i:06d}",
+        )
+        for i in range(3)
+    ])
+    # bulk_create sends no post_save, so the ledger is opened explicitly
+    record_opening_balances(stocks + feeds)
+
+    return {
+        'brooder_manager': manager,
+        'sales_rep': sales_rep,
+        'farmers': farmers,
+        'stocks': stocks,
+        'chick_requests': chick_requests,
+        'sales': sales,
+        'feeds': feeds,
+    }
@@ -1,9 +1,79 @@
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.contrib.auth.signals import user_logged_out
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import UserProfile
+from .models import UserProfile, Sale, ChickStock, FeedStock, ChickRequest, StockMovement
+from .receivables import refresh_balances
+from .ledger import record_stock_change, record_stock_removal
+from . import auth_cache, live
+
+# readers (backups, reports) never block writers in WAL mode; the setting is
+# stored in the database file, in-memory test databases ignore it
+@receiver(connection_created)
+def use_wal_journal(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        UserProfile.objects.get_or_create(user=instance)
\ No newline at end of file
+        UserProfile.objects.get_or_create(user=instance)
+
+# cached request.user copies go stale when the user or their role changes
+# (password changes included) and on logout
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    auth_cache.forget_user(instance.pk)
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def forget_cached_profile_user(sender, instance, **kwargs):
+    auth_cache.forget_user(instance.user_id)
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    if user is not None:
+        auth_cache.forget_user(user.pk)
+
+# keep the customer's receivables balance in step with their sales
+@receiver(post_save, sender=Sale)
+@receiver(post_delete, sender=Sale)
+def refresh_customer_balance(sender, instance, **kwargs):
+    refresh_balances([instance.customer_id])
+
+# every change of a stock quantity goes to the append-only ledger
+@receiver(post_save, sender=ChickStock)
+@receiver(post_save, sender=FeedStock)
+def ledger_stock_saved(sender, instance, created, **kwargs):
+    if not kwargs.get('raw'):
+        record_stock_change(instance, created)
+
+@receiver(post_delete, sender=ChickStock)
+@receiver(post_delete, sender=FeedStock)
+def ledger_stock_deleted(sender, instance, **kwargs):
+    record_stock_removal(instance)
+
+# live dashboard events (see app2.live), sent once the change commits
+@receiver(post_save, sender=ChickRequest)
+def live_request_saved(sender, instance, raw=False, using=None, **kwargs):
+    if not raw:
+        delta = live.pending_delta(instance)
+        live.publish('requests', instance.site, lambda: live.request_payload(instance, pending_delta=delta), using)
+
+@receiver(post_delete, sender=ChickRequest)
+def live_request_deleted(sender, instance, using=None, **kwargs):
+    delta = live.pending_delta(instance, deleted=True)
+    live.publish('requests', instance.site, lambda: live.request_payload(instance, True, delta), using)
+
+@receiver(post_save, sender=Sale)
+def live_sale_saved(sender, instance, created, raw=False, using=None, **kwargs):
+    if created and not raw:
+        live.publish('sales', instance.site, lambda: live.sale_payload(instance), using)
+
+@receiver(post_save, sender=StockMovement)
+def live_stock_moved(sender, instance, created, raw=False, using=None, **kwargs):
+    if created and not raw:
+        live.publish('stock', instance.site, lambda: live.stock_payload(instance), using)
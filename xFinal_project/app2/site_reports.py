@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce
+
+from .models import ChickRequest, ChickStock, Farmer, FarmerBalance, FeedStock, Sale
+from .receivables import ZERO
+from .sites import get_sites, override, site_name
+
+SUMMARY_FIELDS = (
+    'farmers', 'pending', 'approved', 'fulfilled', 'sales', 'chicks_sold', 'revenue', 'outstanding',
+    'chicks_in_stock', 'feed_bags',
+)
+
+
+# Headline numbers of one site, a handful of aggregates against its own
+# (possibly separate) database.
+def site_summary(site):
+    with override(site):
+        summary = {'site': site, 'name': site_name(site), 'farmers': Farmer.objects.count()}
+        # rows of deleted farmers waiting for the purge are left out
+        summary.update(ChickRequest.objects.filter(farmer__deleted_at__isnull=True).aggregate(
+            pending=Count('pk', filter=Q(request_status='Pending')),
+            approved=Count('pk', filter=Q(request_status='Approved')),
+            fulfilled=Count('pk', filter=Q(request_status='Fulfilled')),
+        ))
+        summary.update(Sale.objects.filter(customer__deleted_at__isnull=True).aggregate(
+            sales=Count('pk'), chicks_sold=Coalesce(Sum('quantity_sold'), 0), revenue=Coalesce(Sum('amount'), ZERO),
+        ))
+        summary.update(FarmerBalance.objects.filter(farmer__deleted_at__isnull=True).aggregate(outstanding=Coalesce(Sum('outstanding'), ZERO)))
+        summary.update(ChickStock.objects.aggregate(chicks_in_stock=Coalesce(Sum('chick_quantity'), 0)))
+        summary.update(FeedStock.objects.aggregate(feed_bags=Coalesce(Sum('quantity'), 0)))
+    return summary
+
+
+def _worker_summary(site):
+    try:
+        return site_summary(site)
+    finally:
+        # the pool's threads each opened their own connections
+        connections.close_all()
+
+
+# Every site's summary plus the totals. With more than one site the sites are
+# queried in parallel, SITE_REPORT_WORKERS at a time, so the report takes
+# about as long as the slowest site rather than the sum of them.
+def consolidated_report():
+    site_codes = list(get_sites())
+    workers = min(getattr(settings, 'SITE_REPORT_WORKERS', 4), len(site_codes))
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(_worker_summary, site_codes))
+    else:
+        rows = [site_summary(site) for site in site_codes]
+    totals = {field: sum(row[field] for row in rows) for field in SUMMARY_FIELDS}
+    return {'sites': rows, 'totals': totals}
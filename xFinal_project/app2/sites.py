@@ -0,0 +1,162 @@
+from contextlib import ContextDecorator, ExitStack
+
+from asgiref.local import Local
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+
+_active = Local()
+
+
+def get_sites():
+    return getattr(settings, 'BROODER_SITES', {'main': {'name': 'Main', 'database': 'default'}})
+
+
+def get_default_site():
+    return getattr(settings, 'DEFAULT_BROODER_SITE', next(iter(get_sites())))
+
+
+def site_database(site):
+    try:
+        return get_sites()[site].get('database', 'default')
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown brooder site {site!r}, see BROODER_SITES.")
+
+
+# every database holding site rows, each once
+def site_databases():
+    return list(dict.fromkeys(site_database(site) for site in get_sites()))
+
+
+def site_name(site):
+    return get_sites()[site].get('name', site)
+
+
+# The site the current request (or command loop) works on, set and cleared
+# like django.utils.timezone.activate(): by SiteMiddleware from the user's
+# profile, or by override() around background work.
+def activate(site):
+    site_database(site)
+    _active.value = site
+
+
+def deactivate():
+    if hasattr(_active, 'value'):
+        del _active.value
+
+
+def get_current_site():
+    return getattr(_active, 'value', None)
+
+
+# default of every `site` column: rows are created at the active site
+def current_or_default_site():
+    return get_current_site() or get_default_site()
+
+
+class override(ContextDecorator):
+    def __init__(self, site):
+        self.site = site
+
+    def __enter__(self):
+        self.old_site = get_current_site()
+        if self.site is None:
+            deactivate()
+        else:
+            activate(self.site)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.old_site is None:
+            deactivate()
+        else:
+            activate(self.old_site)
+
+
+def current_database():
+    site = get_current_site()
+    return site_database(site) if site else DEFAULT_DB_ALIAS
+
+
+# transaction.atomic() for work on site rows: one transaction on the active
+# site's database, nested in one on 'default' (users, the ledger, sync
+# receipts) when the router gives the site a database of its own.
+class atomic(ContextDecorator):
+    def __enter__(self):
+        self.stack = ExitStack()
+        for alias in dict.fromkeys([DEFAULT_DB_ALIAS, current_database()]):
+            self.stack.enter_context(transaction.atomic(using=alias))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.stack.__exit__(exc_type, exc_value, traceback)
+
+
+# Runs the loop body once per site with that site active, for commands that
+# work through every site's rows (and database, when the router splits them).
+def each_site():
+    for site in get_sites():
+        with override(site):
+            yield site
+
+
+# Default manager of the site-partitioned models: with a site active every
+# query is limited to its rows. With none active (migrations, shell, commands
+# not looping over sites) nothing is filtered. Rows without a site column of
+# their own are scoped through their farmer, e.g. SiteManager('farmer__site').
+class SiteManager(models.Manager):
+    def __init__(self, lookup='site'):
+        super().__init__()
+        self.lookup = lookup
+
+    def deconstruct(self):
+        manager_class, path, qs_class, args, kwargs = super().deconstruct()
+        return manager_class, path, qs_class, (self.lookup,), kwargs
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        site = get_current_site()
+        if site is not None:
+            queryset = queryset.filter(**{self.lookup: site})
+        return queryset
+
+
+# Optional placement of each site's rows in its own database: a site whose
+# BROODER_SITES entry names another alias gets its farmers, stock, requests,
+# sales and everything hanging off a farmer stored there. The ledger, sync
+# receipts and deletion jobs point at users and stay in 'default' with a site
+# column. Every database is migrated in full (migrate --database=<alias>), and
+# a farmer's dependents follow the database of the farmer they are given.
+class SiteRouter:
+    GLOBAL_MODELS = {'userprofile', 'syncreceipt', 'farmerdeletion', 'stockmovement', 'stocksnapshot'}
+
+    def route(self, model, hints):
+        if model._meta.app_label != 'app2' or model._meta.model_name in self.GLOBAL_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        site = getattr(instance, 'site', None) or get_current_site()
+        return site_database(site) if site else None
+
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.route(model, hints)
+
+
+# Activates the logged-in user's site for the request. Keep it after the
+# authentication middleware.
+class SiteMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = request.user
+        profile = getattr(user, 'userprofile', None) if user.is_authenticated else None
+        request.site = profile.site if profile is not None else None
+        if request.site:
+            activate(request.site)
+        try:
+            return self.get_response(request)
+        finally:
+            deactivate()
@@ -0,0 +1,226 @@
+import json
+import multiprocessing
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+
+import django
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.timezone import make_aware, now
+
+from .models import ArchivedChickRequest, ArchivedSale, ChickRequest, Farmer, FarmerBalance, Sale
+from .receivables import OPEN_PAYMENT_STATUSES
+from .sites import each_site, site_name
+
+try:
+    import weasyprint
+except ImportError:  # optional, without it only the HTML statements are written
+    weasyprint = None
+
+MANIFEST = 'manifest.json'
+PROGRESS = 'progress.jsonl'
+
+REQUEST_FIELDS = ('id', 'farmer_id', 'request_date', 'chick_type', 'chick_breed', 'quantity_requested',
+                  'request_status', 'payment_status')
+SALE_FIELDS = ('id', 'customer_id', 'chick_request_id', 'sale_date', 'quantity_sold', 'amount',
+               'feed_payment_due_date', 'payment_status', 'payment_method')
+
+
+def get_workers():
+    return getattr(settings, 'STATEMENT_WORKERS', None) or os.cpu_count() or 1
+
+
+def statement_period(month):
+    year, month_number = map(int, month.split('-'))
+    start = make_aware(datetime(year, month_number, 1))
+    end = make_aware(datetime(year + month_number // 12, month_number % 12 + 1, 1))
+    return start, end
+
+
+# Farmers of the active site, `chunk_size` ids at a time in pk order.
+def farmer_chunks(chunk_size):
+    last_id = 0
+    while True:
+        ids = list(Farmer.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def rows_by(queryset, fields, key):
+    grouped = defaultdict(list)
+    for row in queryset.values(*fields):
+        grouped[row[key]].append(row)
+    return grouped
+
+
+# The statements of a chunk of farmers from a handful of set-based queries:
+# the farmers, their requests and sales in the month (hot and archived),
+# their open sales and their balance. Only plain dicts, so the result can be
+# handed to a worker process.
+def load_statements(farmer_ids, start, end):
+    in_month = {'request_date__gte': start, 'request_date__lt': end}
+    requests = rows_by(ChickRequest.objects.filter(farmer_id__in=farmer_ids, **in_month), REQUEST_FIELDS, 'farmer_id')
+    for farmer_id, rows in rows_by(
+        ArchivedChickRequest.objects.filter(farmer_id__in=farmer_ids, **in_month), REQUEST_FIELDS, 'farmer_id',
+    ).items():
+        requests[farmer_id].extend(rows)
+
+    in_month = {'sale_date__gte': start, 'sale_date__lt': end}
+    sales = rows_by(Sale.objects.filter(customer_id__in=farmer_ids, **in_month), SALE_FIELDS, 'customer_id')
+    for customer_id, rows in rows_by(
+        ArchivedSale.objects.filter(customer_id__in=farmer_ids, **in_month), SALE_FIELDS, 'customer_id',
+    ).items():
+        sales[customer_id].extend(rows)
+    # open sales as they stand now, whatever month they were made in
+    open_sales = rows_by(
+        Sale.objects.filter(customer_id__in=farmer_ids, payment_status__in=OPEN_PAYMENT_STATUSES)
+        .order_by('feed_payment_due_date', 'pk'),
+        SALE_FIELDS, 'customer_id',
+    )
+    balances = {
+        row['farmer_id']: row
+        for row in FarmerBalance.objects.filter(farmer_id__in=farmer_ids).values(
+            'farmer_id', 'outstanding', 'open_sales', 'next_due_date')
+    }
+
+    statements = []
+    for farmer in Farmer.objects.filter(pk__in=farmer_ids).order_by('pk').values(
+        'id', 'farmer_name', 'farmer_nin', 'phone_number', 'address', 'email', 'site',
+    ):
+        farmer_requests = sorted(requests.get(farmer['id'], []), key=lambda row: row['request_date'])
+        farmer_sales = sorted(sales.get(farmer['id'], []), key=lambda row: row['sale_date'])
+        statements.append({
+            'farmer': farmer,
+            'requests': farmer_requests,
+            'sales': farmer_sales,
+            'open_sales': open_sales.get(farmer['id'], []),
+            'balance': balances.get(farmer['id']),
+            'chicks_requested': sum(row['quantity_requested'] for row in farmer_requests),
+            'chicks_bought': sum(row['quantity_sold'] for row in farmer_sales),
+            'amount_bought': sum(row['amount'] for row in farmer_sales),
+        })
+    return statements
+
+
+def write_file(path, content):
+    # written under a temporary name, so an interrupted run never leaves
+    # half a statement behind
+    partial = f"{path}.partial"
+    mode = 'wb' if isinstance(content, bytes) else 'w'
+    with open(partial, mode) as f:
+        f.write(content)
+    os.replace(partial, path)
+
+
+# Renders and writes the statements of one chunk; runs in a worker process
+# and touches no database.
+def render_chunk(statements, directory, context, pdf):
+    written = []
+    for statement in statements:
+        html = render_to_string('farmer_statement.html', {**context, **statement})
+        path = os.path.join(directory, statement['farmer']['site'], f"farmer-{statement['farmer']['id']}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file(f"{path}.html", html)
+        if pdf:
+            write_file(f"{path}.pdf", weasyprint.HTML(string=html).write_pdf())
+        written.append(statement['farmer']['id'])
+    return written
+
+
+def read_progress(directory):
+    done = set()
+    try:
+        with open(os.path.join(directory, PROGRESS), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the line being written when the run was interrupted
+                    continue
+                done.update((entry['site'], farmer_id) for farmer_id in entry['farmers'])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+# Stands in for the pool with one worker: chunks are rendered in this process
+class InlineExecutor:
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+# Writes <path>/<YYYY-MM>/<site>/farmer-<id>.html (and .pdf with weasyprint)
+# for every farmer of every site. This process loads each chunk of farmers
+# with a few set-based queries while a pool of `workers` processes renders
+# the chunks before it. Finished chunks are appended to progress.jsonl, so a
+# re-run after an interruption skips the farmers already written; manifest.json
+# is written once every farmer is done. `restart` starts the month over.
+def generate_statements(path, month, workers=None, chunk_size=500, pdf=None, restart=False, progress=None):
+    start, end = statement_period(month)
+    directory = os.path.join(path, month)
+    os.makedirs(directory, exist_ok=True)
+    if restart:
+        for name in (PROGRESS, MANIFEST):
+            if os.path.exists(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+    done = read_progress(directory)
+    pdf = weasyprint is not None if pdf is None else pdf
+    workers = workers or get_workers()
+    context = {'month': start, 'generated_at': now()}
+
+    if workers > 1:
+        # fresh interpreters that set Django up again: the workers never
+        # share this process's database connections
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup,
+        )
+    else:
+        executor = InlineExecutor()
+    with executor, open(os.path.join(directory, PROGRESS), 'a', encoding='utf-8') as log:
+        pending = {}
+
+        def finish(futures):
+            for future in futures:
+                site = pending.pop(future)
+                farmer_ids = future.result()
+                log.write(json.dumps({'site': site, 'farmers': farmer_ids}) + '\n')
+                log.flush()
+                if progress:
+                    progress(site, len(farmer_ids))
+
+        for site in each_site():
+            for farmer_ids in farmer_chunks(chunk_size):
+                todo = [farmer_id for farmer_id in farmer_ids if (site, farmer_id) not in done]
+                if not todo:
+                    continue
+                # at most two chunks per worker in flight, the rest wait unloaded
+                if len(pending) >= workers * 2:
+                    finish(wait(pending, return_when=FIRST_COMPLETED)[0])
+                future = executor.submit(render_chunk, load_statements(todo, start, end), directory, context, pdf)
+                pending[future] = site
+                finish([future for future in pending if future.done()])
+        finish(wait(pending)[0])
+
+    counts = Counter(site for site, _ in read_progress(directory))
+    manifest = {
+        'month': month,
+        'generated_at': now().isoformat(),
+        'formats': ['html', 'pdf'] if pdf else ['html'],
+        'sites': {site: {'name': site_name(site), 'statements': count} for site, count in counts.items()},
+        'statements': sum(counts.values()),
+    }
+    with open(os.path.join(directory, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
@@ -0,0 +1,115 @@
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always written
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.html', '.xml', '.ico')
+# name.0123456789ab.ext as written by ManifestStaticFilesStorage
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+ONE_YEAR = 60 * 60 * 24 * 365
+
+
+# collectstatic storage: content-hashed names (from the manifest storage) plus
+# .gz and .br siblings for every text asset, so nothing is compressed per request.
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(paths) | set(self.hashed_files.values()):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        path = self.path(name)
+        with open(path, 'rb') as source:
+            data = source.read()
+        encoders = [('.gz', lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            encoders.append(('.br', lambda raw: brotli.compress(raw, quality=11)))
+        for extension, encode in encoders:
+            compressed = encode(data)
+            # not worth a second file when it barely shrinks
+            if len(compressed) < len(data) * 0.95:
+                with open(path + extension, 'wb') as target:
+                    target.write(compressed)
+
+
+# The codings of an Accept-Encoding header with their q-values, e.g.
+# "gzip;q=0, br" -> {'gzip': 0.0, 'br': 1.0}. A malformed q counts as 0.
+def parse_accept_encoding(header):
+    codings = {}
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        codings[coding.lower()] = quality
+    return codings
+
+
+# Whether the client takes `encoding`: named with q > 0, or covered by "*"
+def accepts_encoding(codings, encoding):
+    return codings.get(encoding, codings.get('*', 0.0)) > 0
+
+
+# Serves STATIC_ROOT in-process, picking the precompressed variant the client
+# accepts. Hashed names never change content so they are cached for a year.
+class CompressedStaticMiddleware:
+    encodings = (('br', '.br'), ('gzip', '.gz'))
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        static_url = settings.STATIC_URL
+        if settings.STATIC_ROOT and request.method in ('GET', 'HEAD') and request.path.startswith(static_url):
+            response = self.serve(request, request.path[len(static_url):])
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        accepted = parse_accept_encoding(request.headers.get('Accept-Encoding', ''))
+        content_encoding = None
+        for encoding, extension in self.encodings:
+            if accepts_encoding(accepted, encoding) and os.path.isfile(path + extension):
+                path, content_encoding = path + extension, encoding
+                break
+
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+        if HASHED_NAME.search(name):
+            response['Cache-Control'] = f'public, max-age={ONE_YEAR}, immutable'
+        else:
+            response['Cache-Control'] = 'public, max-age=60'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
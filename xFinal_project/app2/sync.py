@@ -0,0 +1,191 @@
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.db.models import Max, Sum
+from django.utils.timezone import now
+
+from .models import Farmer, ChickStock, ChickRequest, SyncReceipt
+from . import sites
+
+MAX_BATCH_ITEMS = 1000
+FARMER_FIELDS = (
+    'farmer_name', 'date_of_birth', 'gender', 'farmer_nin', 'phone_number', 'recommender_name',
+    'recommender_nin', 'address', 'email', 'recommender_tel', 'farmer_type',
+)
+CHICK_REQUEST_FIELDS = ('farmer_type', 'chick_type', 'chick_breed', 'quantity_requested', 'took_feeds')
+# same rules as submit_request
+REQUEST_LIMITS = {'Starter': 100, 'Returning': 500}
+RETURNING_WAIT_DAYS = 120
+
+
+class SyncError(Exception):
+    pass
+
+
+def result(key, item_type, status, object_id=None, errors=None):
+    entry = {'idempotency_key': key, 'type': item_type, 'status': status, 'id': object_id}
+    if errors:
+        entry['errors'] = errors
+    return entry
+
+
+# Applies one uploaded batch of farmer registrations and chick requests.
+# Everything is checked with a handful of set-wise queries, then the valid
+# records are written with bulk inserts in a single transaction. Returns one
+# result per uploaded item, in upload order.
+def apply_batch(payload, user):
+    farmer_items = payload.get('farmers') or []
+    request_items = payload.get('chick_requests') or []
+    if not isinstance(farmer_items, list) or not isinstance(request_items, list):
+        raise SyncError("'farmers' and 'chick_requests' must be lists.")
+    if len(farmer_items) + len(request_items) > MAX_BATCH_ITEMS:
+        raise SyncError(f"A batch holds at most {MAX_BATCH_ITEMS} items.")
+
+    items = [('farmer', item) for item in farmer_items] + [('chick_request', item) for item in request_items]
+    results = [None] * len(items)
+
+    # retries: keys we have already applied return the original record
+    keys = [item.get('idempotency_key') if isinstance(item, dict) else None for _, item in items]
+    receipts = SyncReceipt.objects.in_bulk(
+        [key for key in keys if key and isinstance(key, str)], field_name='idempotency_key',
+    )
+    seen_keys = {}
+    pending = []
+    for index, ((item_type, item), key) in enumerate(zip(items, keys)):
+        if not isinstance(item, dict):
+            results[index] = result(None, item_type, 'error', errors={'item': ["Must be an object."]})
+        elif not key or not isinstance(key, str) or len(key) > 64:
+            results[index] = result(key, item_type, 'error',
+                                    errors={'idempotency_key': ["A key of at most 64 characters is required."]})
+        elif any(isinstance(value, (list, dict)) for value in item.values()):
+            # nested values would reach the set-wise lookups below as unhashables
+            results[index] = result(key, item_type, 'error', errors={
+                field: ["Must be a single value."] for field, value in item.items()
+                if isinstance(value, (list, dict))
+            })
+        elif key in receipts:
+            results[index] = result(key, item_type, 'duplicate', receipts[key].object_id)
+        elif key in seen_keys:
+            # the same record queued twice on the device, resolved after the insert
+            results[index] = seen_keys[key]
+        else:
+            seen_keys[key] = index
+            pending.append((index, item_type, item, key))
+
+    new_farmers = validate_farmers(
+        [(index, item, key) for index, item_type, item, key in pending if item_type == 'farmer'], results,
+    )
+    new_requests = validate_chick_requests(
+        [(index, item, key) for index, item_type, item, key in pending if item_type == 'chick_request'],
+        new_farmers, results,
+    )
+
+    with sites.atomic():
+        # bulk_create fills in the farmer ids, which requests for farmers
+        # registered in this same batch pick up on their own insert
+        created_farmers = Farmer.objects.bulk_create([farmer for _, farmer, _ in new_farmers])
+        created_requests = ChickRequest.objects.bulk_create([chick_request for _, chick_request, _ in new_requests])
+        SyncReceipt.objects.bulk_create(
+            [SyncReceipt(idempotency_key=key, item_type='farmer', object_id=farmer.pk, submitted_by=user)
+             for (_, _, key), farmer in zip(new_farmers, created_farmers)]
+            + [SyncReceipt(idempotency_key=key, item_type='chick_request', object_id=chick_request.pk,
+                           submitted_by=user)
+               for (_, _, key), chick_request in zip(new_requests, created_requests)]
+        )
+
+    for (index, farmer, key) in new_farmers:
+        results[index] = result(key, 'farmer', 'created', farmer.pk)
+    for (index, chick_request, key) in new_requests:
+        results[index] = result(key, 'chick_request', 'created', chick_request.pk)
+    for index, entry in enumerate(results):
+        if isinstance(entry, int):
+            original = results[entry]
+            results[index] = result(original['idempotency_key'], original['type'],
+                                    'duplicate' if original['status'] == 'created' else original['status'],
+                                    original['id'], original.get('errors'))
+    return results
+
+
+def validate_farmers(pending, results):
+    nins = {item.get('farmer_nin') for _, item, _ in pending}
+    emails = {item.get('email') for _, item, _ in pending}
+    # farmers waiting for their background delete still hold their nin and email
+    taken_nins = Farmer.all_objects.taken('farmer_nin', nins)
+    taken_emails = Farmer.all_objects.taken('email', emails)
+
+    valid = []
+    for index, item, key in pending:
+        farmer = Farmer(**{field: item.get(field) for field in FARMER_FIELDS})
+        # bulk_create does not call save()
+        farmer.set_blocking_keys()
+        errors = {}
+        try:
+            farmer.clean_fields()
+        except ValidationError as exc:
+            errors = exc.message_dict
+        if farmer.farmer_nin in taken_nins:
+            errors.setdefault('farmer_nin', []).append("A farmer with this NIN already exists.")
+        if farmer.email in taken_emails:
+            errors.setdefault('email', []).append("A farmer with this email already exists.")
+        if errors:
+            results[index] = result(key, 'farmer', 'error', errors=errors)
+            continue
+        # later items in the same batch may not reuse them either
+        taken_nins.add(farmer.farmer_nin)
+        taken_emails.add(farmer.email)
+        valid.append((index, farmer, key))
+    return valid
+
+
+def stock_key(chick_request):
+    return chick_request.chick_type.lower(), chick_request.chick_breed.lower()
+
+
+def validate_chick_requests(pending, new_farmers, results):
+    farmers = {farmer.farmer_nin: farmer for _, farmer, _ in new_farmers}
+    nins = {item.get('farmer_nin') for _, item, _ in pending} - set(farmers)
+    farmers.update(Farmer.objects.in_bulk(nins, field_name='farmer_nin'))
+    last_fulfilled = dict(
+        ChickRequest.objects.filter(farmer__farmer_nin__in=nins, request_status='Fulfilled')
+        .values('farmer_id').annotate(last=Max('request_date')).values_list('farmer_id', 'last')
+    )
+    available = {
+        (row['chick_type'].lower(), row['chick_breed'].lower()): row['total']
+        for row in ChickStock.objects.values('chick_type', 'chick_breed').annotate(total=Sum('chick_quantity'))
+    }
+
+    valid = []
+    today = now()
+    for index, item, key in pending:
+        chick_request = ChickRequest(
+            request_date=today,
+            took_feeds=item.get('took_feeds') or 'NO',
+            **{field: item.get(field) for field in CHICK_REQUEST_FIELDS if field != 'took_feeds'},
+        )
+        errors = {}
+        try:
+            chick_request.clean_fields(exclude=['farmer'])
+        except ValidationError as exc:
+            errors = exc.message_dict
+        farmer = farmers.get(item.get('farmer_nin'))
+        if farmer is None:
+            errors.setdefault('farmer_nin', []).append("Farmer not registered.")
+        elif not errors:
+            limit = REQUEST_LIMITS.get(farmer.farmer_type, REQUEST_LIMITS['Returning'])
+            last = last_fulfilled.get(farmer.pk)
+            if chick_request.quantity_requested > limit:
+                errors.setdefault('quantity_requested', []).append(
+                    f"Quantity exceeds the limit of {limit} for farmer type.")
+            elif chick_request.quantity_requested > available.get(stock_key(chick_request), 0):
+                errors.setdefault('quantity_requested', []).append("Requested quantity exceeds available stock.")
+            if last and (today.date() - last.date()).days < RETURNING_WAIT_DAYS:
+                errors.setdefault('farmer_nin', []).append(
+                    f"Returning farmers can request again on {last.date() + timedelta(days=RETURNING_WAIT_DAYS)}.")
+        if errors:
+            results[index] = result(key, 'chick_request', 'error', errors=errors)
+            continue
+        chick_request.farmer = farmer
+        # later items of the batch compete for what is left
+        available[stock_key(chick_request)] -= chick_request.quantity_requested
+        valid.append((index, chick_request, key))
+    return valid
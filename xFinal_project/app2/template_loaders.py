@@ -0,0 +1,65 @@
+import re
+
+from django.template.loaders import app_directories, filesystem
+
+# Whitespace inside these elements is significant and left as written
+PRESERVED = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.S | re.I)
+# a line holding nothing but comments and tags that output nothing themselves
+# ({% url %}, {% csrf_token %} and the like do, and keep their newline)
+TAG_LINE = re.compile(
+    r'(?:\{%\s*(?:(?:end)?(?:block|if|for|with|comment|spaceless|autoescape)|elif|else|empty|extends|load)\b.*?%\}'
+    r'|\{#.*?#\}|\s)+'
+)
+MINIFIED_EXTENSIONS = ('.html',)
+
+
+def collapse_lines(text):
+    lines = text.split('\n')
+    if len(lines) == 1:
+        return text
+    # the first and last line may continue a preserved element, so only the
+    # side of them touching a newline is stripped
+    pieces = [lines[0].rstrip()]
+    pieces.extend(line.strip() for line in lines[1:-1] if line.strip())
+    pieces.append(lines[-1].lstrip())
+    out = [pieces[0]]
+    for position, piece in enumerate(pieces[1:], 1):
+        previous = pieces[position - 1]
+        # the newline after a whole line of tags would be output on every
+        # render; the line before it already ends in a newline
+        glue = position > 1 and TAG_LINE.fullmatch(previous)
+        out.append(piece if glue else f"\n{piece}")
+    return ''.join(out)
+
+
+# Drops indentation, trailing spaces, blank lines and the newlines after
+# lines of only template tags, outside <pre>, <textarea>, <script> and
+# <style>. A run of whitespace between two things is kept as one newline, so
+# the page renders the same.
+def strip_whitespace(source):
+    parts = PRESERVED.split(source)
+    out = []
+    # split() returns text, then each preserved element and its tag name
+    for position in range(0, len(parts), 3):
+        out.append(collapse_lines(parts[position]))
+        if position + 1 < len(parts):
+            out.append(parts[position + 1])
+    return ''.join(out)
+
+
+# Whitespace is stripped from the source before it is compiled, so under the
+# cached loader it costs nothing per render.
+class WhitespaceStrippingMixin:
+    def get_contents(self, origin):
+        contents = super().get_contents(origin)
+        if origin.name.endswith(MINIFIED_EXTENSIONS):
+            contents = strip_whitespace(contents)
+        return contents
+
+
+class FilesystemLoader(WhitespaceStrippingMixin, filesystem.Loader):
+    pass
+
+
+class AppDirectoriesLoader(WhitespaceStrippingMixin, app_directories.Loader):
+    pass
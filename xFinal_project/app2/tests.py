@@ -1,3 +1,1561 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import shutil
+import tempfile
+import zlib
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.handlers.asgi import ASGIHandler
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.template import Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, clear_url_caches, resolve, reverse
+from django.utils import timezone
+
+from . import api, auth_cache, compression, live, sites
+from .analytics import export_dataset, month_start
+from .archive import archive_closed_records, request_history, sale_history
+from .backup import SnapshotError, backup_models, restore_snapshots, write_snapshot
+from .concurrency import ConflictError, save_edit_form
+from .dedupe import MergeError, find_duplicates, merge_farmers
+from .ledger import inventory_at, take_snapshot, valuation_series, valuation_totals
+from .forecasting import HORIZON_WEEKS, SEASON_WEEKS, compute_forecast, forecast
+from .models import (
+    ArchivedChickRequest, ArchivedSale, ChickRequest, ChickStock, DuplicateCandidate, Farmer, FarmerBalance,
+    FarmerDeletion, Notification, ReceivablesSnapshot, Sale, StockMovement, StockSnapshot, UserProfile,
+)
+from .management.commands import audit_query_plans
+from .management.commands.measure_startup import run_probe
+from .receivables import ageing_totals, refresh_balances, snapshot_ageing
+from .seed import seed_demo_data
+from .site_reports import consolidated_report
+from .purge import count_cascade, purge
+from .notifications import BaseProvider, enqueue, render_message
+from .statements import generate_statements
+from .static_pipeline import accepts_encoding, parse_accept_encoding
+from .template_loaders import strip_whitespace
+from .warmup import STEPS as WARM_UP_STEPS, warm_up
+
+
+def create_staff_user(username, role):
+    user = User.objects.create_user(username, password='test-pass', is_staff=True)
+    UserProfile.objects.filter(user=user).update(role=role)
+    return user
+
+
+class StaticPipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(STATIC_ROOT=cls.static_root)
+        cls.settings_override.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        shutil.rmtree(cls.static_root)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client.force_login(create_staff_user('manager', 'brooder_manager'))
+
+    def test_cold_dashboard_load_transfers_fewer_bytes(self):
+        page = self.client.get(reverse('brooder_manager_dashboard'))
+        asset_urls = re.findall(r'(?:href|src)="(%s[^"]+)"' % settings.STATIC_URL, page.content.decode())
+        self.assertTrue(asset_urls)
+
+        # before: every asset shipped as the plain file from STATICFILES_DIRS
+        before = len(page.content)
+        after = len(page.content)
+        for url in asset_urls:
+            original = re.sub(r'\.[0-9a-f]{12}(\.\w+)$', r'\1', url[len(settings.STATIC_URL):])
+            before += os.path.getsize(os.path.join(settings.STATICFILES_DIRS[0], original))
+
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(response['Content-Encoding'], ('gzip', 'br'))
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertIn('Accept-Encoding', response['Vary'])
+            after += len(b''.join(response.streaming_content))
+
+        self.assertLess(after, before * 0.5)
+
+    def test_uncompressed_when_client_does_not_accept_encoding(self):
+        page = self.client.get(reverse('brooder_manager_dashboard'))
+        url = re.search(r'href="(%s[^"]+\.css)"' % settings.STATIC_URL, page.content.decode()).group(1)
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Type'], 'text/css')
+
+    def test_refused_and_lookalike_codings_are_not_served(self):
+        page = self.client.get(reverse('brooder_manager_dashboard'))
+        url = re.search(r'href="(%s[^"]+\.css)"' % settings.STATIC_URL, page.content.decode()).group(1)
+        for header in ('gzip;q=0', 'identity, x-gzip-foo', 'br;q=0, gzip;q=0.0', '*;q=0'):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(response.has_header('Content-Encoding'), header)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='GZIP;q=0.5, br;q=0')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_accept_encoding_parsing(self):
+        self.assertEqual(parse_accept_encoding('gzip;q=0, br , deflate; q=0.5, x;q=oops'),
+                         {'gzip': 0.0, 'br': 1.0, 'deflate': 0.5, 'x': 0.0})
+        self.assertTrue(accepts_encoding(parse_accept_encoding('*'), 'br'))
+        self.assertFalse(accepts_encoding(parse_accept_encoding('*, br;q=0'), 'br'))
+        self.assertFalse(accepts_encoding(parse_accept_encoding(''), 'gzip'))
+
+
+# pages render without collectstatic
+PLAIN_STATIC_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+TWO_SITES = {
+    'main': {'name': 'Main Brooder', 'database': 'default'},
+    'north': {'name': 'North Brooder', 'database': 'default'},
+}
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class OptimisticConcurrencyTests(TestCase):
+    def setUp(self):
+        self.stock = ChickStock.objects.create(
+            batch_number='B-1', chick_type='Layers', chick_breed='local', chick_price=1650,
+            chick_quantity=1000, registered_by='manager', chicks_period=1,
+        )
+        self.url = reverse('chick_stock_update', args=[self.stock.pk])
+        self.form = {
+            'batch_number': 'B-1', 'chick_type': 'Layers', 'chick_breed': 'local', 'chick_price': '1650',
+            'chick_quantity': '1000', 'chicks_period': '1', 'version': '0',
+        }
+
+    def test_stale_form_is_rejected_instead_of_overwriting(self):
+        first = self.client_class()
+        first.force_login(create_staff_user('manager_a', 'brooder_manager'))
+        second = self.client_class()
+        second.force_login(create_staff_user('manager_b', 'brooder_manager'))
+        # both opened the edit form at version 0
+        self.assertContains(first.get(self.url), 'name="version" value="0"')
+        self.assertContains(second.get(self.url), 'name="version" value="0"')
+
+        response = first.post(self.url, {**self.form, 'chick_quantity': '900'})
+        self.assertEqual(response.status_code, 302)
+
+        response = second.post(self.url, {**self.form, 'chick_price': '2000'})
+        self.assertEqual(response.status_code, 409)
+        self.assertContains(response, 'Someone else saved this record', status_code=409)
+        self.assertContains(response, 'name="version" value="1"', status_code=409)
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.chick_quantity, self.stock.chick_price, self.stock.version), (900, 1650, 1))
+
+        # re-applied on top of the current version, nothing is lost
+        response = second.post(self.url, {**self.form, 'chick_quantity': '900', 'chick_price': '2000', 'version': '1'})
+        self.assertEqual(response.status_code, 302)
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.chick_quantity, self.stock.chick_price, self.stock.version), (900, 2000, 2))
+
+    def test_only_changed_columns_are_written(self):
+        self.client.force_login(create_staff_user('manager', 'brooder_manager'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, {**self.form, 'chick_quantity': '750'})
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "app2_chickstock"')]
+        self.assertEqual(len(updates), 1)
+        set_clause, where_clause = updates[0].split(' WHERE ')
+        self.assertIn('"chick_quantity"', set_clause)
+        self.assertIn('"version"', set_clause)
+        self.assertNotIn('"batch_number"', set_clause)
+        self.assertNotIn('"chick_price"', set_clause)
+        self.assertIn('"version" = 0', where_clause)
+
+    def test_interleaved_read_modify_write_loses_no_updates(self):
+        # every worker reads the row before any of them writes; on a conflict
+        # it re-reads and retries, as the edit form asks the user to
+        workers = [ChickStock.objects.get(pk=self.stock.pk) for _ in range(10)]
+        conflicts = 0
+        for stock in workers:
+            while True:
+                stock.chick_quantity += 10
+                try:
+                    with transaction.atomic():
+                        stock.save(update_fields=['chick_quantity', 'updated_at'])
+                    break
+                except ConflictError:
+                    conflicts += 1
+                    stock.refresh_from_db()
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.chick_quantity, 1100)
+        self.assertEqual(self.stock.version, 10)
+        self.assertEqual(conflicts, 9)
+
+
+# lookups every request used to make before the view ran
+AUTH_QUERIES = ('FROM "django_session"', 'FROM "auth_user"', 'FROM "app2_userprofile"')
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        auth_cache.clear()
+        self.seeded = seed_demo_data(3)
+        self.manager = self.seeded['brooder_manager']
+        self.sales_rep = self.seeded['sales_rep']
+
+    def staff_pages(self):
+        farmer = self.seeded['farmers'][0].pk
+        stock = self.seeded['stocks'][0].pk
+        feed = self.seeded['feeds'][0].pk
+        sale = self.seeded['sales'][0].pk
+        chick_request = self.seeded['chick_requests'][0].pk
+        manager_pages = [
+            ('brooder_manager_dashboard', []), ('manage_requests', []), ('manage_stock', []),
+            ('manage_feed_stock', []), ('brooder_manager_report', []), ('stock_valuation', []),
+            ('chick_stock_detail', [stock]), ('chick_stock_update', [stock]), ('chick_stock_delete', [stock]),
+            ('feed_stock_detail', [feed]), ('feed_stock_update', [feed]),
+        ]
+        sales_rep_pages = [
+            ('sales_rep_dashboard', []), ('submit_request', []), ('process_sales', []), ('view_all_sales', []),
+            ('sales_rep_report', []), ('collections', []), ('list_farmers', []), ('register_farmer', []),
+            ('farmer_deletions', []), ('farmer_detail', [farmer]), ('farmer_update', [farmer]),
+            ('farmer_delete', [farmer]), ('chick_request_detail', [chick_request]),
+            ('sale_update', [sale]), ('profile_list', []),
+        ]
+        # chick_request_update/delete, feed_stock_delete, sale_detail and
+        # sale_delete render templates the project does not have yet
+        return [(self.manager, name, args) for name, args in manager_pages] + \
+               [(self.sales_rep, name, args) for name, args in sales_rep_pages]
+
+    def test_staff_pages_do_not_query_session_or_user_once_warm(self):
+        clients = {}
+        for user in (self.manager, self.sales_rep):
+            clients[user] = self.client_class()
+            clients[user].force_login(user)
+        for user, name, args in self.staff_pages():
+            url = reverse(name, args=args)
+            self.assertLess(clients[user].get(url).status_code, 400, url)
+            with CaptureQueriesContext(connection) as queries:
+                response = clients[user].get(url)
+            self.assertLess(response.status_code, 400, url)
+            auth_queries = [query['sql'] for query in queries.captured_queries
+                            if any(lookup in query['sql'] for lookup in AUTH_QUERIES)]
+            self.assertEqual(auth_queries, [], url)
+
+    def test_page_without_view_queries_needs_none(self):
+        self.client.force_login(self.sales_rep)
+        self.client.get(reverse('profile_list'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('profile_list'))
+
+    def test_profile_change_is_seen_on_the_next_request(self):
+        self.client.force_login(self.manager)
+        self.assertEqual(self.client.get(reverse('manage_stock')).status_code, 200)
+        profile = self.manager.userprofile
+        profile.role = 'sales_rep'
+        profile.save()
+        self.assertEqual(self.client.get(reverse('manage_stock')).status_code, 302)
+
+    def test_password_change_and_logout_end_cached_sessions(self):
+        other = self.client_class()
+        other.force_login(self.manager)
+        self.client.force_login(self.manager)
+        self.assertEqual(other.get(reverse('manage_stock')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('manage_stock')).status_code, 200)
+
+        self.client.get(reverse('logout_view'))
+        self.assertEqual(self.client.get(reverse('manage_stock')).status_code, 302)
+
+        self.manager.set_password('new-pass')
+        self.manager.save()
+        self.assertEqual(other.get(reverse('manage_stock')).status_code, 302)
+
+    def test_changes_made_by_another_process_end_cached_sessions(self):
+        self.client.force_login(self.manager)
+        self.assertEqual(self.client.get(reverse('manage_stock')).status_code, 200)
+        # the other process drops only its own copies, ours stay in _users
+        with mock.patch.dict(auth_cache._users):
+            self.manager.set_password('new-pass')
+            self.manager.save()
+        self.assertTrue(auth_cache._users)
+        self.assertEqual(self.client.get(reverse('manage_stock')).status_code, 302)
+
+    def test_deactivation_by_another_process_ends_cached_sessions(self):
+        self.client.force_login(self.manager)
+        self.assertEqual(self.client.get(reverse('manage_stock')).status_code, 200)
+        with mock.patch.dict(auth_cache._users):
+            self.manager.is_active = False
+            self.manager.save()
+        self.assertEqual(self.client.get(reverse('manage_stock')).status_code, 302)
+
+
+# One open EventSource connection, driven straight through the ASGI handler.
+class SSEConnection:
+    def __init__(self, cookie):
+        self.scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': reverse('live_events'), 'raw_path': reverse('live_events').encode(),
+            'query_string': b'topics=requests', 'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 40000), 'server': ('testserver', 80),
+        }
+        self.status = None
+        self.body = ''
+        self.changed = asyncio.Event()
+        self._request_sent = False
+
+    async def receive(self):
+        if not self._request_sent:
+            self._request_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # the client stays connected
+        await asyncio.Event().wait()
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        else:
+            self.body += message.get('body', b'').decode()
+        self.changed.set()
+
+    async def wait_for(self, text):
+        while text not in self.body:
+            self.changed.clear()
+            await self.changed.wait()
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES, LIVE_EVENTS_BACKEND='app2.live.LocalBackend')
+class LiveEventsTests(TestCase):
+    def setUp(self):
+        auth_cache.clear()
+        self.seeded = seed_demo_data(3)
+        self.client.force_login(self.seeded['brooder_manager'])
+
+    def create_request(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ChickRequest.objects.create(
+                farmer=self.seeded['farmers'][0], farmer_type='Starter', chick_type='Layers',
+                chick_breed='local', quantity_requested=100, took_feeds='NO',
+            )
+
+    async def test_one_server_holds_hundreds_of_idle_connections(self):
+        # the test database connection lives in this test's transaction
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        handler = ASGIHandler()
+        subscribers = live.hub.subscriber_count()
+        threads = threading.active_count()
+
+        connections = [SSEConnection(cookie) for _ in range(300)]
+        tasks = [asyncio.create_task(handler(conn.scope, conn.receive, conn.send)) for conn in connections]
+        try:
+            await asyncio.wait_for(asyncio.gather(*(conn.wait_for('retry:') for conn in connections)), 60)
+            self.assertEqual({conn.status for conn in connections}, {200})
+            self.assertEqual(live.hub.subscriber_count(), subscribers + 300)
+            # idle streams are parked coroutines, not threads
+            self.assertLess(threading.active_count(), threads + 10)
+
+            chick_request = await sync_to_async(self.create_request)()
+            await asyncio.wait_for(asyncio.gather(*(conn.wait_for('event: requests') for conn in connections)), 10)
+            for conn in connections:
+                self.assertIn(f'"id": {chick_request.pk}', conn.body)
+                self.assertIn('"status": "Pending"', conn.body)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self.assertEqual(live.hub.subscriber_count(), subscribers)
+
+    def test_reconnect_replays_missed_events(self):
+        response = self.client.get(reverse('live_events'), {'topics': 'requests'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        last_id = int(re.search(r'^id: (\d+)$', response.content.decode(), re.M).group(1))
+
+        chick_request = self.create_request()
+        response = self.client.get(reverse('live_events'), {'topics': 'requests'}, HTTP_LAST_EVENT_ID=str(last_id))
+        body = response.content.decode()
+        self.assertIn('event: requests', body)
+        self.assertIn(f'"id": {chick_request.pk}', body)
+        # nothing new for a client on another topic
+        response = self.client.get(reverse('live_events'), {'topics': 'sales'}, HTTP_LAST_EVENT_ID=str(last_id))
+        self.assertNotIn('event:', response.content.decode())
+
+    def test_events_are_for_staff_only(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('live_events')).status_code, 401)
+
+    def last_event(self):
+        _, last_id = live.hub.replay(['requests'], 'main')
+        backlog, _ = live.hub.replay(['requests'], 'main', last_id - 1)
+        return backlog[-1].data
+
+    def test_request_events_carry_the_pending_count_change(self):
+        def last_event(change):
+            with CaptureQueriesContext(connection) as queries:
+                with self.captureOnCommitCallbacks(execute=True):
+                    change()
+            self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql']])
+            return self.last_event()
+
+        chick_request = self.create_request()
+        self.assertEqual(self.last_event()['pending_delta'], 1)
+        chick_request = ChickRequest.objects.get(pk=chick_request.pk)
+        chick_request.quantity_requested = 80
+        self.assertEqual(last_event(chick_request.save)['pending_delta'], 0)
+        chick_request.request_status = 'Approved'
+        self.assertEqual(last_event(chick_request.save)['pending_delta'], -1)
+
+        pending = ChickRequest.objects.filter(request_status='Pending').first()
+        data = last_event(ChickRequest.objects.filter(pk=pending.pk).delete)
+        self.assertEqual((data['status'], data['pending_delta']), ('Deleted', -1))
+
+    def test_relayed_events_keep_their_global_ids(self):
+        # two workers relay the same Redis messages, so a browser moving
+        # between them resumes at the same event
+        workers = [live.Hub(), live.Hub()]
+        for hub in workers:
+            with mock.patch.object(live, 'hub', hub):
+                for event_id in (41, 42, 43):
+                    message = json.dumps({'topic': 'requests', 'site': 'main', 'data': {'n': event_id}})
+                    live.relay(f"{event_id} {message}".encode())
+        for hub in workers:
+            backlog, start_id = hub.replay(['requests'], 'main', 42)
+            self.assertEqual(([event.id for event in backlog], start_id), ([43], 42))
+        # ids from before a worker's history send the page a reload
+        backlog, _ = workers[1].replay(['requests'], 'main', 10)
+        self.assertEqual(backlog[0].topic, 'reload')
+
+
+class SnapshotBackupTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(20)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def counts(self):
+        return {model._meta.label: model._base_manager.count() for model in backup_models()}
+
+    @override_settings(BACKUP_INCREMENTAL_OVERLAP=0)
+    def test_full_and_incremental_restore(self):
+        full = write_snapshot(os.path.join(self.directory, 'full'))
+        farmer = self.seeded['farmers'][0]
+        Farmer.objects.filter(pk=farmer.pk).update(farmer_name='Renamed', updated_at=timezone.now())
+        Sale.objects.filter(pk=self.seeded['sales'][0].pk).delete()
+        incremental = write_snapshot(os.path.join(self.directory, 'incremental'), base=full)
+        expected = self.counts()
+        # only changed rows and the keys of the rest are in the incremental one
+        farmers = next(entry for entry in incremental['tables'] if entry['model'] == 'app2.farmer')
+        self.assertLess(farmers['rows'], len(self.seeded['farmers']))
+
+        # lost after the last backup
+        Farmer.objects.filter(pk=farmer.pk).update(farmer_name='Lost')
+        ChickRequest.objects.all().delete()
+        restore_snapshots([os.path.join(self.directory, 'full'), os.path.join(self.directory, 'incremental')])
+
+        self.assertEqual(self.counts(), expected)
+        self.assertEqual(Farmer.all_objects.get(pk=farmer.pk).farmer_name, 'Renamed')
+        self.assertFalse(Sale.objects.filter(pk=self.seeded['sales'][0].pk).exists())
+
+    @override_settings(BACKUP_INCREMENTAL_OVERLAP=0)
+    def test_incremental_takes_rows_changed_by_bulk_updates(self):
+        full = write_snapshot(os.path.join(self.directory, 'full'))
+        sale = self.seeded['sales'][0]
+        # purging the request nulls the sale's link with a queryset update
+        purge(ChickRequest, {'pk': sale.chick_request_id}, 100, lambda model, count: None)
+        sale.refresh_from_db()
+        self.assertIsNone(sale.chick_request_id)
+        self.assertEqual(sale.version, 1)
+
+        incremental = write_snapshot(os.path.join(self.directory, 'incremental'), base=full)
+        sales = next(entry for entry in incremental['tables'] if entry['model'] == 'app2.sale')
+        self.assertEqual(sales['rows'], 1)
+
+    def test_refuses_sqlite_without_wal(self):
+        with mock.patch('app2.backup.journal_mode', return_value='delete'):
+            with self.assertRaises(SnapshotError):
+                write_snapshot(os.path.join(self.directory, 'full'))
+
+    def test_restore_refuses_snapshots_out_of_order(self):
+        full = write_snapshot(os.path.join(self.directory, 'full'))
+        write_snapshot(os.path.join(self.directory, 'incremental'), base=full)
+        write_snapshot(os.path.join(self.directory, 'other'))
+        with self.assertRaises(SnapshotError):
+            restore_snapshots([os.path.join(self.directory, 'other'), os.path.join(self.directory, 'incremental')])
+
+
+class AnalyticsExportTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(20)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        requests = self.seeded['chick_requests']
+        ChickRequest.objects.filter(pk__in=[req.pk for req in requests[:10]]).update(
+            request_date=month_start('2025-01'))
+        ChickRequest.objects.filter(pk__in=[req.pk for req in requests[10:]]).update(
+            request_date=month_start('2025-02'))
+
+    def read(self, month, chick_type):
+        path = os.path.join(self.directory, 'requests', f'month={month}', f'chick_type={chick_type}', 'part-00000.npz')
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    def test_partitions_by_month_and_chick_type(self):
+        months, rows = export_dataset(self.directory, 'requests', 'npz', until=month_start('2025-03'))
+        self.assertEqual(months, ['2025-01', '2025-02'])
+        self.assertEqual(rows, 40)
+        layers = self.read('2025-02', 'Layers')
+        # choice fields are stored as codes into a fixed dictionary
+        self.assertEqual(list(layers['chick_type__categories']), ['Broilers', 'Layers'])
+        self.assertTrue((layers['chick_type'] == 1).all())
+        self.assertEqual(layers['request_date'].dtype, np.dtype('datetime64[us]'))
+        expected = ChickRequest.objects.filter(chick_type='Layers', request_date__gte=month_start('2025-02')).count()
+        self.assertEqual(len(layers['id']), expected)
+
+    def test_incremental_export_only_adds_new_months(self):
+        export_dataset(self.directory, 'requests', 'npz', until=month_start('2025-02'))
+        january = os.path.getmtime(os.path.join(self.directory, 'requests', 'month=2025-01'))
+        months, rows = export_dataset(self.directory, 'requests', 'npz', incremental=True, until=month_start('2025-03'))
+        self.assertEqual(months, ['2025-02'])
+        self.assertEqual(rows, 30)
+        self.assertEqual(os.path.getmtime(os.path.join(self.directory, 'requests', 'month=2025-01')), january)
+        with open(os.path.join(self.directory, 'requests', '_manifest.json')) as f:
+            self.assertEqual(json.load(f)['rows'], 40)
+
+
+class FarmerStatementTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(20)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.month = f"{timezone.localdate():%Y-%m}"
+
+    def statement(self, farmer):
+        with open(os.path.join(self.directory, self.month, 'main', f'farmer-{farmer.pk}.html')) as f:
+            return f.read()
+
+    def test_statements_are_rendered_in_worker_processes(self):
+        manifest = generate_statements(self.directory, self.month, workers=2, chunk_size=6, pdf=False)
+        self.assertEqual(manifest['statements'], 20)
+        farmer = self.seeded['sales'][0].customer
+        html = self.statement(farmer)
+        self.assertIn(farmer.farmer_name, html)
+        self.assertIn(f"<td>{self.seeded['sales'][0].pk}</td>", html)
+
+    def test_interrupted_run_resumes(self):
+        def interrupt(site, written):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            generate_statements(self.directory, self.month, workers=1, chunk_size=6, pdf=False, progress=interrupt)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, self.month, 'manifest.json')))
+
+        written = []
+        manifest = generate_statements(
+            self.directory, self.month, workers=1, chunk_size=6, pdf=False,
+            progress=lambda site, count: written.append(count),
+        )
+        # the first chunk was not rendered again
+        self.assertEqual(sum(written), 14)
+        self.assertEqual(manifest['statements'], 20)
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class CompressedPageTests(TestCase):
+    def setUp(self):
+        seed_demo_data(30)
+        self.client.force_login(create_staff_user('manager', 'brooder_manager'))
+
+    def test_whitespace_is_stripped_when_templates_compile(self):
+        source = '<ul>\n    {% for x in items %}\n        <li>{{ x }}</li>\n\n    {% endfor %}\n</ul>\n<pre>\n  kept\n</pre>'
+        self.assertEqual(strip_whitespace(source), '<ul>\n{% for x in items %}<li>{{ x }}</li>\n{% endfor %}</ul>\n<pre>\n  kept\n</pre>')
+
+        minified = self.client.get(reverse('list_farmers')).content.decode()
+        templates = [{**settings.TEMPLATES[0], 'APP_DIRS': True, 'OPTIONS': {
+            key: value for key, value in settings.TEMPLATES[0]['OPTIONS'].items() if key != 'loaders'
+        }}]
+        with override_settings(TEMPLATES=templates):
+            plain = self.client.get(reverse('list_farmers')).content.decode()
+        self.assertLess(len(minified), len(plain) * 0.8)
+        # the same page, only the whitespace differs
+        self.assertEqual(re.sub(r'\s+', ' ', minified).replace('> <', '><'),
+                         re.sub(r'\s+', ' ', plain).replace('> <', '><'))
+
+    def test_large_pages_are_compressed_above_threshold(self):
+        plain = self.client.get(reverse('list_farmers'))
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.client.get(reverse('list_farmers'), HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertLess(len(response.content), len(plain.content) * 0.5)
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        # the compressed page is still revalidated with its (now weak) ETag
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+        revalidated = self.client.get(reverse('list_farmers'), HTTP_ACCEPT_ENCODING='gzip',
+                                      HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+        with override_settings(RESPONSE_COMPRESSION_MIN_SIZE=len(plain.content) + 1):
+            response = self.client.get(reverse('list_farmers'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_refused_codings_are_not_used(self):
+        for header in ('gzip;q=0', 'identity, x-gzip-foo'):
+            response = self.client.get(reverse('list_farmers'), HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(response.has_header('Content-Encoding'), header)
+
+    def test_pages_with_secrets_get_gzip_instead_of_brotli(self):
+        fake_brotli = mock.Mock(compress=lambda content, quality: zlib.compress(content))
+        with mock.patch.object(compression, 'brotli', fake_brotli):
+            # the middleware picks its encoders when the client's handler loads it
+            client = self.client_class()
+            client.force_login(create_staff_user('rep', 'sales_rep'))
+            page = client.get(reverse('list_farmers'), HTTP_ACCEPT_ENCODING='br, gzip')
+            self.assertEqual(page['Content-Encoding'], 'gzip')
+            self.assertIn(b'<html', gzip.decompress(page.content).lower())
+            api_page = client.get(reverse('api_resource_list', args=['farmers']), HTTP_ACCEPT_ENCODING='br, gzip')
+            self.assertEqual(api_page['Content-Encoding'], 'br')
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class DuplicateFarmerTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(30)
+        self.farmer = Farmer.objects.create(
+            farmer_name='John Okello', date_of_birth='1990-05-17', gender='Male', farmer_nin='CM90012345ABCD',
+            phone_number='0772 123456', recommender_name='Grace', recommender_nin='CF80011111XYZW',
+            address='Gulu', email='john.okello@example.com', recommender_tel='0780000000', farmer_type='Starter',
+        )
+        self.registration = {
+            'farmer_name': 'Okelo Jon', 'date_of_birth': '1990-05-17', 'gender': 'Male',
+            'farmer_nin': 'CM90012354ABCD', 'phone_number': '+256772123456', 'recommender_name': 'Grace',
+            'recommender_nin': 'CF80011111XYZW', 'address': 'Gulu', 'email': 'jon.okelo@example.com',
+            'recommender_tel': '0780000000', 'farmer_type': 'Starter', 'registration_date': '2026-01-01',
+        }
+        self.client.force_login(create_staff_user('rep', 'sales_rep'))
+
+    def test_registration_warns_about_a_near_duplicate(self):
+        response = self.client.post(reverse('register_farmer'), self.registration)
+        self.assertContains(response, 'This farmer may already be registered')
+        self.assertContains(response, self.farmer.farmer_nin)
+        self.assertFalse(Farmer.objects.filter(farmer_nin='CM90012354ABCD').exists())
+
+        response = self.client.post(reverse('register_farmer'), {**self.registration, 'confirm_new': '1'})
+        self.assertRedirects(response, reverse('list_farmers'))
+        duplicate = Farmer.objects.get(farmer_nin='CM90012354ABCD')
+        candidate = DuplicateCandidate.objects.get()
+        self.assertEqual((candidate.farmer_id, candidate.other_id), (self.farmer.pk, duplicate.pk))
+
+    def test_blocks_find_the_duplicate_without_comparing_every_pair(self):
+        duplicate = Farmer(**{key: value for key, value in self.registration.items() if key != 'registration_date'})
+        duplicate.set_blocking_keys()
+        Farmer.objects.bulk_create([duplicate])
+        candidates, stats = find_duplicates()
+        self.assertEqual(candidates[0][1:3], (self.farmer.pk, duplicate.pk))
+        self.assertEqual(set(candidates[0].reasons), {'name', 'phone', 'date_of_birth', 'email', 'recommender_nin'})
+        self.assertEqual(len(candidates), 1)
+        self.assertLess(stats['comparisons'], stats['farmers'] * (stats['farmers'] - 1) // 2)
+
+    def test_merge_moves_requests_and_sales(self):
+        duplicate = Farmer.objects.create(**{
+            key: value for key, value in self.registration.items() if key != 'registration_date'
+        })
+        sale = Sale.objects.filter(payment_status='pending').first()
+        ChickRequest.objects.filter(pk=sale.chick_request_id).update(farmer=duplicate)
+        Sale.objects.filter(pk=sale.pk).update(customer=duplicate)
+        candidate = DuplicateCandidate.objects.create(farmer_id=self.farmer.pk, other_id=duplicate.pk, score=0.9)
+        self.assertContains(self.client.get(reverse('duplicate_farmers')), 'Okelo Jon')
+        self.assertContains(self.client.get(reverse('duplicate_merge', args=[candidate.pk])), 'Keep this record', count=2)
+
+        response = self.client.post(reverse('duplicate_merge', args=[candidate.pk]), {'keep': self.farmer.pk})
+        self.assertRedirects(response, reverse('farmer_detail', args=[self.farmer.pk]))
+        moved = Sale.objects.get(pk=sale.pk)
+        self.assertEqual(moved.customer_id, self.farmer.pk)
+        self.assertEqual(moved.version, sale.version + 1)
+        self.assertEqual(ChickRequest.objects.get(pk=sale.chick_request_id).farmer_id, self.farmer.pk)
+        self.assertEqual(FarmerBalance.objects.get(farmer=self.farmer).outstanding, sale.amount)
+        # the duplicate is hidden at once and purged in the background
+        self.assertFalse(Farmer.objects.filter(pk=duplicate.pk).exists())
+        candidate.refresh_from_db()
+        self.assertEqual((candidate.status, candidate.kept_id), ('merged', self.farmer.pk))
+        self.assertEqual(candidate.moved, {'app2.ChickRequest': 1, 'app2.Sale': 1})
+
+        with self.assertRaises(MergeError):
+            merge_farmers(self.farmer, self.farmer)
+
+
+class ColdStartTests(TestCase):
+    @override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+    def test_warm_up_compiles_every_template_ahead_of_requests(self):
+        warm_up()
+        with mock.patch.object(Template, 'compile_nodelist', autospec=True) as compile_nodelist:
+            response = self.client.get(reverse('loginpage'))
+        self.assertEqual(response.status_code, 200)
+        compile_nodelist.assert_not_called()
+
+    def test_warm_up_builds_the_url_resolver(self):
+        clear_url_caches()
+        warm_up()
+        with mock.patch.object(URLResolver, '_populate', autospec=True) as populate:
+            reverse('farmer_detail', args=[1])
+            resolve(reverse('loginpage'))
+        populate.assert_not_called()
+
+    def test_warm_up_connects_to_every_site_database(self):
+        with CaptureQueriesContext(connection) as queries:
+            timings = warm_up()
+        self.assertEqual(set(timings), {name for name, _ in WARM_UP_STEPS})
+        self.assertIn('SELECT 1', [query['sql'] for query in queries.captured_queries])
+
+    def test_cold_start_probe_warms_up_before_the_first_request(self):
+        # a new interpreter, started and warmed up like chicks.wsgi
+        timings, imports = run_probe(reverse('loginpage'), warm=True)
+        self.assertEqual(timings['status'], '200 OK')
+        self.assertEqual(set(timings['warm_up']), {name for name, _ in WARM_UP_STEPS})
+        self.assertTrue(any(module == 'app2.views' for module, *_ in imports))
+
+    # wall-clock budget, too noisy for shared CI machines: RUN_BENCHMARKS=1
+    @skipUnless(os.environ.get('RUN_BENCHMARKS'), "timing benchmark, set RUN_BENCHMARKS=1")
+    def test_first_request_after_cold_start_meets_target(self):
+        timings, _ = run_probe(reverse('loginpage'), warm=True)
+        self.assertLessEqual(timings['first_request'] * 1000, settings.COLD_START_TARGET_MS)
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        seed_demo_data(5)
+        self.client.force_login(User.objects.create_superuser('admin', password='test-pass'))
+
+    def counts(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries.captured_queries if 'COUNT(' in query['sql'].upper()]
+
+    def test_unfiltered_changelist_runs_no_count(self):
+        url = reverse('admin:app2_farmer_changelist')
+        self.assertEqual(self.counts(url), [])
+        self.assertEqual(self.counts(url + '?o=2&p=1'), [])
+
+    def test_filtered_or_searched_changelist_counts_exactly(self):
+        url = reverse('admin:app2_farmer_changelist')
+        self.assertTrue(self.counts(url + '?farmer_type=Starter'))
+        self.assertTrue(self.counts(url + '?q=nobody'))
+
+    @override_settings(BROODER_SITES=TWO_SITES)
+    def test_estimate_reads_the_sites_own_rows(self):
+        farmers = list(Farmer.objects.order_by('pk'))
+        with sites.override('north'):
+            Farmer.objects.create(**{
+                field: getattr(farmers[0], field) for field in (
+                    'date_of_birth', 'gender', 'phone_number', 'recommender_name', 'recommender_nin',
+                    'address', 'recommender_tel', 'farmer_type',
+                )
+            }, farmer_name='Northern Farmer', farmer_nin='CMNORTH', email='north@example.com')
+        response = self.client.get(reverse('admin:app2_farmer_changelist'))
+        self.assertEqual(response.context['cl'].paginator.count, farmers[-1].pk)
+
+    def test_bulk_reject_sends_the_live_events(self):
+        pending = list(ChickRequest.objects.filter(request_status='Pending').values_list('pk', flat=True))
+        self.assertTrue(pending)
+        _, last_id = live.hub.replay(['requests'], 'main')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:app2_chickrequest_changelist'), {
+                'action': 'mark_rejected', '_selected_action': pending,
+            })
+        events, _ = live.hub.replay(['requests'], 'main', last_id)
+        self.assertEqual(sorted(event.data['id'] for event in events), sorted(pending))
+        self.assertEqual({(event.data['status'], event.data['pending_delta']) for event in events}, {('Rejected', -1)})
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(10)
+        # half the sales are settled; everything was made before the cutoff
+        self.paid = self.seeded['sales'][::2]
+        Sale.objects.filter(pk__in=[sale.pk for sale in self.paid]).update(payment_status='paid')
+        self.cutoff = timezone.now() + timedelta(seconds=1)
+
+    def test_closed_requests_and_settled_sales_move_together(self):
+        pending = ChickRequest.objects.filter(request_status='Pending').count()
+        with mock.patch.object(live, 'publish') as publish:
+            moved = archive_closed_records(self.cutoff, chunk_size=3)
+        # closed rows leave no dashboard state behind, so nothing is broadcast
+        publish.assert_not_called()
+
+        rejected = [req for req in self.seeded['chick_requests'] if req.request_status == 'Rejected']
+        self.assertEqual(moved, {'chick_requests': len(self.paid) + len(rejected), 'sales': len(self.paid)})
+        self.assertEqual(ArchivedSale.objects.count(), len(self.paid))
+        self.assertEqual(ChickRequest.objects.filter(request_status='Pending').count(), pending)
+        # a fulfilled request with an unpaid sale stays hot with its sale
+        self.assertFalse(ChickRequest.objects.filter(request_status='Rejected').exists())
+        self.assertFalse(Sale.objects.filter(payment_status='paid').exists())
+        self.assertTrue(all(sale.chick_request_id for sale in Sale.objects.all()))
+        # the request-sale link survives the move
+        for sale in self.paid:
+            archived = ArchivedSale.objects.get(pk=sale.pk)
+            self.assertEqual(archived.chick_request_id, sale.chick_request_id)
+            self.assertEqual(archived.chick_request.sale, archived)
+
+    def test_history_reads_hot_and_archived_rows(self):
+        farmer = self.paid[0].customer
+        requests_before = sorted(row['id'] for row in request_history(farmer))
+        sales_before = sorted(row['id'] for row in sale_history(farmer))
+        archive_closed_records(self.cutoff)
+        self.assertTrue(ArchivedChickRequest.objects.filter(farmer=farmer).exists())
+        self.assertTrue(ChickRequest.objects.filter(farmer=farmer).exists())
+        self.assertEqual(sorted(row['id'] for row in request_history(farmer)), requests_before)
+        self.assertEqual(sorted(row['id'] for row in sale_history(farmer)), sales_before)
+        sale = next(row for row in sale_history(farmer) if row['id'] == self.paid[0].pk)
+        self.assertEqual(sale['chick_request_id'], self.paid[0].chick_request_id)
+
+
+def farmer_item(key, nin, **fields):
+    return {
+        'idempotency_key': key, 'farmer_name': 'Okello Peter', 'date_of_birth': '2000-01-01', 'gender': 'Male',
+        'farmer_nin': nin, 'phone_number': '0772000001', 'recommender_name': 'Akello Ruth',
+        'recommender_nin': 'CM900', 'address': 'Gulu', 'email': f"{nin.lower()}@example.com",
+        'recommender_tel': '0772000002', 'farmer_type': 'Starter', **fields,
+    }
+
+
+class SyncBatchTests(TestCase):
+    def setUp(self):
+        ChickStock.objects.create(
+            batch_number='B-1', chick_type='Layers', chick_breed='local', chick_price=1650,
+            chick_quantity=1000, registered_by='manager', chicks_period=1,
+        )
+        self.client.force_login(create_staff_user('rep', 'sales_rep'))
+        self.url = reverse('api_sync_batch')
+
+    def sync(self, payload):
+        return self.client.post(self.url, json.dumps(payload), content_type='application/json')
+
+    def test_retried_batch_returns_the_original_records(self):
+        payload = {
+            'farmers': [farmer_item('f-1', 'CM001')],
+            'chick_requests': [{
+                'idempotency_key': 'r-1', 'farmer_nin': 'CM001', 'farmer_type': 'Starter',
+                'chick_type': 'Layers', 'chick_breed': 'local', 'quantity_requested': 50,
+            }],
+        }
+        first = self.sync(payload).json()
+        self.assertEqual(first['summary'], {'created': 2, 'duplicate': 0, 'error': 0})
+        retry = self.sync(payload).json()
+        self.assertEqual(retry['summary'], {'created': 0, 'duplicate': 2, 'error': 0})
+        self.assertEqual([entry['id'] for entry in retry['results']], [entry['id'] for entry in first['results']])
+        self.assertEqual(Farmer.objects.count(), 1)
+        self.assertEqual(ChickRequest.objects.get().farmer.farmer_nin, 'CM001')
+
+    def test_duplicates_within_one_batch(self):
+        response = self.sync({'farmers': [
+            farmer_item('f-1', 'CM001'),
+            # queued twice on the device
+            farmer_item('f-1', 'CM001'),
+            # a different key for a nin already in the batch
+            farmer_item('f-2', 'CM001', email='other@example.com'),
+        ]}).json()
+        created, repeated, clash = response['results']
+        self.assertEqual(created['status'], 'created')
+        self.assertEqual((repeated['status'], repeated['id']), ('duplicate', created['id']))
+        self.assertEqual(clash['status'], 'error')
+        self.assertIn('farmer_nin', clash['errors'])
+        self.assertEqual(Farmer.objects.count(), 1)
+
+    def test_invalid_items_are_reported_one_by_one(self):
+        response = self.sync({'farmers': [
+            farmer_item('f-1', 'CM001'),
+            farmer_item('f-2', 'CM002', gender='Other'),
+            {**farmer_item('f-3', 'CM003'), 'farmer_nin': ['CM003'], 'email': {'address': 'x'}},
+            'not an object',
+            farmer_item('', 'CM004'),
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([entry['status'] for entry in results], ['created', 'error', 'error', 'error', 'error'])
+        self.assertIn('gender', results[1]['errors'])
+        self.assertEqual(set(results[2]['errors']), {'farmer_nin', 'email'})
+        self.assertIn('item', results[3]['errors'])
+        self.assertIn('idempotency_key', results[4]['errors'])
+        self.assertEqual(list(Farmer.objects.values_list('farmer_nin', flat=True)), ['CM001'])
+
+    def test_requests_in_one_batch_share_the_stock(self):
+        nins = [f'CM00{n}' for n in range(1, 5)]
+        response = self.sync({
+            'farmers': [farmer_item(f'f-{nin}', nin, farmer_type='Returning') for nin in nins],
+            'chick_requests': [{
+                'idempotency_key': f'r-{nin}', 'farmer_nin': nin, 'farmer_type': 'Returning',
+                'chick_type': 'Layers', 'chick_breed': 'local', 'quantity_requested': 300,
+            } for nin in nins],
+        }).json()
+        statuses = [entry['status'] for entry in response['results'] if entry['type'] == 'chick_request']
+        # 1000 chicks: three requests of 300 fit, the fourth does not
+        self.assertEqual(statuses, ['created', 'created', 'created', 'error'])
+        self.assertEqual(ChickRequest.objects.count(), 3)
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES, LIVE_EVENTS_BACKEND='app2.live.LocalBackend')
+class ProfilerTests(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+        settings_override = override_settings(PROFILER_DIR=self.profile_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        auth_cache.clear()
+        self.client.force_login(create_staff_user('manager', 'brooder_manager'))
+
+    def saved(self, extension):
+        return sorted(name for name in os.listdir(self.profile_dir) if name.endswith(extension))
+
+    def test_staff_request_writes_profile_and_stacks(self):
+        response = self.client.get(reverse('brooder_manager_dashboard'), HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        [meta] = self.saved('.json')
+        base = os.path.join(self.profile_dir, meta[:-len('.json')])
+        with open(base + '.json') as f:
+            self.assertEqual(json.load(f)['url_name'], 'brooder_manager_dashboard')
+        functions = {name for _, _, name in pstats.Stats(base + '.prof').stats}
+        self.assertIn('brooder_manager_dashboard', functions)
+        with open(base + '.collapsed') as f:
+            for line in f:
+                self.assertRegex(line, r'^\S.* \d+$')
+
+    def test_unrequested_and_async_views_are_not_profiled(self):
+        self.client.get(reverse('brooder_manager_dashboard'))
+        response = self.client.get(reverse('live_events'), {'topics': 'requests', 'profile': '1'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('retry:', response.content.decode())
+        self.assertEqual(self.saved('.json'), [])
+
+    def test_download_serves_only_profile_files(self):
+        self.client.get(reverse('brooder_manager_dashboard'), {'profile': '1'})
+        [name] = [meta[:-len('.json')] for meta in self.saved('.json')]
+        self.assertContains(self.client.get(reverse('profile_list')), name)
+        response = self.client.get(reverse('profile_download', args=[name + '.prof']))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(self.client.get(reverse('profile_download', args=[name + '.json'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('profile_download', args=['missing.prof'])).status_code, 404)
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class FarmerDeletionTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(6)
+        self.farmer = self.seeded['farmers'][0]
+        self.requests = ChickRequest.objects.filter(farmer=self.farmer)
+        self.client.force_login(self.seeded['sales_rep'])
+        self.client.post(reverse('farmer_delete', args=[self.farmer.pk]))
+
+    def test_tombstoned_farmer_and_their_requests_are_hidden(self):
+        self.assertFalse(Farmer.objects.filter(pk=self.farmer.pk).exists())
+        self.assertEqual(FarmerDeletion.objects.get().farmer_id, self.farmer.pk)
+        # the rows themselves wait for the background purge
+        self.assertTrue(self.requests.exists())
+
+        pending, approved = self.requests.order_by('pk')[:2]
+        self.assertEqual(pending.request_status, 'Pending')
+        ChickRequest.objects.filter(pk=approved.pk).update(request_status='Approved')
+        self.client.force_login(self.seeded['brooder_manager'])
+        page = self.client.get(reverse('manage_requests'))
+        self.assertNotIn(pending, page.context['pending_requests'])
+        response = self.client.post(reverse('manage_requests'), {'action': 'approve', 'request_id': pending.pk})
+        self.assertEqual(response.status_code, 404)
+        pending.refresh_from_db()
+        self.assertEqual(pending.request_status, 'Pending')
+
+        self.client.force_login(self.seeded['sales_rep'])
+        page = self.client.get(reverse('process_sales'))
+        self.assertNotIn(approved, page.context['approved_requests'])
+        response = self.client.post(reverse('process_sales'), {'request_id': approved.pk})
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Sale.objects.filter(chick_request=approved).exists())
+
+    def test_tombstoned_farmers_sales_and_requests_leave_lists_and_reports(self):
+        sale = self.seeded['sales'][0]
+        Sale.objects.filter(pk=sale.pk).update(customer=self.farmer)
+        chick_request = self.requests.first()
+        self.assertEqual(self.client.get(reverse('sale_detail', args=[sale.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('chick_request_detail', args=[chick_request.pk])).status_code, 404)
+        self.assertNotIn(sale, self.client.get(reverse('sales_rep_dashboard')).context['recent_sales'])
+        self.assertNotIn(sale, self.client.get(reverse('view_all_sales')).context['sales'])
+        report = self.client.get(reverse('sales_rep_report')).context
+        self.assertEqual(report['total_requests_submitted'], ChickRequest.objects.exclude(farmer=self.farmer).count())
+
+        listed = {}
+        for resource in ('sales', 'chick-requests'):
+            response = self.client.get(reverse('api_resource_list', args=[resource]), {'fields': 'id'})
+            listed[resource] = {row['id'] for row in json.loads(response.content)['results']}
+        self.assertNotIn(sale.pk, listed['sales'])
+        self.assertNotIn(chick_request.pk, listed['chick-requests'])
+        summary = consolidated_report()['totals']
+        self.assertEqual(summary['sales'], Sale.objects.exclude(customer=self.farmer).count())
+
+    def test_tombstone_sends_the_pending_count_change(self):
+        farmer = self.seeded['farmers'][1]
+        ChickRequest.objects.create(
+            farmer=farmer, farmer_type='Starter', chick_type='Layers', chick_breed='local',
+            quantity_requested=100, took_feeds='NO',
+        )
+        pending = ChickRequest.objects.filter(farmer=farmer, request_status='Pending').count()
+        _, last_id = live.hub.replay(['requests'], 'main')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('farmer_delete', args=[farmer.pk]))
+        events, _ = live.hub.replay(['requests'], 'main', last_id)
+        self.assertEqual({event.data['status'] for event in events}, {'Deleted'})
+        self.assertEqual(sum(event.data['pending_delta'] for event in events), -pending)
+
+    def test_purge_removes_the_farmer_in_chunks(self):
+        others = ChickRequest.objects.exclude(farmer=self.farmer).count()
+        total = count_cascade(Farmer, {'pk': self.farmer.pk})
+        with CaptureQueriesContext(connection) as queries:
+            call_command('purge_deleted_farmers', once=True, chunk_size=2, stdout=io.StringIO())
+        job = FarmerDeletion.objects.get()
+        self.assertEqual((job.status, job.total, job.deleted), ('done', total, total))
+        self.assertEqual(job.progress['app2.ChickRequest'], len(self.seeded['chick_requests']) - others)
+        self.assertFalse(Farmer.all_objects.filter(pk=self.farmer.pk).exists())
+        self.assertFalse(self.requests.exists())
+        self.assertFalse(Sale.objects.filter(customer_id=self.farmer.pk).exists())
+        self.assertEqual(ChickRequest.objects.count(), others)
+        # two rows per DELETE
+        deletes = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('DELETE FROM "app2_chickrequest"')]
+        self.assertEqual(len(deletes), -(-job.progress['app2.ChickRequest'] // 2))
+
+
+@override_settings(BROODER_SITES=TWO_SITES, STORAGES=PLAIN_STATIC_STORAGES)
+class SiteScopingTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(4)
+        with sites.override('north'):
+            self.north_farmer = Farmer.objects.create(**{
+                field: getattr(self.seeded['farmers'][0], field) for field in (
+                    'date_of_birth', 'gender', 'phone_number', 'recommender_name', 'recommender_nin',
+                    'address', 'recommender_tel', 'farmer_type',
+                )
+            }, farmer_name='Northern Farmer', farmer_nin='CMNORTH', email='north@example.com')
+            ChickRequest.objects.create(
+                farmer=self.north_farmer, farmer_type='Starter', chick_type='Layers', chick_breed='local',
+                quantity_requested=70, took_feeds='NO',
+            )
+
+    def test_managers_hide_other_sites_rows(self):
+        with sites.override('north'):
+            self.assertEqual(list(Farmer.objects.all()), [self.north_farmer])
+            self.assertEqual(ChickRequest.objects.get().quantity_requested, 70)
+            self.assertFalse(Sale.objects.exists())
+        with sites.override('main'):
+            self.assertNotIn(self.north_farmer, Farmer.objects.all())
+            self.assertEqual(Farmer.objects.count(), len(self.seeded['farmers']))
+        # nothing active: commands and migrations see every site
+        self.assertEqual(Farmer.objects.count(), len(self.seeded['farmers']) + 1)
+
+    def test_staff_only_see_their_own_site(self):
+        user = create_staff_user('north_rep', 'sales_rep')
+        UserProfile.objects.filter(user=user).update(site='north')
+        self.client.force_login(user)
+        response = self.client.get(reverse('list_farmers'))
+        self.assertEqual(list(response.context['farmers']), [self.north_farmer])
+        self.assertEqual(self.client.get(reverse('farmer_detail', args=[self.seeded['farmers'][0].pk])).status_code, 404)
+
+    @override_settings(BROODER_SITES={**TWO_SITES, 'north': {'name': 'North Brooder', 'database': 'north'}})
+    def test_router_picks_the_sites_database(self):
+        router = sites.SiteRouter()
+        with sites.override('north'):
+            self.assertEqual(router.db_for_read(Farmer), 'north')
+            self.assertEqual(router.db_for_write(Sale), 'north')
+            # shared tables stay in 'default'
+            self.assertIsNone(router.db_for_write(StockMovement))
+            self.assertIsNone(router.db_for_read(User))
+        # a row goes back to the database it was read from, whatever is active
+        with sites.override('north'):
+            self.assertEqual(router.db_for_write(Farmer, instance=self.seeded['farmers'][0]), 'default')
+        self.assertEqual(router.db_for_write(Farmer, instance=Farmer(site='north')), 'north')
+        self.assertIsNone(router.db_for_read(Farmer))
+        with self.assertRaises(ImproperlyConfigured):
+            sites.site_database('south')
+
+    @override_settings(BROODER_SITES={**TWO_SITES, 'north': {'name': 'North Brooder', 'database': 'north'}})
+    def test_nin_and_email_are_checked_in_every_site_database(self):
+        asked = []
+
+        # the test run has one database: 'north' answers from it
+        def using(alias):
+            asked.append(alias)
+            return Farmer.all_objects.get_queryset()
+
+        with mock.patch.object(Farmer.all_objects, 'using', side_effect=using):
+            self.assertEqual(Farmer.all_objects.taken('farmer_nin', ['CMNORTH', 'CMFREE']), {'CMNORTH'})
+            self.assertEqual(asked, ['default', 'north'])
+            self.assertEqual(Farmer.all_objects.taken('email', ['north@example.com']), {'north@example.com'})
+
+    @override_settings(SITE_REPORT_WORKERS=1)
+    def test_consolidated_report_sums_every_site(self):
+        report = consolidated_report()
+        by_site = {row['site']: row for row in report['sites']}
+        self.assertEqual(by_site['north']['farmers'], 1)
+        self.assertEqual(by_site['north']['pending'], 1)
+        self.assertEqual(by_site['main']['farmers'], len(self.seeded['farmers']))
+        self.assertEqual(by_site['main']['sales'], len(self.seeded['sales']))
+        for field in ('farmers', 'pending', 'sales', 'revenue', 'chicks_in_stock'):
+            self.assertEqual(report['totals'][field], by_site['main'][field] + by_site['north'][field])
+
+    def test_consolidated_report_queries_sites_in_parallel(self):
+        threads = set()
+
+        def summary(site):
+            threads.add(threading.get_ident())
+            return {'site': site, **{field: 1 for field in ('farmers', 'revenue')}}
+
+        with override_settings(SITE_REPORT_WORKERS=2), \
+                mock.patch('app2.site_reports.SUMMARY_FIELDS', ('farmers', 'revenue')), \
+                mock.patch('app2.site_reports.site_summary', side_effect=summary):
+            report = consolidated_report()
+        self.assertEqual([row['site'] for row in report['sites']], ['main', 'north'])
+        self.assertEqual(report['totals'], {'farmers': 2, 'revenue': 2})
+        self.assertNotIn(threading.get_ident(), threads)
+
+
+class QueryPlanAuditTests(TestCase):
+    def test_flags_full_scans_and_repeated_statements(self):
+        command = audit_query_plans.Command()
+        scan = Farmer.all_objects.filter(address='Gulu').query.sql_with_params()
+        findings = {finding['key'] for finding in command.analyse([scan] * 3, 3)}
+        self.assertEqual(findings, {'full_scan:app2_farmer', f"n_plus_one:{scan[0]}"})
+        # a lookup on the unique nin uses its index
+        lookup = Farmer.all_objects.filter(farmer_nin='CM001').query.sql_with_params()
+        self.assertEqual(command.analyse([lookup], 3), [])
+
+    def test_case_insensitive_label_belongs_to_the_compared_table(self):
+        command = audit_query_plans.Command()
+        search = Farmer.all_objects.filter(farmer_name__icontains='ali').query.sql_with_params()
+        self.assertEqual({finding['key'] for finding in command.analyse([search], 3)},
+                         {'case_insensitive_scan:app2_farmer'})
+        sql = 'SELECT * FROM "app2_sale" INNER JOIN "app2_farmer" T3 ON (1) WHERE T3."farmer_name" LIKE %s'
+        self.assertTrue(audit_query_plans.case_insensitive_on(sql, 'app2_farmer', 'T3'))
+        self.assertFalse(audit_query_plans.case_insensitive_on(sql, 'app2_sale'))
+        postgres = 'WHERE UPPER("app2_farmer"."farmer_nin"::text) LIKE UPPER(%s)'
+        self.assertTrue(audit_query_plans.case_insensitive_on(postgres, 'app2_farmer'))
+
+    def test_routes_get_their_arguments_or_are_skipped(self):
+        command = audit_query_plans.Command()
+        seeded = seed_demo_data(2)
+        routes = dict(command.get_routes())
+        self.assertEqual(command.route_url('api_resource_list', routes['api_resource_list'], seeded),
+                         (reverse('api_resource_list', args=['farmers']), None))
+        self.assertEqual(command.route_url('sale_detail', routes['sale_detail'], seeded),
+                         (reverse('sale_detail', args=[seeded['sales'][0].pk]), None))
+        self.assertEqual(command.route_url('profile_download', routes['profile_download'], seeded),
+                         (None, "no value for <filename>"))
+
+    def test_committed_baseline_is_valid(self):
+        with open(os.path.join(settings.BASE_DIR, 'query_plan_baseline.json')) as f:
+            baseline = json.load(f)
+        self.assertIn('list_farmers [sales_rep]', baseline)
+
+    def test_only_findings_missing_from_the_baseline_fail(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        baseline = os.path.join(directory, 'baseline.json')
+        report = {'list_farmers [sales_rep]': {'url': '/farmers/', 'status': 200, 'queries': 4, 'findings': [
+            {'key': 'full_scan:app2_farmer', 'kind': 'full_scan', 'sql': 'SELECT 1', 'detail': 'SCAN app2_farmer'},
+        ]}}
+        command = audit_query_plans.Command
+        # the seeded test database the command builds is not needed here
+        with mock.patch.object(command, 'audit', side_effect=lambda *args: json.loads(json.dumps(report))), \
+                mock.patch.object(audit_query_plans, 'seed_demo_data'), \
+                mock.patch.object(audit_query_plans, 'setup_test_environment'), \
+                mock.patch.object(audit_query_plans, 'teardown_test_environment'), \
+                mock.patch.object(connection.creation, 'create_test_db'), \
+                mock.patch.object(connection.creation, 'destroy_test_db'):
+            out = io.StringIO()
+            with self.assertRaisesMessage(CommandError, '1 new query plan finding'):
+                call_command('audit_query_plans', baseline=baseline, stdout=out)
+            call_command('audit_query_plans', baseline=baseline, update_baseline=True, stdout=out)
+            with open(baseline) as f:
+                self.assertEqual(json.load(f), {'list_farmers [sales_rep]': ['full_scan:app2_farmer']})
+            call_command('audit_query_plans', baseline=baseline, stdout=out)
+
+
+@override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+class ConditionalPageTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(5)
+        self.client.force_login(self.seeded['sales_rep'])
+        self.url = reverse('list_farmers')
+
+    def test_unchanged_page_is_answered_with_304(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('no-cache', first['Cache-Control'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        # only the aggregate ran, the farmers were neither read nor rendered
+        [farmer_query] = [query['sql'] for query in queries.captured_queries if '"app2_farmer"' in query['sql']]
+        self.assertIn('MAX(', farmer_query)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_or_deleted_row_renders_the_page_again(self):
+        first = self.client.get(self.url)
+        farmer = Farmer.objects.get(pk=self.seeded['farmers'][0].pk)
+        farmer.address = 'Lira'
+        farmer.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+        # a delete leaves MAX(updated_at) alone, the row count changes
+        second = response
+        Farmer.objects.filter(pk=self.seeded['farmers'][1].pk).update(deleted_at=timezone.now())
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=second['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+class ResourceApiTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(7)
+        self.client.force_login(self.seeded['brooder_manager'])
+        self.url = reverse('api_resource_list', args=['farmers'])
+
+    def test_cursor_pages_cover_every_row_once(self):
+        ids = []
+        params = {'limit': 3, 'fields': 'farmer_name'}
+        while True:
+            body = self.client.get(self.url, params).json()
+            self.assertLessEqual(len(body['results']), 3)
+            ids.extend(row['id'] for row in body['results'])
+            if body['next_cursor'] is None:
+                break
+            params['cursor'] = body['next_cursor']
+        self.assertEqual(ids, sorted(farmer.pk for farmer in self.seeded['farmers']))
+
+    def test_fields_projects_the_selected_columns(self):
+        body = self.client.get(self.url, {'fields': 'farmer_nin,farmer_type'}).json()
+        self.assertEqual(set(body['results'][0]), {'id', 'farmer_nin', 'farmer_type'})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, {'fields': 'farmer_nin'})
+        [select] = [query['sql'] for query in queries.captured_queries if 'FROM "app2_farmer"' in query['sql']]
+        self.assertNotIn('"farmer_name"', select)
+
+    def test_invalid_parameters_are_rejected(self):
+        response = self.client.get(self.url, {'fields': 'farmer_nin,password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['error'])
+        self.assertEqual(self.client.get(self.url, {'cursor': '!!'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'limit': '0'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_resource_list', args=['users'])).status_code, 404)
+
+    def test_large_pages_are_compressed_once(self):
+        response = self.client.get(self.url, {'limit': 1000}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(body['results']), len(self.seeded['farmers']))
+
+    def test_dates_are_written_the_same_with_either_encoder(self):
+        farmer = self.seeded['farmers'][0]
+        row = self.client.get(self.url, {'fields': 'updated_at,date_of_birth', 'limit': 1}).json()['results'][0]
+        self.assertEqual(row['updated_at'], DjangoJSONEncoder().default(Farmer.objects.get(pk=farmer.pk).updated_at))
+        self.assertTrue(row['updated_at'].endswith('Z'))
+
+    @skipUnless(api.orjson, "orjson is not installed")
+    def test_orjson_matches_the_stdlib_encoder(self):
+        data = {'at': timezone.now(), 'day': timezone.localdate(), 'amount': Decimal('12.50')}
+        with mock.patch.object(api, 'orjson', None):
+            stdlib = api.json_response(data).content
+        self.assertEqual(json.loads(api.json_response(data).content), json.loads(stdlib))
+
+
+# Records what it delivers; recipients listed in `failing` raise instead.
+class RecordingProvider(BaseProvider):
+    sent = []
+    failing = set()
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def recipient(self, farmer):
+        return farmer.farmer_nin
+
+    def send(self, recipient, subject, body):
+        if (self.channel, recipient) in self.failing:
+            raise ConnectionError("provider down")
+        self.sent.append((self.channel, recipient))
+
+
+@override_settings(
+    STORAGES=PLAIN_STATIC_STORAGES,
+    NOTIFICATION_PROVIDERS={'sms': 'app2.tests.RecordingProvider', 'email': 'app2.tests.RecordingProvider'},
+)
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(3)
+        self.farmer = self.seeded['farmers'][0]
+        RecordingProvider.sent = []
+        RecordingProvider.failing = set()
+
+    def send(self, **options):
+        call_command('send_notifications', once=True, backoff=60, stdout=io.StringIO(), **options)
+
+    def test_outbox_row_commits_with_the_approval(self):
+        pending = ChickRequest.objects.filter(request_status='Pending').first()
+        self.client.force_login(self.seeded['brooder_manager'])
+        self.client.post(reverse('manage_requests'), {'action': 'approve', 'request_id': pending.pk})
+        notification = Notification.objects.get()
+        self.assertEqual((notification.event, notification.payload['request_id']), ('request_approved', pending.pk))
+
+        # the approval fails after the notification was queued: neither is kept
+        other = ChickRequest.objects.filter(request_status='Pending').first()
+
+        def enqueue_then_conflict(*args, **kwargs):
+            enqueue(*args, **kwargs)
+            raise ConflictError("stock changed")
+
+        with mock.patch('app2.views.enqueue', side_effect=enqueue_then_conflict):
+            self.client.post(reverse('manage_requests'), {'action': 'approve', 'request_id': other.pk})
+        self.assertEqual(Notification.objects.count(), 1)
+        other.refresh_from_db()
+        self.assertEqual(other.request_status, 'Pending')
+
+    def test_claimed_rows_are_left_to_their_worker(self):
+        busy = enqueue('request_approved', self.farmer.pk, request_id=1, quantity=50)
+        Notification.objects.filter(pk=busy.pk).update(status='sending', claimed_at=timezone.now())
+        abandoned = enqueue('request_approved', self.farmer.pk, request_id=2, quantity=50)
+        Notification.objects.filter(pk=abandoned.pk).update(
+            status='sending', claimed_at=timezone.now() - timedelta(hours=1),
+        )
+        self.send(claim_timeout=300)
+        statuses = dict(Notification.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {busy.pk: 'sending', abandoned.pk: 'sent'})
+        self.assertEqual(len(RecordingProvider.sent), 2)
+
+    def test_failures_back_off_and_only_undelivered_channels_retry(self):
+        notification = enqueue('request_approved', self.farmer.pk, request_id=1, quantity=50)
+        RecordingProvider.failing = {('sms', self.farmer.farmer_nin)}
+        self.send(max_attempts=3)
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.attempts), ('pending', 1))
+        self.assertEqual(notification.delivered_channels, ['email'])
+        self.assertIn('sms: provider down', notification.last_error)
+        delay = (notification.next_attempt_at - timezone.now()).total_seconds()
+        self.assertTrue(50 < delay <= 60)
+
+        # not due yet
+        self.send(max_attempts=3)
+        self.assertEqual(Notification.objects.get().attempts, 1)
+
+        Notification.objects.update(next_attempt_at=timezone.now())
+        self.send(max_attempts=3)
+        notification.refresh_from_db()
+        # the second delay doubles
+        delay = (notification.next_attempt_at - timezone.now()).total_seconds()
+        self.assertTrue(110 < delay <= 120)
+
+        Notification.objects.update(next_attempt_at=timezone.now())
+        self.send(max_attempts=3)
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.attempts), ('failed', 3))
+        self.assertEqual(RecordingProvider.sent, [('email', self.farmer.farmer_nin)])
+
+    def test_message_that_cannot_render_fails_alone(self):
+        broken = enqueue('request_approved', self.farmer.pk, request_id=1)
+        fine = enqueue('request_approved', self.farmer.pk, request_id=2, quantity=50)
+        self.send(max_attempts=3)
+        rows = {row.pk: row for row in Notification.objects.all()}
+        self.assertEqual((rows[broken.pk].status, rows[broken.pk].claimed_by), ('failed', ''))
+        self.assertIn('render:', rows[broken.pk].last_error)
+        self.assertEqual(rows[fine.pk].status, 'sent')
+        self.assertEqual(len(RecordingProvider.sent), 2)
+
+    def test_worker_that_lost_its_claim_writes_nothing_back(self):
+        notification = enqueue('request_approved', self.farmer.pk, request_id=1, quantity=50)
+
+        # the claim times out while this worker renders; another one takes the row over
+        def taken_over(notification, farmer):
+            Notification.objects.filter(pk=notification.pk).update(claimed_by='other-worker')
+            return render_message(notification, farmer)
+
+        with mock.patch('app2.management.commands.send_notifications.render_message', side_effect=taken_over):
+            self.send()
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.claimed_by, notification.attempts),
+                         ('sending', 'other-worker', 0))
+
+
+class ReceivablesTests(TestCase):
+    def setUp(self):
+        self.seeded = seed_demo_data(3)
+        self.farmer = self.seeded['farmers'][0]
+        self.today = timezone.now().date()
+
+    def sell(self, amount, due_in_days, status='pending'):
+        return Sale.objects.create(
+            customer=self.farmer, quantity_sold=10, amount=amount, payment_method='cash', payment_status=status,
+            feed_payment_due_date=self.today + timedelta(days=due_in_days),
+        )
+
+    def balance(self):
+        return FarmerBalance.objects.get(farmer=self.farmer)
+
+    def test_balance_follows_sales_as_they_change(self):
+        Sale.objects.filter(customer=self.farmer).delete()
+        self.assertEqual((self.balance().outstanding, self.balance().open_sales), (0, 0))
+        first = self.sell(1000, 10)
+        self.sell(500, 5)
+        self.sell(700, -3, status='paid')
+        balance = self.balance()
+        self.assertEqual((balance.outstanding, balance.open_sales), (1500, 2))
+        self.assertEqual(balance.next_due_date, self.today + timedelta(days=5))
+
+        first.payment_status = 'paid'
+        first.save()
+        self.assertEqual(self.balance().outstanding, 500)
+        # bulk changes skip the signal until the balances are refreshed
+        Sale.objects.filter(customer=self.farmer).update(payment_status='cancelled')
+        self.assertEqual(self.balance().outstanding, 500)
+        refresh_balances()
+        self.assertEqual((self.balance().outstanding, self.balance().next_due_date), (0, None))
+
+    def test_ageing_buckets_by_days_past_due(self):
+        Sale.objects.all().delete()
+        for amount, due_in_days in ((100, 3), (200, -10), (400, -45), (800, -90), (1600, -30)):
+            self.sell(amount, due_in_days)
+        self.sell(3200, -90, status='paid')
+        self.assertEqual(snapshot_ageing(self.today), 1)
+        snapshot = ReceivablesSnapshot.objects.get(farmer=self.farmer, snapshot_date=self.today)
+        self.assertEqual(
+            (snapshot.current, snapshot.days_0_30, snapshot.days_31_60, snapshot.days_over_60, snapshot.total),
+            (100, 1800, 400, 800, 3100),
+        )
+        # re-running the day replaces its rows
+        Sale.objects.filter(amount=800).update(payment_status='paid')
+        snapshot_ageing(self.today)
+        self.assertEqual(ageing_totals(self.today)['days_over_60'], 0)
+        self.assertEqual(ReceivablesSnapshot.objects.filter(snapshot_date=self.today).count(), 1)
+
+
+class ForecastTests(TestCase):
+    def test_forecast_per_type_and_breed(self):
+        seeded = seed_demo_data(4)
+        # two weeks on, the seeded requests are a complete week of history
+        today = timezone.localdate() + timedelta(days=14)
+        result = compute_forecast(today)
+        self.assertEqual(len(result['weeks']), HORIZON_WEEKS)
+        self.assertEqual(result['weeks'][0].weekday(), 0)
+        series = {(row['chick_type'], row['chick_breed']): row for row in result['series']}
+        requested = {}
+        for chick_request in seeded['chick_requests']:
+            if chick_request.request_status != 'Rejected':
+                key = (chick_request.chick_type, chick_request.chick_breed)
+                requested[key] = requested.get(key, 0) + chick_request.quantity_requested
+        self.assertEqual(set(series), set(requested))
+        for key, row in series.items():
+            self.assertEqual(len(row['weekly']), HORIZON_WEEKS)
+            self.assertEqual(row['total'], sum(row['weekly']))
+            self.assertEqual(row['shortfall'], max(row['total'] - row['on_hand'], 0))
+        ChickRequest.objects.all().delete()
+        self.assertIsNone(compute_forecast(today))
+
+    def test_short_history_is_forecast_flat(self):
+        demand = np.array([[100.0] * 30, [10.0] * 29 + [50.0]])
+        predicted = forecast(demand, first_week=0)
+        self.assertEqual(predicted.shape, (2, HORIZON_WEEKS))
+        np.testing.assert_allclose(predicted[0], 100)
+        # the latest week weighs the most, but the forecast stays flat
+        self.assertEqual(len(set(predicted[1])), 1)
+        self.assertTrue(10 < predicted[1][0] < 50)
+
+    def test_two_seasons_of_history_follow_the_season(self):
+        # three years, low in the first half of each and high in the second
+        low, high = [100.0] * (SEASON_WEEKS // 2), [300.0] * (SEASON_WEEKS // 2)
+        np.testing.assert_allclose(forecast(np.array([(low + high) * 3]), first_week=0)[0], 100)
+        np.testing.assert_allclose(forecast(np.array([(high + low) * 3]), first_week=0)[0], 300)
+        # one season short of that, the same history is forecast flat
+        flat = forecast(np.array([high + low]), first_week=0)[0]
+        self.assertEqual(len(set(flat)), 1)
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.start = timezone.now() - timedelta(days=10)
+        stock = ChickStock.objects.create(
+            batch_number='B-1', chick_type='Layers', chick_breed='local', chick_price=1650,
+            chick_quantity=1000, registered_by='manager', chicks_period=1,
+        )
+        for quantity in (900, 950):
+            stock = ChickStock.objects.get(pk=stock.pk)
+            stock.chick_quantity = quantity
+            stock.save()
+        self.stock = stock
+        # received on day 0, -100 on day 1, +50 on day 2
+        self.movements = list(StockMovement.objects.filter(item_id=stock.pk).order_by('pk'))
+        self.assertEqual([movement.delta for movement in self.movements], [1000, -100, 50])
+        for day, movement in enumerate(self.movements):
+            StockMovement.objects.filter(pk=movement.pk).update(created_at=self.start + timedelta(days=day))
+
+    def quantity_at(self, moment):
+        return {position['item_id']: position['quantity'] for position in inventory_at(moment)}.get(self.stock.pk)
+
+    def test_replays_the_movements_without_a_checkpoint(self):
+        self.assertIsNone(self.quantity_at(self.start - timedelta(hours=1)))
+        self.assertEqual(self.quantity_at(self.start + timedelta(hours=12)), 1000)
+        self.assertEqual(self.quantity_at(self.start + timedelta(days=1, hours=12)), 900)
+        [position] = inventory_at(self.start + timedelta(days=3))
+        self.assertEqual((position['quantity'], position['value']), (950, 950 * 1650))
+
+    def test_starts_from_the_latest_checkpoint(self):
+        checkpoint = self.start + timedelta(days=1, hours=12)
+        self.assertEqual(take_snapshot(checkpoint), 1)
+        self.assertEqual(StockSnapshot.objects.get().quantity, 900)
+        # movements before the checkpoint are no longer read
+        StockMovement.objects.filter(pk=self.movements[0].pk).update(delta=0)
+        self.assertEqual(self.quantity_at(self.start + timedelta(days=3)), 950)
+        # earlier moments still replay from the start, edited movement included
+        self.assertIsNone(self.quantity_at(self.start + timedelta(hours=12)))
+
+    def test_valuation_series_reads_the_ledger_once(self):
+        moments = [self.start + timedelta(days=day, hours=12) for day in (2, 0, 1, -1)]
+        with CaptureQueriesContext(connection) as queries:
+            series = valuation_series(moments)
+        movement_reads = [query for query in queries.captured_queries if 'app2_stockmovement' in query['sql']]
+        self.assertEqual(len(movement_reads), 1)
+        for moment in moments:
+            self.assertEqual(series[moment], valuation_totals(moment))
+        self.assertEqual(series[moments[2]]['chick']['units'], 900)
+
+    @override_settings(STORAGES=PLAIN_STATIC_STORAGES)
+    def test_conflicting_edit_leaves_no_ledger_note(self):
+        manager = create_staff_user('manager', 'brooder_manager')
+        self.client.force_login(manager)
+        stale = self.stock.version
+        ChickStock.objects.filter(pk=self.stock.pk).update(version=stale + 1)
+        url = reverse('chick_stock_update', args=[self.stock.pk])
+        with mock.patch('app2.views.save_edit_form', wraps=save_edit_form) as save:
+            response = self.client.post(url, {'chick_quantity': 700, 'version': stale})
+        self.assertEqual(response.status_code, 409)
+        edited = save.call_args.args[1]
+        self.assertIsNone(edited._ledger_note)
+        self.assertEqual(StockMovement.objects.filter(item_id=self.stock.pk).count(), 3)
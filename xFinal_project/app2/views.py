@@ -1,4 +1,6 @@
+import os
 from django.shortcuts import render, redirect, get_object_or_404
+from django.http import FileResponse, Http404
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login, logout
@@ -7,21 +9,38 @@ from django.contrib import messages
 from django.utils.timezone import now
 from django.db.models import Sum, F
 from datetime import timedelta
-from .models import UserProfile, Farmer, ChickStock, ChickRequest, Sale, FeedStock
+from .models import UserProfile, Farmer, ChickStock, ChickRequest, Sale, FeedStock, FarmerBalance, ReceivablesSnapshot, FarmerDeletion, StockMovement, DuplicateCandidate
 from .forms import CustomUserCreationForm
+from .profiling import get_profile_dir, recent_profiles
+from .conditional import conditional_page
+from .notifications import enqueue
+from .receivables import ageing_totals
+from .forecasting import get_forecast
+from .archive import request_history, sale_history
+from .purge import tombstone_farmer
+from .concurrency import ConflictError, save_edit_form
+from . import ledger, sites
+from .site_reports import consolidated_report
+from .dedupe import MergeError, merge_farmers, possible_duplicates, record_candidates
 
 # Public view for farmers to track requests and serves as the homepage
 def public_track_requests(request):
     requests = []
+    farmer = None
     error = None
     youth_nin = request.GET.get('youth_nin')
     if youth_nin:
-        try:
-            farmer = Farmer.objects.get(farmer_nin=youth_nin)
-            requests = ChickRequest.objects.filter(farmer=farmer).order_by('-request_date')
-        except Farmer.DoesNotExist:
+        # the public page has no site, look the nin up at each one
+        for site in sites.get_sites():
+            with sites.override(site):
+                farmer = Farmer.objects.filter(farmer_nin=youth_nin).first()
+                if farmer is not None:
+                    # includes requests already moved to the archive
+                    requests = list(request_history(farmer))
+                    break
+        else:
             error = "No farmer found with that Youth NIN."
-    return render(request, "track_requests_public.html", {'requests': requests, 'error': error})
+    return render(request, "track_requests_public.html", {'requests': requests, 'farmer': farmer, 'error': error})
 
 # Login view for staff (brooder_manager and sales_rep)
 def loginpage(request):
@@ -72,6 +91,15 @@ def admin_register(request):
         form = CustomUserCreationForm()
     return render(request, "register.html", {"form": form})
 
+# Requests staff can still act on: those of deleted farmers stay in the table
+# until the background purge reaches them, but are no longer listed or approved
+def open_requests():
+    return ChickRequest.objects.filter(farmer__deleted_at__isnull=True).select_related('farmer')
+
+# Sales likewise, those of deleted farmers wait for the purge out of sight
+def open_sales():
+    return Sale.objects.filter(customer__deleted_at__isnull=True).select_related('customer')
+
 # Brooder Manager dashboard with chick stock, pending requests, recent sales
 @login_required
 def brooder_manager_dashboard(request):
@@ -79,12 +107,13 @@ def brooder_manager_dashboard(request):
         messages.error(request, "Permission denied.")
         return redirect('loginpage')
     chick_stock = ChickStock.objects.all()
-    pending_requests = ChickRequest.objects.filter(request_status='Pending')
-    recent_sales = Sale.objects.order_by('-sale_date')[:5]
+    pending_requests = open_requests().filter(request_status='Pending')
+    recent_sales = open_sales().order_by('-sale_date')[:5]
     return render(request, "brooder_manager_dashboard.html", {
         'chick_stock': chick_stock,
         'pending_requests': pending_requests,
         'recent_sales': recent_sales,
+        'forecast': get_forecast(),
     })
 
 # Brooder Manager approve/reject requests
@@ -97,7 +126,7 @@ def manage_requests(request):
     if request.method == 'POST':
         action = request.POST.get('action')
         req_id = request.POST.get('request_id')
-        chick_request = get_object_or_404(ChickRequest, id=req_id)
+        chick_request = get_object_or_404(open_requests(), id=req_id)
         if action == 'approve':
             stock = ChickStock.objects.filter(
                 chick_type__iexact=chick_request.chick_type,
@@ -106,20 +135,29 @@ def manage_requests(request):
             if not stock or stock.chick_quantity < chick_request.quantity_requested:
                 messages.error(request, "Insufficient stock for approval.")
             else:
-                chick_request.request_status = 'Approved'
-                chick_request.approval_date = now()
-                chick_request.save()
-                stock.chick_quantity -= chick_request.quantity_requested
-                stock.save()
-                messages.success(request, f"Request {req_id} approved.")
+                try:
+                    with sites.atomic():
+                        chick_request.request_status = 'Approved'
+                        chick_request.approval_date = now()
+                        chick_request.save()
+                        stock.chick_quantity -= chick_request.quantity_requested
+                        ledger.note(stock, 'request_approved', source=chick_request, user=request.user)
+                        stock.save()
+                        enqueue('request_approved', chick_request.farmer_id,
+                                request_id=chick_request.pk, quantity=chick_request.quantity_requested)
+                except ConflictError:
+                    # the stock row changed between reading and saving it, nothing was written
+                    messages.error(request, "Chick stock was updated at the same time. Please approve again.")
+                else:
+                    messages.success(request, f"Request {req_id} approved.")
         elif action == 'reject':
             chick_request.request_status = 'Rejected'
             chick_request.save()
             messages.success(request, f"Request {req_id} rejected.")
         return redirect('manage_requests')
     
-    pending_requests = ChickRequest.objects.filter(request_status='Pending')
-    denied_requests = ChickRequest.objects.filter(request_status='Rejected')
+    pending_requests = open_requests().filter(request_status='Pending')
+    denied_requests = open_requests().filter(request_status='Rejected')
     
     return render(request, "manage_requests.html", {
         'pending_requests': pending_requests,
@@ -129,6 +167,7 @@ def manage_requests(request):
 # Brooder Manager manage chick stock
 @login_required
 @staff_member_required
+@conditional_page(lambda request: [ChickStock.objects.all()])
 def manage_stock(request):
     if request.user.userprofile.role != 'brooder_manager':
         messages.error(request, "Permission denied.")
@@ -152,7 +191,7 @@ def manage_stock(request):
         except (ValueError, TypeError):
             messages.error(request, "Quantity, price, and age must be positive integers.")
         else:
-            ChickStock.objects.create(
+            stock = ChickStock(
                 batch_number=batch_number,
                 chick_type=chick_type,
                 chick_breed=chick_breed,
@@ -162,6 +201,8 @@ def manage_stock(request):
                 registered_by=registered_by,
                 date_added=now(),
             )
+            ledger.note(stock, 'received', user=request.user)
+            stock.save()
             messages.success(request, "Chick stock added.")
             return redirect('manage_stock')
     stocks = ChickStock.objects.all()
@@ -170,6 +211,7 @@ def manage_stock(request):
 # Brooder Manager manages feed stock
 @login_required
 @staff_member_required
+@conditional_page(lambda request, pk=None: [FeedStock.objects.all()])
 def manage_feed_stock(request, pk=None):
     if request.user.userprofile.role != 'brooder_manager':
         messages.error(request, "Permission denied.")
@@ -182,6 +224,7 @@ def manage_feed_stock(request, pk=None):
     if request.method == 'POST':
         if 'delete' in request.POST:
             if feed_item:
+                ledger.note(feed_item, 'removed', user=request.user)
                 feed_item.delete()
                 messages.success(request, "Feed stock item deleted successfully.")
             return redirect('manage_feed_stock')
@@ -216,10 +259,15 @@ def manage_feed_stock(request, pk=None):
             feed_item.selling_price = selling_price
             feed_item.supplier = supplier
             feed_item.supplier_contact = supplier_contact
-            feed_item.save()
+            ledger.note(feed_item, 'adjustment', user=request.user)
+            try:
+                feed_item.save()
+            except ConflictError:
+                messages.error(request, "This feed stock item was changed by someone else. Please try again.")
+                return redirect('manage_feed_stock', pk=pk)
             messages.success(request, "Feed stock item updated successfully.")
         else:
-            FeedStock.objects.create(
+            feed_item = FeedStock(
                 name=name,
                 feed_type=feed_type,
                 feed_brand=feed_brand,
@@ -230,6 +278,8 @@ def manage_feed_stock(request, pk=None):
                 supplier=supplier,
                 supplier_contact=supplier_contact
             )
+            ledger.note(feed_item, 'received', user=request.user)
+            feed_item.save()
             messages.success(request, "Feed stock item added successfully.")
         return redirect('manage_feed_stock')
 
@@ -242,9 +292,9 @@ def sales_rep_dashboard(request):
     if request.user.userprofile.role != 'sales_rep':
         messages.error(request, "Permission denied.")
         return redirect('loginpage')
-    pending_requests = ChickRequest.objects.filter(request_status='Pending')
-    recent_sales = Sale.objects.order_by('-sale_date')[:5]
-    denied_requests = ChickRequest.objects.filter(request_status='Rejected')
+    pending_requests = open_requests().filter(request_status='Pending')
+    recent_sales = open_sales().order_by('-sale_date')[:5]
+    denied_requests = open_requests().filter(request_status='Rejected')
     return render(request, "sales_rep_dashboard.html", {
         'pending_requests': pending_requests,
         'recent_sales': recent_sales,
@@ -321,29 +371,44 @@ def process_sales(request):
         return redirect('loginpage')
     if request.method == 'POST':
         req_id = request.POST.get('request_id')
-        chick_request = get_object_or_404(ChickRequest, id=req_id)
+        chick_request = get_object_or_404(open_requests(), id=req_id)
         if chick_request.request_status != 'Approved':
             messages.error(request, "Only approved requests can be processed.")
             return redirect('process_sales')
+        try:
+            record_sale(request, chick_request)
+        except ConflictError:
+            messages.error(request, "Feed stock was updated at the same time. Please process the sale again.")
+            return redirect('process_sales')
+        messages.success(request, f"Sale processed for request {req_id}.")
+        return redirect('process_sales')
+    approved_requests = open_requests().filter(request_status='Approved')
+    return render(request, "process_sales.html", {'approved_requests': approved_requests})
+
+# Marks the request fulfilled, takes the feed bags off the generic feed stock
+# and records the sale, all or nothing
+def record_sale(request, chick_request):
+    with sites.atomic():
         chick_request.request_status = 'Fulfilled'
         chick_request.save()
         price_per_unit = 1650
         quantity = chick_request.quantity_requested
         total_amount = price_per_unit * quantity
         feed_due_date = now().date() + timedelta(days=60)
-        
+    
         # Reduce feed stock quantity
         feed_bags_to_reduce = 2  # Assuming 2 bags per sale for now
         try:
             generic_feed = FeedStock.objects.get(name__iexact='generic feed')
             if generic_feed.quantity >= feed_bags_to_reduce:
                 generic_feed.quantity -= feed_bags_to_reduce
+                ledger.note(generic_feed, 'feed_issued', source=chick_request, user=request.user)
                 generic_feed.save()
             else:
                 messages.warning(request, "Not enough feed stock to deduct for this sale.")
         except FeedStock.DoesNotExist:
             messages.warning(request, "Generic feed stock item not found.")
-            
+        
         Sale.objects.create(
             customer=chick_request.farmer,
             chick_request=chick_request,
@@ -355,16 +420,15 @@ def process_sales(request):
             payment_status='pending',
             payment_method='cash',
         )
-        messages.success(request, f"Sale processed for request {req_id}.")
-        return redirect('process_sales')
-    approved_requests = ChickRequest.objects.filter(request_status='Approved')
-    return render(request, "process_sales.html", {'approved_requests': approved_requests})
+        enqueue('sale_recorded', chick_request.farmer_id, request_id=chick_request.pk, quantity=quantity,
+                amount=total_amount, due_date=feed_due_date.isoformat())
 
 # New view to list all sales
 @login_required
 @staff_member_required
+@conditional_page(lambda request: [Sale.objects.all(), Farmer.objects.all()])
 def view_all_sales(request):
-    sales = Sale.objects.order_by('-sale_date')
+    sales = open_sales().order_by('-sale_date')
     return render(request, "all_sales.html", {'sales': sales})
 
 
@@ -388,10 +452,24 @@ def register_farmer(request):
         recommender_tel = request.POST.get('recommender_tel')
         email = request.POST.get('email')
 
-        if Farmer.objects.filter(farmer_nin=farmer_nin).exists():
+        # near matches (typo'd NIN, other spelling of the name) are shown first;
+        # the sales rep then registers anyway or opens the existing farmer
+        confirmed = bool(request.POST.get('confirm_new'))
+        duplicates = possible_duplicates(request.POST)
+
+        # a farmer still being deleted in the background keeps the NIN until the purge finishes
+        if Farmer.all_objects.taken('farmer_nin', [farmer_nin]):
             messages.error(request, "A farmer with this NIN already exists.")
+        elif Farmer.all_objects.taken('email', [email]):
+            messages.error(request, "A farmer with this email already exists.")
+        elif duplicates and not confirmed:
+            matches = Farmer.objects.in_bulk([candidate.farmer_id for candidate in duplicates])
+            return render(request, "register_farmer.html", {
+                'duplicates': [(candidate, matches[candidate.farmer_id]) for candidate in duplicates],
+                'posted': [(name, value) for name, value in request.POST.items() if name != 'csrfmiddlewaretoken'],
+            })
         else:
-            Farmer.objects.create(
+            farmer = Farmer.objects.create(
                 farmer_name=farmer_name,
                 farmer_nin=farmer_nin,
                 gender=gender,
@@ -404,6 +482,8 @@ def register_farmer(request):
                 recommender_tel=recommender_tel,
                 email=email,
             )
+            # kept for review on the duplicates page
+            record_candidates(duplicates, farmer_id=farmer.pk)
             messages.success(request, "Farmer registered successfully!")
             return redirect('list_farmers')
 
@@ -411,14 +491,22 @@ def register_farmer(request):
     return render(request, "register_farmer.html", {'farmer_types': farmer_types})
 
 @login_required
+@conditional_page(lambda request: [Farmer.objects.all()])
 def list_farmers(request):
     farmers = Farmer.objects.all().order_by('farmer_name')
     return render(request, 'list_farmers.html', {'farmers': farmers})
 
 @login_required
+@conditional_page(lambda request, pk: [
+    Farmer.objects.filter(pk=pk), ChickRequest.objects.filter(farmer_id=pk), Sale.objects.filter(customer_id=pk),
+])
 def farmer_detail(request, pk):
     farmer = get_object_or_404(Farmer, pk=pk)
-    return render(request, 'farmer_detail.html', {'farmer': farmer})
+    return render(request, 'farmer_detail.html', {
+        'farmer': farmer,
+        'chick_requests': request_history(farmer),
+        'sales': sale_history(farmer),
+    })
 
 @login_required
 def farmer_update(request, pk):
@@ -427,24 +515,18 @@ def farmer_update(request, pk):
         return redirect('loginpage')
     
     farmer = get_object_or_404(Farmer, pk=pk)
+    status = 200
     if request.method == 'POST':
-        farmer.farmer_name = request.POST.get('farmer_name')
-        farmer.gender = request.POST.get('gender')
-        farmer.date_of_birth = request.POST.get('date_of_birth')
-        farmer.phone_number = request.POST.get('phone_number')
-        farmer.address = request.POST.get('address')
-        farmer.farmer_type = request.POST.get('farmer_type')
-        farmer.recommender_name = request.POST.get('recommender_name')
-        farmer.recommender_nin = request.POST.get('recommender_nin')
-        farmer.recommender_tel = request.POST.get('recommender_tel')
-        farmer.email = request.POST.get('email')
-        farmer.registration_date = request.POST.get('registration_date')
-        farmer.save()
-        messages.success(request, "Farmer details updated successfully!")
-        return redirect('farmer_detail', pk=farmer.pk)
+        status = save_edit_form(request, farmer, [
+            'farmer_name', 'gender', 'date_of_birth', 'phone_number', 'address', 'farmer_type',
+            'recommender_name', 'recommender_nin', 'recommender_tel', 'email', 'registration_date',
+        ])
+        if status is None:
+            messages.success(request, "Farmer details updated successfully!")
+            return redirect('farmer_detail', pk=farmer.pk)
 
     farmer_types = ChickRequest.FARMER_TYPES
-    return render(request, 'farmer_update.html', {'farmer': farmer, 'farmer_types': farmer_types})
+    return render(request, 'farmer_update.html', {'farmer': farmer, 'farmer_types': farmer_types}, status=status)
 
 @login_required
 def farmer_delete(request, pk):
@@ -454,8 +536,9 @@ def farmer_delete(request, pk):
     
     farmer = get_object_or_404(Farmer, pk=pk)
     if request.method == 'POST':
-        farmer.delete()
-        messages.success(request, "Farmer record deleted successfully!")
+        # the farmer disappears now, their requests and sales are removed in the background
+        tombstone_farmer(farmer, request.user)
+        messages.success(request, "Farmer record deleted successfully! Their history is being removed in the background.")
         return redirect('list_farmers')
 
     return render(request, 'farmer_delete.html', {'farmer': farmer})
@@ -464,14 +547,17 @@ def farmer_delete(request, pk):
 # Chick Request CRUD
 @login_required
 @staff_member_required
+@conditional_page(lambda request, pk: [
+    ChickRequest.objects.filter(pk=pk), Farmer.objects.filter(chickrequest=pk),
+])
 def chick_request_detail(request, pk):
-    chick_request = get_object_or_404(ChickRequest, pk=pk)
+    chick_request = get_object_or_404(open_requests(), pk=pk)
     return render(request, 'chick_request_detail.html', {'chick_request': chick_request})
 
 @login_required
 @staff_member_required
 def chick_request_update(request, pk):
-    chick_request = get_object_or_404(ChickRequest, pk=pk)
+    chick_request = get_object_or_404(open_requests(), pk=pk)
     if request.method == 'POST':
         # Update logic here based on form data
         messages.success(request, 'Request updated successfully.')
@@ -481,7 +567,7 @@ def chick_request_update(request, pk):
 @login_required
 @staff_member_required
 def chick_request_delete(request, pk):
-    chick_request = get_object_or_404(ChickRequest, pk=pk)
+    chick_request = get_object_or_404(open_requests(), pk=pk)
     if request.method == 'POST':
         chick_request.delete()
         messages.success(request, 'Request deleted successfully.')
@@ -491,6 +577,7 @@ def chick_request_delete(request, pk):
 # Chick Stock CRUD
 @login_required
 @staff_member_required
+@conditional_page(lambda request, pk: [ChickStock.objects.filter(pk=pk)])
 def chick_stock_detail(request, pk):
     chick_stock = get_object_or_404(ChickStock, pk=pk)
     return render(request, 'chick_stock_detail.html', {'chick_stock': chick_stock})
@@ -499,23 +586,23 @@ def chick_stock_detail(request, pk):
 @staff_member_required
 def chick_stock_update(request, pk):
     chick_stock = get_object_or_404(ChickStock, pk=pk)
+    status = 200
     if request.method == 'POST':
-        chick_stock.batch_number = request.POST.get('batch_number', chick_stock.batch_number)
-        chick_stock.chick_type = request.POST.get('chick_type', chick_stock.chick_type)
-        chick_stock.chick_breed = request.POST.get('chick_breed', chick_stock.chick_breed)
-        chick_stock.chick_price = request.POST.get('chick_price', chick_stock.chick_price)
-        chick_stock.chick_quantity = request.POST.get('chick_quantity', chick_stock.chick_quantity)
-        chick_stock.chicks_period = request.POST.get('chicks_period', chick_stock.chicks_period)
-        chick_stock.save()
-        messages.success(request, 'Chick stock updated successfully.')
-        return redirect('chick_stock_detail', pk=pk)
-    return render(request, 'chick_stock_update.html', {'chick_stock': chick_stock})
+        with ledger.noted(chick_stock, 'adjustment', user=request.user):
+            status = save_edit_form(request, chick_stock, [
+                'batch_number', 'chick_type', 'chick_breed', 'chick_price', 'chick_quantity', 'chicks_period',
+            ])
+        if status is None:
+            messages.success(request, 'Chick stock updated successfully.')
+            return redirect('chick_stock_detail', pk=pk)
+    return render(request, 'chick_stock_update.html', {'chick_stock': chick_stock}, status=status)
 
 @login_required
 @staff_member_required
 def chick_stock_delete(request, pk):
     chick_stock = get_object_or_404(ChickStock, pk=pk)
     if request.method == 'POST':
+        ledger.note(chick_stock, 'removed', user=request.user)
         chick_stock.delete()
         messages.success(request, 'Stock deleted successfully.')
         return redirect('manage_stock')
@@ -524,6 +611,7 @@ def chick_stock_delete(request, pk):
 # Feed Stock CRUD
 @login_required
 @staff_member_required
+@conditional_page(lambda request, pk: [FeedStock.objects.filter(pk=pk)])
 def feed_stock_detail(request, pk):
     feed_item = get_object_or_404(FeedStock, pk=pk)
     return render(request, 'feed_stock_detail.html', {'feed_item': feed_item})
@@ -532,26 +620,24 @@ def feed_stock_detail(request, pk):
 @staff_member_required
 def feed_stock_update(request, pk):
     feed_item = get_object_or_404(FeedStock, pk=pk)
+    status = 200
     if request.method == 'POST':
-        feed_item.name = request.POST.get('name', feed_item.name)
-        feed_item.feed_type = request.POST.get('feed_type', feed_item.feed_type)
-        feed_item.feed_brand = request.POST.get('feed_brand', feed_item.feed_brand)
-        feed_item.quantity = request.POST.get('quantity', feed_item.quantity)
-        feed_item.unit_price = request.POST.get('unit_price', feed_item.unit_price)
-        feed_item.buying_price = request.POST.get('buying_price', feed_item.buying_price)
-        feed_item.selling_price = request.POST.get('selling_price', feed_item.selling_price)
-        feed_item.supplier = request.POST.get('supplier', feed_item.supplier)
-        feed_item.supplier_contact = request.POST.get('supplier_contact', feed_item.supplier_contact)
-        feed_item.save()
-        messages.success(request, 'Feed stock updated successfully.')
-        return redirect('feed_stock_detail', pk=pk)
-    return render(request, 'feed_stock_update.html', {'feed_item': feed_item})
+        with ledger.noted(feed_item, 'adjustment', user=request.user):
+            status = save_edit_form(request, feed_item, [
+                'name', 'feed_type', 'feed_brand', 'quantity', 'unit_price', 'buying_price', 'selling_price',
+                'supplier', 'supplier_contact',
+            ])
+        if status is None:
+            messages.success(request, 'Feed stock updated successfully.')
+            return redirect('feed_stock_detail', pk=pk)
+    return render(request, 'feed_stock_update.html', {'feed_item': feed_item}, status=status)
 
 @login_required
 @staff_member_required
 def feed_stock_delete(request, pk):
     feed_item = get_object_or_404(FeedStock, pk=pk)
     if request.method == 'POST':
+        ledger.note(feed_item, 'removed', user=request.user)
         feed_item.delete()
         messages.success(request, 'Feed stock deleted successfully.')
         return redirect('manage_feed_stock')
@@ -560,34 +646,85 @@ def feed_stock_delete(request, pk):
 # Sale CRUD
 @login_required
 @staff_member_required
+@conditional_page(lambda request, pk: [Sale.objects.filter(pk=pk), Farmer.objects.filter(sales=pk)])
 def sale_detail(request, pk):
-    sale = get_object_or_404(Sale, pk=pk)
+    sale = get_object_or_404(open_sales(), pk=pk)
     return render(request, 'sale_detail.html', {'sale': sale})
 
 @login_required
 @staff_member_required
 def sale_update(request, pk):
-    sale = get_object_or_404(Sale, pk=pk)
+    sale = get_object_or_404(open_sales(), pk=pk)
+    status = 200
     if request.method == 'POST':
-        sale.quantity_sold = request.POST.get('quantity_sold', sale.quantity_sold)
-        sale.amount = request.POST.get('amount', sale.amount)
-        sale.payment_status = request.POST.get('payment_status', sale.payment_status)
-        sale.payment_method = request.POST.get('payment_method', sale.payment_method)
-        sale.save()
-        messages.success(request, 'Sale updated successfully.')
-        return redirect('sale_detail', pk=pk)
-    return render(request, 'sale_update.html', {'sale': sale})
+        status = save_edit_form(request, sale, ['quantity_sold', 'amount', 'payment_status', 'payment_method'])
+        if status is None:
+            messages.success(request, 'Sale updated successfully.')
+            return redirect('sale_detail', pk=pk)
+    return render(request, 'sale_update.html', {
+        'sale': sale,
+        'payment_statuses': Sale.PAYMENT_STATUS_CHOICES,
+        'payment_methods': Sale.PAYMENT_METHOD_CHOICES,
+    }, status=status)
 
 @login_required
 @staff_member_required
 def sale_delete(request, pk):
-    sale = get_object_or_404(Sale, pk=pk)
+    sale = get_object_or_404(open_sales(), pk=pk)
     if request.method == 'POST':
         sale.delete()
         messages.success(request, 'Sale deleted successfully.')
         return redirect('sales_rep_dashboard')
     return render(request, 'sale_delete.html', {'sale': sale})
     
+# Stock valuation over time, computed from the ledger checkpoints, plus the
+# latest movements as the audit trail
+VALUATION_PERIODS = {'day': timedelta(days=1), 'week': timedelta(weeks=1), 'month': timedelta(days=30)}
+
+@login_required
+@staff_member_required
+def stock_valuation(request):
+    if request.user.userprofile.role != 'brooder_manager':
+        messages.error(request, "Permission denied.")
+        return redirect('loginpage')
+    period = request.GET.get('period')
+    if period not in VALUATION_PERIODS:
+        period = 'week'
+    try:
+        points = min(max(int(request.GET.get('points', 12)), 1), 52)
+    except ValueError:
+        points = 12
+    current = now()
+    moments = [current - VALUATION_PERIODS[period] * step for step in range(points)]
+    series = ledger.valuation_series(moments)
+    valuation = []
+    for moment in moments:
+        totals = series[moment]
+        valuation.append({
+            'moment': moment,
+            'chick': totals['chick'],
+            'feed': totals['feed'],
+            'value': totals['chick']['value'] + totals['feed']['value'],
+        })
+    movements = StockMovement.objects.select_related('created_by').order_by('-created_at', '-pk')[:50]
+    return render(request, 'stock_valuation.html', {
+        'valuation': valuation,
+        'movements': movements,
+        'period': period,
+        'points': points,
+        'periods': list(VALUATION_PERIODS),
+    })
+
+# Headline numbers of every brooder site side by side, each site queried
+# against its own database in parallel
+@login_required
+@staff_member_required
+def sites_report(request):
+    if request.user.userprofile.role != 'brooder_manager':
+        messages.error(request, "Permission denied.")
+        return redirect('loginpage')
+    return render(request, 'sites_report.html', {'report': consolidated_report(), 'current_site': request.site})
+
 # New report view for Brooder Manager
 @login_required
 @staff_member_required
@@ -643,10 +780,10 @@ def sales_rep_report(request):
     total_farmers = Farmer.objects.count()
     starter_farmers = Farmer.objects.filter(farmer_type='Starter').count()
     returning_farmers = Farmer.objects.filter(farmer_type='Returning').count()
-    total_sales = Sale.objects.aggregate(Sum('amount'))['amount__sum'] or 0
-    total_requests_submitted = ChickRequest.objects.count()
-    approved_requests = ChickRequest.objects.filter(request_status='Approved').count()
-    denied_requests = ChickRequest.objects.filter(request_status='Rejected').count()
+    total_sales = open_sales().aggregate(Sum('amount'))['amount__sum'] or 0
+    total_requests_submitted = open_requests().count()
+    approved_requests = open_requests().filter(request_status='Approved').count()
+    denied_requests = open_requests().filter(request_status='Rejected').count()
     
     context = {
         'total_farmers': total_farmers,
@@ -657,4 +794,99 @@ def sales_rep_report(request):
         'approved_requests': approved_requests,
         'denied_requests': denied_requests,
     }
-    return render(request, 'report.html', context)
\ No newline at end of file
+    return render(request, 'report.html', context)
+
+# Progress of the background farmer deletions
+@login_required
+@staff_member_required
+def farmer_deletions(request):
+    jobs = FarmerDeletion.objects.select_related('requested_by').order_by('-created_at')[:100]
+    return render(request, 'farmer_deletions.html', {
+        'jobs': jobs,
+        'in_progress': any(job.status in ('pending', 'running') for job in jobs),
+    })
+
+# Possible duplicate farmers, best first: found by find_duplicate_farmers and
+# when a sales rep registers a farmer despite the warning
+@login_required
+@staff_member_required
+def duplicate_farmers(request):
+    candidates = list(DuplicateCandidate.objects.filter(status='open').order_by('-score', 'pk')[:100])
+    farmers = Farmer.objects.in_bulk(
+        {candidate.farmer_id for candidate in candidates} | {candidate.other_id for candidate in candidates}
+    )
+    # pairs with a farmer deleted since are left out
+    pairs = [
+        (candidate, farmers[candidate.farmer_id], farmers[candidate.other_id])
+        for candidate in candidates
+        if candidate.farmer_id in farmers and candidate.other_id in farmers
+    ]
+    return render(request, 'duplicate_farmers.html', {'pairs': pairs})
+
+@login_required
+def duplicate_merge(request, pk):
+    if request.user.userprofile.role != 'sales_rep':
+        messages.error(request, "Permission denied. Only Sales Representatives can merge farmer records.")
+        return redirect('loginpage')
+
+    candidate = get_object_or_404(DuplicateCandidate, pk=pk, status='open')
+    first = get_object_or_404(Farmer, pk=candidate.farmer_id)
+    second = get_object_or_404(Farmer, pk=candidate.other_id)
+    if request.method == 'POST':
+        keep, duplicate = (second, first) if request.POST.get('keep') == str(second.pk) else (first, second)
+        try:
+            moved = merge_farmers(keep, duplicate, request.user, candidate)
+        except MergeError as exc:
+            messages.error(request, str(exc))
+            return redirect('duplicate_farmers')
+        messages.success(request, f"{duplicate.farmer_name} was merged into {keep.farmer_name}: "
+                                  f"{sum(moved.values())} record(s) moved.")
+        return redirect('farmer_detail', pk=keep.pk)
+
+    return render(request, 'duplicate_merge.html', {'candidate': candidate, 'farmers': [first, second]})
+
+@login_required
+def duplicate_dismiss(request, pk):
+    if request.user.userprofile.role != 'sales_rep':
+        messages.error(request, "Permission denied. Only Sales Representatives can review duplicate farmers.")
+        return redirect('loginpage')
+
+    candidate = get_object_or_404(DuplicateCandidate, pk=pk, status='open')
+    if request.method == 'POST':
+        candidate.status = 'dismissed'
+        candidate.resolved_by = request.user
+        candidate.resolved_at = now()
+        candidate.save(update_fields=['status', 'resolved_by', 'resolved_at'])
+        messages.success(request, "Marked as not a duplicate.")
+    return redirect('duplicate_farmers')
+
+# Collections: overdue farmers by outstanding amount, read from the
+# precomputed balances and the latest ageing snapshot
+@login_required
+@staff_member_required
+def collections(request):
+    today = now().date()
+    overdue = FarmerBalance.objects.filter(
+        next_due_date__lt=today, outstanding__gt=0,
+    ).select_related('farmer').order_by('-outstanding')[:200]
+    latest_snapshot = ReceivablesSnapshot.objects.order_by('-snapshot_date').values_list('snapshot_date', flat=True).first()
+    return render(request, 'collections.html', {
+        'overdue': [(balance, (today - balance.next_due_date).days) for balance in overdue],
+        'snapshot_date': latest_snapshot,
+        'ageing': ageing_totals(latest_snapshot) if latest_snapshot else None,
+    })
+
+# Staff page listing the most recent request profiles
+@login_required
+@staff_member_required
+def profile_list(request):
+    return render(request, 'profiles.html', {'profiles': recent_profiles()})
+
+@login_required
+@staff_member_required
+def profile_download(request, filename):
+    name, extension = os.path.splitext(filename)
+    path = os.path.join(get_profile_dir(), os.path.basename(filename))
+    if extension not in ('.prof', '.collapsed') or name != os.path.basename(name) or not os.path.exists(path):
+        raise Http404("Profile not found.")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename)
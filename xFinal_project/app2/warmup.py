@@ -0,0 +1,121 @@
+import logging
+import mimetypes
+import os
+import time
+
+from django import forms
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db import connections
+from django.template import engines
+from django.template.loader import get_template
+from django.urls import get_resolver, reverse
+from django.urls.exceptions import NoReverseMatch
+from django.utils import translation
+
+from .sites import get_sites, site_database
+
+logger = logging.getLogger(__name__)
+
+
+# A throwaway form using the common widgets, rendered once so the form
+# renderer has compiled its widget templates.
+class WarmUpForm(forms.Form):
+    text = forms.CharField()
+    number = forms.IntegerField()
+    choice = forms.ChoiceField(choices=[('a', 'a')])
+    day = forms.DateField()
+    flag = forms.BooleanField()
+    notes = forms.CharField(widget=forms.Textarea)
+    secret = forms.CharField(widget=forms.PasswordInput)
+
+
+# The URLconf is imported and both the resolve and reverse lookups built.
+def prime_urls():
+    resolver = get_resolver()
+    resolver.url_patterns
+    names = [name for name in resolver.reverse_dict if isinstance(name, str)]
+    for name in names:
+        try:
+            reverse(name)
+        except NoReverseMatch:
+            # needs arguments; building reverse_dict already compiled it
+            pass
+    return len(names)
+
+
+def template_names():
+    for engine in engines.all():
+        for directory in getattr(engine, 'template_dirs', ()):
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    if name.endswith(('.html', '.txt')):
+                        yield os.path.relpath(os.path.join(root, name), directory).replace(os.sep, '/')
+
+
+# Every project template is loaded through the cached loader, which keeps the
+# compiled Template for the life of the process.
+def prime_templates():
+    names = set(template_names())
+    for name in names:
+        try:
+            get_template(name)
+        except Exception:
+            # a broken template fails its own page, not the warm-up
+            logger.exception("Warm-up could not compile %s", name)
+    str(WarmUpForm())
+    return len(names)
+
+
+def prime_translations():
+    # the first gettext call loads every installed app's catalog
+    translation.activate(settings.LANGUAGE_CODE)
+    translation.gettext('This field is required.')
+    translation.deactivate()
+    return 1
+
+
+# The hashed-name manifest and the mime types table (read from /etc by the
+# first guess_type) that CompressedStaticMiddleware needs.
+def prime_static():
+    mimetypes.init()
+    return len(getattr(staticfiles_storage, 'hashed_files', {}))
+
+
+# Opens (and closes) a connection to every site database: the backend and
+# driver are imported and the configuration checked before traffic arrives.
+# Connections are per thread and must not cross a fork, so none is kept.
+def prime_databases():
+    aliases = list(dict.fromkeys(site_database(site) for site in get_sites()))
+    for alias in aliases:
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        connection.close()
+    return len(aliases)
+
+
+STEPS = (
+    ('urls', prime_urls),
+    ('templates', prime_templates),
+    ('translations', prime_translations),
+    ('static', prime_static),
+    ('databases', prime_databases),
+)
+
+
+# Does the one-off work of a process's first request ahead of it. Called at
+# the end of chicks/wsgi.py and chicks/asgi.py, so with a preloading server
+# (gunicorn --preload) it runs once in the master and every forked worker
+# starts warm. A step that fails is logged and skipped: warming up must not
+# keep a worker from starting. Returns the seconds each step took.
+def warm_up():
+    timings = {}
+    for name, step in STEPS:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception:
+            logger.exception("Warm-up step %s failed", name)
+        timings[name] = time.perf_counter() - started
+    return timings
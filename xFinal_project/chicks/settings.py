@@ -45,20 +45,89 @@ import os
 BASE_DIR =os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 STATIC_URL = '/static/'
 STATICFILES_DIRS =[os.path.join(BASE_DIR,'static')]
+#collectstatic writes hashed, gzip/brotli precompressed copies here
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'app2.static_pipeline.CompressedManifestStaticFilesStorage',
+    },
+}
 AUTH_USER ='app2.User'
 #LOGIN_REDIRECT_URL = '/'
 LOGIN_URL = '/login/' 
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # gzip/brotli for dynamic responses, see RESPONSE_COMPRESSION_MIN_SIZE
+    'app2.compression.ResponseCompressionMiddleware',
+    # serves STATIC_ROOT with far-future caching before any other work is done
+    'app2.static_pipeline.CompressedStaticMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.user (with the profile) from a per-process cache, see app2.auth_cache
+    'app2.auth_cache.CachedAuthenticationMiddleware',
+    # activates the user's brooder site, see BROODER_SITES
+    'app2.sites.SiteMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # must stay last so the other process_view hooks (csrf) run before it
+    'app2.profiling.ProfilerMiddleware',
 ]
 
+# Request profiler: staff send the X-Profile header or ?profile=1, and
+# PROFILER_SAMPLE_RATE is the percentage of all requests profiled at random
+PROFILER_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILER_SAMPLE_RATE = 0
+PROFILER_KEEP = 200
+
+# Sessions are read from the local cache and written through to the database,
+# so an authenticated page no longer starts with a django_session query
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+# Logged-in users kept per process by app2.auth_cache: entries and seconds.
+# Their invalidation counters live in the default cache, which has to be a
+# shared one (redis, memcached) when more than one process serves requests.
+AUTH_USER_CACHE_SIZE = 1000
+AUTH_USER_CACHE_TIMEOUT = 300
+
+# Notification outbox: channel -> provider class used by `manage.py send_notifications`.
+# Local stand-ins are ConsoleProvider, FileProvider (NOTIFICATION_FILE_PATH) and
+# EmailProvider against a debug SMTP server on EMAIL_HOST:EMAIL_PORT
+NOTIFICATION_PROVIDERS = {
+    'sms': 'app2.notifications.ConsoleProvider',
+    'email': 'app2.notifications.FileProvider',
+}
+NOTIFICATION_FILE_PATH = os.path.join(BASE_DIR, 'notifications.log')
+EMAIL_HOST = 'localhost'
+EMAIL_PORT = 1025
+DEFAULT_FROM_EMAIL = 'Young4ChickS <no-reply@young4chicks.local>'
+
+# Live dashboard events (/live/events/). Serve chicks.asgi with an ASGI server
+# (uvicorn, daphne) for push; under WSGI the browsers poll every RETRY_MS.
+# Use 'app2.live.RedisBackend' with LIVE_EVENTS_REDIS_URL when running more
+# than one worker process.
+LIVE_EVENTS_BACKEND = 'app2.live.LocalBackend'
+LIVE_EVENTS_RETRY_MS = 3000
+LIVE_EVENTS_HEARTBEAT = 15
+LIVE_EVENTS_MAX_AGE = 600
+
+# Closed requests/sales older than this are moved to the archive tables by
+# `manage.py archive_closed_records`
+ARCHIVE_AFTER_DAYS = 365
+
+# Incremental `manage.py backup_snapshot --incremental-from` reaches this many
+# seconds before its base, for rows whose transaction was still open then
+BACKUP_INCREMENTAL_OVERLAP = 300
+
 ROOT_URLCONF = 'chicks.urls'
 
 TEMPLATES = [
@@ -66,7 +135,8 @@ TEMPLATES = [
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         #letting django know where to get the templates
         'DIRS': [os.path.join(BASE_DIR,'app2','templates')],
-        'APP_DIRS': True,
+        # the app directories are searched by the loaders below
+        'APP_DIRS': False,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -74,12 +144,40 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # compiled once per process (runserver's autoreloader resets it when
+            # a template changes), with insignificant whitespace stripped from
+            # the source at compile time, see app2.template_loaders
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'app2.template_loaders.FilesystemLoader',
+                    'app2.template_loaders.AppDirectoriesLoader',
+                ]),
+            ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'chicks.wsgi.application'
 
+# chicks.wsgi/chicks.asgi run app2.warmup.warm_up() when imported, so a new
+# worker's first request does not pay for compiling URLs and templates.
+# `manage.py measure_startup` reports the effect against COLD_START_TARGET_MS.
+WARM_UP_ON_START = True
+COLD_START_TARGET_MS = 50
+
+# app2.compression.ResponseCompressionMiddleware leaves smaller responses as
+# they are: below about a kilobyte compressing saves less than it costs.
+# `manage.py benchmark_templates` reports page sizes and render times.
+RESPONSE_COMPRESSION_MIN_SIZE = 1024
+RESPONSE_COMPRESSION_BROTLI_QUALITY = 5
+
+# Duplicate farmers (app2.dedupe): pairs scoring at least the threshold are
+# candidates. A blocking key shared by more than MAX_BLOCK farmers is sorted
+# by name and each farmer only compared with the WINDOW farmers after it.
+DUPLICATE_FARMER_THRESHOLD = 0.8
+DUPLICATE_FARMER_MAX_BLOCK = 200
+DUPLICATE_FARMER_WINDOW = 20
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -92,6 +190,19 @@ DATABASES = {
 }
 
 
+# Brooder sites: code -> display name and the database alias holding the
+# site's farmers, stock, requests and sales. Staff work at their profile's site
+# and every query is scoped to it. To give a site its own SQLite file add an
+# alias to DATABASES, point the site at it and run `migrate --database=<alias>`.
+BROODER_SITES = {
+    'main': {'name': 'Main Brooder', 'database': 'default'},
+}
+DEFAULT_BROODER_SITE = 'main'
+DATABASE_ROUTERS = ['app2.sites.SiteRouter']
+# threads used by the consolidated cross-site report
+SITE_REPORT_WORKERS = 4
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -16,7 +16,7 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path
-from app2 import views
+from app2 import views, api, live
 
 urlpatterns = [
     
@@ -34,6 +34,8 @@ urlpatterns = [
     path('brooder-manager/manage-stock/', views.manage_stock, name='manage_stock'),
     path('brooder-manager/manage-feed-stock/', views.manage_feed_stock, name='manage_feed_stock'),
     path('brooder-manager/report/', views.brooder_manager_report, name='brooder_manager_report'),
+    path('brooder-manager/stock-valuation/', views.stock_valuation, name='stock_valuation'),
+    path('brooder-manager/sites/', views.sites_report, name='sites_report'),
     # Sales Representative Dashboard
     path('sales-rep/dashboard/', views.sales_rep_dashboard, name='sales_rep_dashboard'),
     path('sales-rep/submit-request/', views.submit_request, name='submit_request'),
@@ -43,6 +45,10 @@ urlpatterns = [
     # CRUD for Farmers
     path('farmers/', views.list_farmers, name='list_farmers'),
     path('farmers/register/', views.register_farmer, name='register_farmer'),
+    path('farmers/deletions/', views.farmer_deletions, name='farmer_deletions'),
+    path('farmers/duplicates/', views.duplicate_farmers, name='duplicate_farmers'),
+    path('farmers/duplicates/<int:pk>/merge/', views.duplicate_merge, name='duplicate_merge'),
+    path('farmers/duplicates/<int:pk>/dismiss/', views.duplicate_dismiss, name='duplicate_dismiss'),
     path('farmers/<int:pk>/', views.farmer_detail, name='farmer_detail'),
     path('farmers/update/<int:pk>/', views.farmer_update, name='farmer_update'),
     path('farmers/delete/<int:pk>/', views.farmer_delete, name='farmer_delete'),
@@ -72,6 +78,20 @@ urlpatterns = [
     path('submit-request/', views.submit_request, name='submit_request'),
     path('process-sales/', views.process_sales, name='process_sales'),
     path('report/', views.sales_rep_report, name='sales_rep_report'),
+
+    # Receivables
+    path('collections/', views.collections, name='collections'),
+
+    # JSON api
+    path('api/sync/', api.sync_batch, name='api_sync_batch'),
+    path('api/<slug:resource>/', api.resource_list, name='api_resource_list'),
+
+    # Live dashboard events (Server-Sent Events)
+    path('live/events/', live.live_events, name='live_events'),
+
+    # Request profiles
+    path('profiles/', views.profile_list, name='profile_list'),
+    path('profiles/<str:filename>/', views.profile_download, name='profile_download'),
     
     
 ]
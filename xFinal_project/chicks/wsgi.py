@@ -9,8 +9,17 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chicks.settings')
 
 application = get_wsgi_application()
+
+# URL patterns, templates, translations, the static manifest and the database
+# are primed before the first request; runs once in the master with a
+# preloading server (gunicorn --preload). See app2.warmup.
+if getattr(settings, 'WARM_UP_ON_START', True):
+    from app2.warmup import warm_up
+
+    warm_up()
@@ -0,0 +1,136 @@
+// Live dashboard updates over Server-Sent Events (see app2/live.py).
+// The page container declares what it wants:
+//   data-live-topics="requests,stock"  data-live-url="/live/events/"
+// and the page is patched in place:
+//   [data-live="pending_count"]          number adjusted by each request event's pending_delta
+//   tbody[data-live-table="Pending"]     holds the rows of requests in that status;
+//                                        rows are added from <template data-live-template="Pending">
+//                                        and removed once the request leaves the status
+//   #live-notices                        short alerts for new requests, sales and stock changes
+(function () {
+    'use strict';
+
+    var root = document.querySelector('[data-live-topics]');
+    if (!root || !window.EventSource) {
+        return;
+    }
+    var notices = document.getElementById('live-notices');
+    var MAX_NOTICES = 5;
+
+    function setText(name, value) {
+        if (value === undefined || value === null) {
+            return;
+        }
+        document.querySelectorAll('[data-live="' + name + '"]').forEach(function (element) {
+            element.textContent = value;
+        });
+    }
+
+    function addTo(name, delta) {
+        if (!delta) {
+            return;
+        }
+        document.querySelectorAll('[data-live="' + name + '"]').forEach(function (element) {
+            element.textContent = Math.max(0, (parseInt(element.textContent, 10) || 0) + delta);
+        });
+    }
+
+    function notify(text, level) {
+        if (!notices) {
+            return;
+        }
+        var alert = document.createElement('div');
+        alert.className = 'alert alert-' + (level || 'info') + ' alert-dismissible fade show py-2';
+        alert.setAttribute('role', 'status');
+        alert.textContent = text;
+        var close = document.createElement('button');
+        close.type = 'button';
+        close.className = 'btn-close';
+        close.setAttribute('data-bs-dismiss', 'alert');
+        close.setAttribute('aria-label', 'Close');
+        alert.appendChild(close);
+        notices.prepend(alert);
+        while (notices.children.length > MAX_NOTICES) {
+            notices.lastElementChild.remove();
+        }
+    }
+
+    function fillRow(row, data) {
+        row.setAttribute('data-live-row', data.id);
+        row.querySelectorAll('[data-field]').forEach(function (element) {
+            element.textContent = data[element.getAttribute('data-field')];
+        });
+        row.querySelectorAll('[data-field-value]').forEach(function (element) {
+            element.value = data[element.getAttribute('data-field-value')];
+        });
+        // links are rendered for pk 0, e.g. /requests/0/
+        row.querySelectorAll('[data-field-href]').forEach(function (element) {
+            var value = encodeURIComponent(data[element.getAttribute('data-field-href')]);
+            element.setAttribute('href', element.getAttribute('href').replace(/\/0\/$/, '/' + value + '/'));
+        });
+    }
+
+    function toggleEmpty(table) {
+        var empty = table.querySelector('[data-live-empty]');
+        if (empty) {
+            empty.hidden = table.querySelector('[data-live-row]') !== null;
+        }
+    }
+
+    // Every table shows the request only while it is in the table's status,
+    // so applying the same event twice (a replay after reconnecting) is harmless.
+    function patchTables(data) {
+        var added = false;
+        document.querySelectorAll('[data-live-table]').forEach(function (table) {
+            var status = table.getAttribute('data-live-table');
+            var row = table.querySelector('[data-live-row="' + data.id + '"]');
+            if (data.status !== status) {
+                if (row) {
+                    row.remove();
+                }
+            } else if (!row) {
+                var template = document.querySelector('template[data-live-template="' + status + '"]');
+                if (template) {
+                    row = template.content.firstElementChild.cloneNode(true);
+                    fillRow(row, data);
+                    table.prepend(row);
+                    added = true;
+                }
+            }
+            toggleEmpty(table);
+        });
+        return added;
+    }
+
+    var handlers = {
+        requests: function (data) {
+            addTo('pending_count', data.pending_delta);
+            var added = patchTables(data);
+            if (data.status === 'Pending' && (added || !document.querySelector('[data-live-table]'))) {
+                notify('New request #' + data.id + ': ' + data.quantity + ' ' + data.chick_type + ' (' + data.chick_breed + ')', 'warning');
+            } else if (data.status === 'Approved' && added) {
+                notify('Request #' + data.id + ' was approved and is ready to process.', 'success');
+            }
+        },
+        sales: function (data) {
+            notify('Sale #' + data.id + ' recorded for ' + data.customer + ': ' + data.quantity + ' chicks.', 'success');
+        },
+        stock: function (data) {
+            setText('chick_batches', data.chick_batches);
+            setText('stock-' + data.kind + '-' + data.id, data.quantity);
+            var change = data.delta > 0 ? '+' + data.delta : String(data.delta);
+            notify('Stock ' + data.label + ': ' + change + (data.quantity === null ? ' (removed)' : ', now ' + data.quantity) + '.', 'secondary');
+        }
+    };
+
+    var source = new EventSource(root.getAttribute('data-live-url') + '?topics=' + encodeURIComponent(root.getAttribute('data-live-topics')));
+    // the server could not replay everything that was missed
+    source.addEventListener('reload', function () {
+        window.location.reload();
+    });
+    Object.keys(handlers).forEach(function (topic) {
+        source.addEventListener(topic, function (event) {
+            handlers[topic](JSON.parse(event.data));
+        });
+    });
+})();